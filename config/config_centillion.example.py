@@ -15,9 +15,12 @@
 #   Testing
 #   Searching
 #   User Interface
+#   HTTP
 #   Github
 #   Google Drive
+#   Groups.io
 #   Disqus
+#   Hypothesis
 #   Flask
 
 
@@ -102,6 +105,100 @@ FAKEDOCS = True
 # index (relative path)
 INDEX_DIR = "search_index"
 
+# Directory for the (few) temporary files centillion
+# needs while indexing, e.g. when falling back to
+# pandoc to convert a document. Leave empty to use
+# the system temporary directory; point it at a
+# tmpfs mount to keep these files off the disk.
+SCRATCH_DIR = ""
+
+# Each source hands its documents to a single index
+# writer through a queue, and the writer commits them
+# to the search index in batches. Number of documents
+# written per commit, and number of documents a source
+# can get ahead of the writer before it has to wait.
+INDEX_BATCH_SIZE = 500
+INDEX_QUEUE_SIZE = 1000
+
+# Bulk indexing: when the search index is empty (a
+# full rebuild), documents are written in bigger
+# batches. With INDEX_BULK_PROCS > 1, their text is
+# analyzed by that many writer processes at once,
+# each with its own memory limit (in MB); the default
+# is a single process, since the extra processes only
+# pay off on a machine with spare CPUs. The processes
+# are spawned (not forked), so a script starting
+# centillion must guard its main code with
+# if __name__=="__main__". With INDEX_BULK_MULTISEGMENT,
+# each process writes its own index segment instead
+# of merging them at every commit, and the segments
+# are merged once at the end of the rebuild. See
+# scripts/bench_bulk_index.py to pick the settings.
+INDEX_BULK_ENABLED = True
+INDEX_BULK_PROCS = 1
+INDEX_BULK_LIMITMB = 256
+INDEX_BULK_MULTISEGMENT = True
+INDEX_BULK_BATCH_SIZE = 10000
+
+# A full rebuild (the "Rebuild Main Index" button) builds
+# a new index next to the live one, and swaps it in
+# once it is complete. Number of old index generations
+# to keep around after a rebuild.
+INDEX_KEEP_GENERATIONS = 1
+
+# Updates of the search index are queued and run one
+# at a time (see /index_status for the queue). Number
+# of finished jobs kept in the queue's history.
+INDEX_JOB_HISTORY = 50
+
+# Update each source of documents on a schedule:
+# seconds between updates of each source (leave a
+# source out to only update it from the control
+# panel). Each interval is stretched by a random
+# jitter of up to INDEX_SCHEDULE_JITTER of it. An
+# update is skipped if the last one is still going,
+# and an overdue update runs right after a restart.
+INDEX_SCHEDULE = {
+    # 'gdocs' : 3600,
+    # 'issues' : 1800,
+    # 'ghfiles' : 6*3600,
+    # 'disqus' : 3600,
+}
+INDEX_SCHEDULE_JITTER = 0.1
+
+
+# HTTP
+# ====
+
+# All crawlers share one HTTP client, which keeps
+# connections to each host alive and reuses them.
+
+# Default request timeout, in seconds
+HTTP_TIMEOUT = 60
+
+# Connection errors and 429/5xx responses are
+# retried this many times, waiting HTTP_BACKOFF,
+# then 2*HTTP_BACKOFF, 4*HTTP_BACKOFF... seconds
+# (or as long as the Retry-After header says)
+HTTP_RETRIES = 3
+HTTP_BACKOFF = 1.0
+
+# Number of connections kept alive per host,
+# and maximum number of concurrent requests
+# to any one host (across all crawler threads)
+HTTP_POOL_SIZE = 16
+HTTP_MAX_PER_HOST = 8
+
+# Github trees and markdown files are cached on disk
+# (in INDEX_DIR/http_cache) with their ETags. When
+# they are requested again, the server only needs to
+# answer "304 Not Modified", which does not count
+# against the Github API rate limit. The least
+# recently used entries are removed when the cache
+# is bigger than HTTP_CACHE_MAX_MB.
+HTTP_CACHE_ENABLED = True
+HTTP_CACHE_MAX_MB = 256
+
 
 # User Interface
 # ==============
@@ -138,6 +235,35 @@ GITHUB_TOKEN = "XXXXX"
 # This is mainly useful for testing.
 TRUNCATE_ISSUES_LISTING = False
 
+# Number of worker threads used to crawl
+# repositories (issues and files) in parallel.
+# Each worker crawls one repository at a time.
+GITHUB_WORKERS = 4
+
+# If at least this many of a repository's changed
+# issues have comments, list the repository's
+# comments at once (100 per page; only the ones
+# updated since the last run, in incremental runs)
+# when that takes fewer API calls than one or more
+# calls per issue. Set to 0 to always fetch
+# comments per issue.
+GITHUB_BULK_COMMENTS_THRESHOLD = 20
+
+# Deleted and transferred issues never show up in
+# the incremental listings of updated issues. At
+# most this many seconds apart, every issue of a
+# repository is listed, to drop the ones that are
+# gone and add any that are missing from the index.
+# Set to 0 to list every issue on every update.
+GITHUB_ISSUES_RECONCILE_INTERVAL = 86400
+
+# Github API requests are paced to stay within the
+# rate limit: when the rate limit is used up, the
+# crawl pauses until it resets, instead of failing.
+# This many requests are left unused in each hour,
+# for other uses of the token.
+GITHUB_RATE_LIMIT_RESERVE = 10
+
 REPOSITORIES = [
         "charlesreid1/centillion-search-demo"
 ]
@@ -160,6 +286,42 @@ GOOGLE_DRIVE_CREDENTIALS_FILE="credentials.json"
 # This is mainly useful for testing.
 TRUNCATE_DRIVE_LISTING = False
 
+# Number of worker threads used to download
+# and convert Google Drive documents in parallel.
+GOOGLE_DRIVE_WORKERS = 8
+
+# If true, only Google Drive files whose modifiedTime
+# has changed since they were last indexed are
+# downloaded and converted again. Set to false to
+# force every file to be re-indexed.
+GOOGLE_DRIVE_INCREMENTAL = True
+
+# If true, only the changes since the last run are
+# fetched from the Google Drive changes feed. The
+# changes page token is saved in INDEX_DIR; the full
+# file listing is only used on the first run or if
+# the saved token is no longer valid.
+GOOGLE_DRIVE_DELTA_SYNC = True
+
+# How to extract the text of Google Drive documents:
+# "python" extracts the text of the exported docx
+# in-process, falling back to pandoc for documents
+# it can't handle; "pandoc" always uses pandoc.
+GOOGLE_DRIVE_DOCX_CONVERTER = "python"
+
+
+# Groups.io
+# =========
+
+GROUPSIO_ENABLED = False
+
+# Groups.io API token
+GROUPSIO_TOKEN = "XXXXX"
+
+# Number of worker threads used to download
+# the archives of subgroups in parallel
+GROUPSIO_WORKERS = 4
+
 
 # Disqus
 # ======
@@ -169,6 +331,44 @@ DISQUS_ENABLED = True
 # Disqus API token
 DISQUS_TOKEN = "XXXXX"
 
+# Number of worker threads used to fetch the
+# posts of Disqus threads in parallel (requests
+# are paced to stay within the Disqus rate limit)
+DISQUS_WORKERS = 4
+
+# If true, the posts of a Disqus thread are only
+# downloaded again if its post count changed or it
+# has new posts since the last run; other threads
+# are left in the search index as they are.
+DISQUS_INCREMENTAL = True
+
+
+# Hypothesis
+# ==========
+
+HYPOTHESIS_ENABLED = False
+
+# Hypothesis API token
+HYPOTHESIS_TOKEN = "XXXXX"
+
+# Annotations on pages with urls matching
+# this (wildcard) pattern are indexed
+HYPOTHESIS_URL_PATTERN = "*pilot.nihdatacommons.us*"
+
+# Commit the annotations to the search index at
+# least every this many annotations (by default,
+# every page of 200 annotations from the API), so
+# an interrupted update keeps what it has indexed.
+# The index pipeline also commits every
+# INDEX_BATCH_SIZE documents (of all sources),
+# whichever comes first, so keep this smaller.
+HYPOTHESIS_BATCH_SIZE = 200
+
+# If true, only annotations updated since the
+# last run are listed. Deleted annotations are
+# only removed from the index by a full listing.
+HYPOTHESIS_INCREMENTAL = True
+
 
 # Flask
 # =====
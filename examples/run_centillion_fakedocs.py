@@ -1,4 +1,5 @@
 import centillion
 
-app = centillion.webapp.get_flask_app(config_file='../config/config_centillion_fakedocs.py')
-app.run()
+if __name__=="__main__":
+    app = centillion.webapp.get_flask_app(config_file='../config/config_centillion_fakedocs.py')
+    app.run()
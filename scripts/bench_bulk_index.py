@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+import os
+import sys
+import time
+import random
+import shutil
+import datetime
+import tempfile
+import multiprocessing
+
+from centillion.search import Search
+from centillion.search.const import DEFAULT_INDEX_BULK_BATCH_SIZE
+
+"""
+Bulk Indexing Benchmark
+
+This script compares the two ways centillion can
+write documents to an empty search index: a plain
+index writer, analyzing all document text in one
+process, and the bulk indexing mode used for full
+rebuilds (see Search.get_bulk_writer_options),
+which spreads the analysis over several writer
+processes.
+
+It indexes the same corpus of synthetic documents
+(100k by default) into a fresh index both ways, with
+the same number of documents per commit (the default
+INDEX_BULK_BATCH_SIZE), so only the writers differ.
+Bulk indexing ends by merging its segments, as a
+rebuild does; the time includes that merge, and the
+segment counts before and after it are reported.
+"""
+
+def usage():
+    msg = """bench_bulk_index.py: centillion bulk indexing benchmark
+
+Compare a plain index writer with the multi-process
+bulk indexing mode, on a synthetic corpus.
+
+Usage:
+
+    scripts/bench_bulk_index.py [<procs> [<number-of-docs> [<limitmb> [<batch-size>]]]]
+
+Examples:
+
+    scripts/bench_bulk_index.py
+
+    scripts/bench_bulk_index.py 8 100000 512 10000
+
+    """
+    print(msg)
+    exit(1)
+
+
+WORDS = """index search engine document analysis running runs
+process processing writer writers segment segments commit
+committed github issue issues comment comments drive file
+files folder markdown email thread threads annotation page
+pages repository repositories organization data commons
+pilot stemming stemmed analyzer token tokens query queries""".split()
+
+
+def make_corpus(n_docs):
+    """Make the records of a synthetic corpus"""
+    random.seed(0)
+    now = datetime.datetime.utcnow()
+    corpus = []
+    for i in range(n_docs):
+        content = " ".join(random.choice(WORDS) for j in range(random.randint(20,300)))
+        corpus.append(dict(
+            id = 'synthetic-%06d'%(i),
+            kind = 'gdoc',
+            created_time = now,
+            modified_time = now,
+            indexed_time = now,
+            title = 'Synthetic document %d'%(i),
+            url = 'https://example.com/doc/%d'%(i),
+            mimetype = 'text/plain',
+            owner_email = 'ada@example.com',
+            owner_name = 'Ada Lovelace',
+            content = content
+        ))
+    return corpus
+
+
+def bench(label, corpus, batch_size, bulk_config=None):
+    """Index the corpus into a fresh index, batch_size records per commit"""
+    tmp = tempfile.mkdtemp()
+    try:
+        search = Search(os.path.join(tmp, 'search_index'))
+        writer_options = {}
+        if bulk_config is not None:
+            writer_options = search.get_bulk_writer_options(bulk_config)
+        start = time.time()
+        for i in range(0, len(corpus), batch_size):
+            search.commit_records(corpus[i:i+batch_size], **writer_options)
+        segments = len(search.ix._segments())
+        search.merge_bulk_segments(writer_options)
+        elapsed = time.time() - start
+
+        count = search.ix.doc_count()
+        merged = len(search.ix._segments())
+    finally:
+        shutil.rmtree(tmp)
+
+    print("%-12s %7d docs  %8.1f s  %8.1f docs/sec  %d segments (%d after merge)"%(label, count, elapsed, count/max(elapsed,1e-6), segments, merged))
+    return elapsed
+
+
+def doit(procs=None, n_docs=100000, limitmb=256, batch_size=DEFAULT_INDEX_BULK_BATCH_SIZE):
+    if procs is None:
+        procs = multiprocessing.cpu_count()
+
+    corpus = make_corpus(n_docs)
+    print("Corpus: %d synthetic documents, %d CPUs, %d documents per commit"%(len(corpus), multiprocessing.cpu_count(), batch_size))
+
+    plain_time = bench('plain', corpus, batch_size)
+
+    config = dict(INDEX_BULK_PROCS=procs, INDEX_BULK_LIMITMB=limitmb)
+    bulk_time = bench('bulk (%d)'%(procs), corpus, batch_size, config)
+
+    print("Speedup: %0.1fx"%(plain_time/max(bulk_time,1e-6)))
+
+
+if __name__=="__main__":
+    args = sys.argv[1:]
+    if len(args)>4 or any(a in ['-h','--help'] for a in args):
+        usage()
+    try:
+        args = [int(a) for a in args]
+    except ValueError:
+        usage()
+    doit(*args)
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+import os, io
+import sys
+import time
+import random
+import zipfile
+
+from centillion.search.docx_util import docx_to_text, pandoc_docx_to_text, DocxException
+
+"""
+docx Extraction Benchmark
+
+This script compares the two ways centillion can
+extract the text of a Google Drive document (docx):
+the in-process extractor (docx_to_text) and pandoc
+(pandoc_docx_to_text).
+
+It runs both on every .docx file in a directory,
+or, if no directory is given, on a corpus of
+synthetic docx files of various sizes.
+"""
+
+def usage():
+    msg = """bench_docx_extract.py: centillion docx extraction benchmark
+
+Compare in-process docx text extraction with pandoc.
+
+Usage:
+
+    scripts/bench_docx_extract.py [<directory-of-docx-files>]
+
+Examples:
+
+    scripts/bench_docx_extract.py
+
+    scripts/bench_docx_extract.py ~/Downloads/gdocs/
+
+    """
+    print(msg)
+    exit(1)
+
+
+WORDS = """the quick brown fox jumps over the lazy dog while
+the rain in spain falls mainly on the plain and all
+the kings horses and all the kings men""".split()
+
+DOCUMENT_XML = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>%s</w:body></w:document>"""
+
+CONTENT_TYPES_XML = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>
+</Types>"""
+
+RELS_XML = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/>
+</Relationships>"""
+
+
+def make_docx(n_paragraphs):
+    """Make the bytes of a synthetic docx file"""
+    paragraphs = []
+    for i in range(n_paragraphs):
+        text = " ".join(random.choice(WORDS) for j in range(random.randint(5,80)))
+        paragraphs.append('<w:p><w:r><w:t xml:space="preserve">%s</w:t></w:r></w:p>'%(text))
+
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr('[Content_Types].xml', CONTENT_TYPES_XML)
+        z.writestr('_rels/.rels', RELS_XML)
+        z.writestr('word/document.xml', DOCUMENT_XML%("".join(paragraphs)))
+    return buf.getvalue()
+
+
+def load_corpus(corpus_dir):
+    """Load every docx file in a directory, or make a synthetic corpus"""
+    if corpus_dir is None:
+        random.seed(0)
+        sizes = [5]*20 + [50]*20 + [500]*8 + [5000]*2
+        return [('synthetic-%02d-%d'%(i,n), make_docx(n)) for i,n in enumerate(sizes)]
+
+    corpus = []
+    for name in sorted(os.listdir(corpus_dir)):
+        if name.endswith('.docx'):
+            with open(os.path.join(corpus_dir,name),'rb') as f:
+                corpus.append((name, f.read()))
+    return corpus
+
+
+def bench(label, corpus, convert):
+    """Time convert() on every document in the corpus"""
+    failures = 0
+    start = time.time()
+    for name, data in corpus:
+        try:
+            convert(name, data)
+        except DocxException:
+            failures += 1
+    elapsed = time.time() - start
+    print("%-12s %4d docs  %8.3f s  %8.1f docs/sec  %d failures"%(label, len(corpus), elapsed, len(corpus)/max(elapsed,1e-6), failures))
+    if failures==len(corpus):
+        return None
+    return elapsed
+
+
+def doit(corpus_dir=None):
+    corpus = load_corpus(corpus_dir)
+    if len(corpus)==0:
+        print("No docx files found in %s"%(corpus_dir))
+        exit(1)
+
+    total_bytes = sum(len(data) for name, data in corpus)
+    print("Corpus: %d docx files, %0.1f MB"%(len(corpus), total_bytes/1.0e6))
+
+    python_time = bench('python', corpus, lambda name, data: docx_to_text(data))
+
+    pandoc_time = bench('pandoc', corpus, lambda name, data: pandoc_docx_to_text(data))
+
+    if pandoc_time is None:
+        print("Every pandoc conversion failed (is pandoc installed?), no speedup to report")
+    else:
+        print("Speedup: %0.1fx"%(pandoc_time/max(python_time,1e-6)))
+
+
+if __name__=="__main__":
+    if len(sys.argv)==1:
+        doit()
+    elif len(sys.argv)==2 and sys.argv[1] not in ['-h','--help']:
+        doit(sys.argv[1])
+    else:
+        usage()
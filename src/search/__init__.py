@@ -1,12 +1,32 @@
-from .const import base
+from .const import base, DEFAULT_GOOGLE_DRIVE_WORKERS, DEFAULT_GITHUB_WORKERS, DEFAULT_GITHUB_BULK_COMMENTS_THRESHOLD, \
+        DEFAULT_GITHUB_ISSUES_RECONCILE_INTERVAL, DEFAULT_HTTP_CACHE_MAX_MB, DEFAULT_DISQUS_WORKERS, DEFAULT_GROUPSIO_WORKERS, \
+        DEFAULT_HYPOTHESIS_URL_PATTERN, DEFAULT_HYPOTHESIS_BATCH_SIZE, DEFAULT_INDEX_BATCH_SIZE, DEFAULT_INDEX_QUEUE_SIZE, \
+        DEFAULT_INDEX_BULK_PROCS, DEFAULT_INDEX_BULK_LIMITMB, DEFAULT_INDEX_BULK_BATCH_SIZE, DEFAULT_INDEX_KEEP_GENERATIONS
 
 from .gdrive_util import GDrive
+from .sync_state import SyncState
+from .docx_util import docx_to_text, pandoc_docx_to_text, DocxException
 from .disqus_util import DisqusCrawler
-
-import os, re, io, requests
+from .groupsio_util import get_all_subgroups, get_short_subgroup_name, message_permalink, \
+        crawl_subgroup
+from .hypothesis_util import iter_annotation_pages
+from .bulk_writer import open_writer
+from .pipeline import Connector, IndexPipeline, IndexCancelled, Drop, Checkpoint, iter_completed
+from .generations import get_current_generation, new_generation, set_current_generation, \
+        remove_generation, collect_generations
+from .http_client import get_http_client, configure_http_client, GITHUB_API
+from .rate_limit import get_rate_limiter
+from .http_cache import HttpCache
+
+import os, re, io
 import os.path
 import logging
+import threading
 import json
+import time
+import math
+
+from concurrent.futures import ThreadPoolExecutor
 
 import dateutil.parser
 import datetime
@@ -20,13 +40,12 @@ from github import Github, GithubException
 import base64
 
 from apiclient.http import MediaIoBaseDownload
+from apiclient.errors import HttpError
 
 import mistune
 from whoosh.fields import *
 import whoosh.index as index
-import tempfile, subprocess
-import pypandoc
-import codecs
+import tempfile
 
 from whoosh.query import Variations
 from whoosh.qparser import MultifieldParser, QueryParser
@@ -43,39 +62,87 @@ Define a Search object for use by the centillion search engine.
 
 Auth notes:
     - Google drive/Google oauth requires credentials.json
-    - Github, Disqus require API tokens passed in 
+    - Github, Groups.io, Disqus, Hypothesis require API tokens passed in 
       via centillion config file (available through Flask app.config)
 
 Utility functions:
     - clean_timestamp (for cleanup of timestamps)
+    - utc_timestamp (for comparison of timestamps)
+    - ghfile_id (search index id of a github file)
+    - ignore_ghfile_path (github files that are not indexed)
     - is_url (for cleanup of results)
     - SearchResult (simple class representing results)
     - DontEscapeHtmlInCodeRenderer (used to render markdown as html)
+    - get_shared_search (process-wide Search object for the live index generation, for the webapp)
 
 Search class:
 
     create:
 
     - open_index (create new schema, open index on disk)
+    - is_open_at (whether the index folder is still the one that was opened)
 
     populate:
 
+    - add_record (write a document record built by one of the make_*_record methods)
     - add_drive_file (add an individual google drive file item)
+    - make_drive_record (download/convert a google drive file item, safe to call from worker threads)
     - add_issue (add an individual github issue item)
+    - make_issue_record (fetch comments for a github issue item and build its record)
     - add_ghfile (add an individual github file item)
+    - make_ghfile_record (download a github file item if it is markdown, and build its record)
+    - add_emailthread (add groups.io email thread)
+    - make_emailthread_record (build the record for a groups.io email thread)
+    - add_annotation (add hypothesis annotation)
+    - make_annotation_record (build the record for a hypothesis annotation)
+    - commit_records (write a batch of records, and drop ids, in one commit)
+    - run_pipeline (write the records of one or more source connectors to the index in batches, see pipeline.py)
+    - get_bulk_writer_options (index writer options for bulk indexing an empty index, multiple processes)
+    - merge_bulk_segments (merge the segments written by a multisegment bulk run into one)
     - add_disqusthread (add disqus comments thread)
+    - make_disqusthread_record (build the record for a disqus comments thread)
 
     update:
 
-    - update_index (update entire search index)
-    - update_index_gdocs (iterate over all Google Drive documents and add them)
-    - update_index_issues (iterate over all Github issues and add them)
-    - update_index_ghfiles (iterate over all github files and add them)
-    - update_index_disqus (iterate over all disqus comment threads and add them)
+    - update_index (update entire search index, running the enabled sources concurrently)
+    - rebuild_index (rebuild entire search index in a new generation, and swap it in when complete)
+    - open_shadow_index (create a new, empty index generation for a rebuild)
+    - discard_shadow_index (remove the generation of a failed rebuild)
+    - swap_index (make a rebuilt generation the live index, and remove old generations)
+    - update_index_gdocs (iterate over all new/changed Google Drive documents and add them)
+    - gdocs_connector (source connector for Google Drive, also run by update_index)
+    - iter_gdocs_items (source connector items for update_index_gdocs)
+    - get_scratch_dir (directory for temporary files)
+    - list_drive_files (full listing of Google Drive files)
+    - list_drive_changes (Google Drive changes since the last sync)
+    - update_index_issues (iterate over all Github issues updated since the last run and add them)
+    - issues_connector (source connector for Github issues, also run by update_index)
+    - iter_issue_items (source connector items for update_index_issues)
+    - crawl_repo_issues (list the changed issues of one github repo and build their records, run in worker threads)
+    - list_repo_comments (list all the issue comments of a github repo at once, grouped by issue)
+    - log_repo_timings (log the slowest repos of a github crawl)
+    - get_repo (get a Github repository object, for an org or a user)
+    - wait_for_github (pace Github API requests to stay within the rate limit)
+    - update_index_ghfiles (iterate over all github files, add new ones and drop ones that are gone)
+    - ghfiles_connector (source connector for Github files, also run by update_index)
+    - iter_ghfile_items (source connector items for update_index_ghfiles)
+    - crawl_repo_files (list the new files of one github repo, skipping unchanged trees, and build their records, run in worker threads)
+    - get_tree_data (get a github tree, through the http cache if there is one)
+    - get_http_cache (the on-disk http response cache, if enabled)
+    - update_index_emailthreads (download groups.io subgroup archives in parallel and add the new messages)
+    - emailthreads_connector (source connector for groups.io email threads, also run by update_index)
+    - iter_emailthread_items (source connector items for update_index_emailthreads)
+    - update_index_annotations (page through hypothesis annotations updated since the last run and add them in batches)
+    - annotations_connector (source connector for hypothesis annotations, also run by update_index)
+    - iter_annotation_items (source connector items for update_index_annotations)
+    - update_index_disqus (iterate over all disqus comment threads and add the new/changed ones)
+    - disqus_connector (source connector for disqus comment threads, also run by update_index)
+    - iter_disqus_items (source connector items for update_index_disqus)
 
     test update:
 
     - test_update_index (called by update_index if testing)
+    - test_rebuild_index (rebuild the index with fake docs, like rebuild_index)
     - test_update_index_gdocs (test harness for update_index_gdocs calls; if fake docs is enabled, this will populate index with fake docs)
     - test_update_index_issues (see above)
     - test_update_index_ghfiles (see above)
@@ -84,9 +151,12 @@ Search class:
     search:
 
     - search (perform a search on the search index with the user's query)
+    - shared_searcher (searcher shared by all threads and reused between searches, refreshed when the index changes)
+    - close_searcher (close the shared searcher)
 
     util:
 
+    - read_search_hits (read the fields and highlights of search hits, while holding the searcher)
     - create_search_results (package search results for the Flask template)
     - get_document_total_count (ask centillion for count of documents of each type)
     - get_list (get a listing of all files of a particular type)
@@ -114,10 +184,66 @@ Schema:
 
 here = os.path.abspath(os.path.dirname(__file__))
 
+# Google Drive file fields used to build index records
+GDRIVE_FILE_FIELDS = "id, kind, createdTime, modifiedTime, mimeType, name, owners, webViewLink"
+
+# Names of the sync state files
+GDRIVE_SYNC_STATE = "gdrive_sync"
+GITHUB_ISSUES_SYNC_STATE = "github_issues_sync"
+GITHUB_FILES_SYNC_STATE = "github_files_sync"
+GROUPSIO_SYNC_STATE = "groupsio_sync"
+HYPOTHESIS_SYNC_STATE = "hypothesis_sync"
+DISQUS_SYNC_STATE = "disqus_sync"
+
+# Directory (in INDEX_DIR, shared by all index
+# generations) of the HTTP response cache
+HTTP_CACHE_DIR = "http_cache"
+
+# Github files with these extensions are
+# downloaded and indexed as markdown
+GITHUB_MARKDOWN_EXTS = ['.md','.markdown']
+
 
 def clean_timestamp(dt):
     return dt.replace(microsecond=0).isoformat()
 
+def utc_timestamp(dt):
+    """
+    Convert a (possibly timezone-aware) datetime
+    to a naive UTC datetime, so that timestamps
+    from the APIs and from the search index can
+    be compared.
+    """
+    if dt is None:
+        return None
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(pytz.utc).replace(tzinfo=None)
+    return dt
+
+def ghfile_id(d):
+    """
+    Get the search index id of a Github file
+    (an entry of a git tree): the blob sha for
+    markdown files, the file name and the sha
+    for everything else.
+    """
+    _, fname = os.path.split(d['path'])
+    _, fext = os.path.splitext(fname)
+    if fext in GITHUB_MARKDOWN_EXTS:
+        return d['sha']
+    return fname+"_"+d['sha']
+
+def ignore_ghfile_path(fpath):
+    """
+    Github files (or directories) whose name or
+    path has a piece starting with . or _ are
+    not indexed.
+    """
+    for piece in fpath.split('/'):
+        if piece[0]=='.' or piece[0]=='_':
+            return True
+    return False
+
 def is_url(u):
     if '...' in u:
         # special case of whoosh messing up urls
@@ -132,6 +258,65 @@ def is_url(u):
         return True
     return False
 
+# Search objects shared by get_shared_search,
+# by index folder
+shared_searches = {}
+shared_searches_lock = threading.Lock()
+
+def get_shared_search(index_folder):
+    """
+    Return the process-wide Search object for the
+    index in index_folder (INDEX_DIR), so the index is
+    not opened again for every request, and searchers
+    are reused (see Search.shared_searcher). A new Search
+    object is opened when a rebuild has made another
+    generation of the index live (or the index folder
+    was removed and created again).
+    """
+    generation = get_current_generation(index_folder)
+    folder = index_folder
+    if generation is not None:
+        folder = os.path.join(index_folder, generation)
+    old_search = None
+    with shared_searches_lock:
+        search = shared_searches.get(index_folder)
+        if search is None or search.generation != generation or not search.is_open_at(folder):
+            old_search = search
+            search = Search(index_folder, generation=generation)
+            shared_searches[index_folder] = search
+    if old_search is not None:
+        old_search.close_searcher()
+    return search
+
+
+class SharedSearcher(object):
+    """
+    Context manager returned by Search.shared_searcher:
+    holds the Search object's searcher lock, and opens
+    (or refreshes) its searcher, while in use.
+    """
+    def __init__(self, search):
+        self.search = search
+
+    def __enter__(self):
+        search = self.search
+        search.searcher_lock.acquire()
+        try:
+            if search.searcher is None:
+                search.searcher = search.ix.searcher()
+            elif not search.searcher.up_to_date():
+                # Reuses the readers of the segments that
+                # did not change, and closes the old searcher
+                search.searcher = search.searcher.refresh()
+        except Exception:
+            search.searcher_lock.release()
+            raise
+        return search.searcher
+
+    def __exit__(self, *exc_info):
+        self.search.searcher_lock.release()
+        return False
+
 class SearchResult:
     score = 1.0
     path = None
@@ -157,60 +342,197 @@ class DontEscapeHtmlInCodeRenderer(mistune.Renderer):
 class Search:
     ix = None
     index_folder = None
+    root_folder = None
     markdown = mistune.Markdown(renderer=DontEscapeHtmlInCodeRenderer(), escape=False)
     schema = None
 
-    def __init__(self, index_folder):
+    def __init__(self, index_folder, generation=None):
+        """
+        Open the search index in index_folder (INDEX_DIR):
+        the live generation of the index, or the given
+        generation (see generations.py).
+        """
+        self.root_folder = index_folder
+        if generation is None:
+            generation = get_current_generation(index_folder)
+        self.generation = generation
+        if generation is not None:
+            index_folder = os.path.join(index_folder, generation)
         self.open_index(index_folder)
 
+        # Searcher shared by all threads (see shared_searcher)
+        self.searcher = None
+        self.searcher_lock = threading.RLock()
+
 
     # ------------------------------
     # Update the entire index
 
-    def update_index(self, gdrive_token_path, gh_token, disqus_token, run_which, config):
+    def update_index(self, gdrive_token_path, gh_token, disqus_token, run_which, config, groupsio_token='', hypothesis_token='', cancel=None):
         """
         Update the entire search index
+
+        The enabled sources are fetched concurrently,
+        each with its own workers, and their records
+        are written by a single index writer (see
+        run_pipeline). The time each source took is
+        logged at the end.
+
+        cancel is a threading.Event; setting it stops
+        the update (see IndexPipeline), which raises
+        IndexCancelled.
+
+        Returns the names of the sources that failed.
         """
+        configure_http_client(config)
+
+        # Connectors of the enabled sources
+        # (see pipeline.py), and the names
+        # used for them in error messages
+        connectors = []
+
         # Google Drive Files
         if run_which=='all' or run_which=='gdocs':
             if config['GOOGLE_DRIVE_ENABLED']:
-                try:
-                    self.update_index_gdocs(gdrive_token_path,config)
-                except Exception as e:
-                    msg = "ERROR: While re-indexing: failed to update Google Drive. Continuing..."
-                    logging.exception(msg)
-                    pass
+                connectors.append(("Google Drive", self.gdocs_connector(gdrive_token_path, config)))
 
         # Github files
         if run_which=='all' or run_which=='ghfiles':
             if config['GITHUB_ENABLED']:
-                try:
-                    self.update_index_ghfiles(gh_token,config)
-                except Exception as e:
-                    msg = "ERROR: While re-indexing: failed to update Github files. Continuing..."
-                    logging.exception(msg)
-                    pass
+                connectors.append(("Github files", self.ghfiles_connector(gh_token, config)))
 
         # Github issues
         if run_which=='all' or run_which=='issues':
             if config['GITHUB_ENABLED']:
-                try:
-                    self.update_index_issues(gh_token,config)
-                except Exception as e:
-                    msg = "ERROR: While re-indexing: failed to update Github issues. Continuing..."
-                    logging.exception(msg)
-                    pass
+                connectors.append(("Github issues", self.issues_connector(gh_token, config)))
+
+        # Groups.io email threads
+        if run_which=='all' or run_which=='emailthreads':
+            if config.get('GROUPSIO_ENABLED', False):
+                connectors.append(("Groups.io email threads", self.emailthreads_connector(groupsio_token, config)))
 
         # Disqus
         if run_which=='all' or run_which=='disqus':
             if config['DISQUS_ENABLED']:
-                try:
-                    self.update_index_disqus(disqus_token, config)
-                except Exception as e:
-                    msg = "ERROR: While re-indexing: failed to update Disqus comment threads. Continuing..."
-                    logging.exception(msg)
-                    pass
+                connectors.append(("Disqus comment threads", self.disqus_connector(disqus_token, config)))
+
+        # Hypothesis annotations
+        if run_which=='all' or run_which=='annotations':
+            if config.get('HYPOTHESIS_ENABLED', False):
+                connectors.append(("Hypothesis annotations", self.annotations_connector(hypothesis_token, config)))
+
+        if len(connectors)==0:
+            return []
+
+        # Fetch from all the sources at once,
+        # through a single index writer. A source
+        # that fails does not stop the others.
+        pipeline = self.run_pipeline([c for name, c in connectors], config, cancel=cancel)
+
+        failed = []
+        for name, connector in connectors:
+            if connector.error is not None:
+                msg = "ERROR: While re-indexing: failed to update %s. Continuing..."%(name)
+                logging.error(msg, exc_info=connector.error)
+                failed.append(name)
+
+        timings = ", ".join("%s %0.1f s"%(c.name, c.elapsed) for name, c in connectors)
+        msg = "centillion.search: Done, updated the index in %0.1f s (%s)"%(pipeline.elapsed, timings)
+        logging.info(msg)
+        return failed
+
+
+
+    # ------------------------------
+    # Rebuild the entire index
+
+    def rebuild_index(self, gdrive_token_path, gh_token, disqus_token, config, groupsio_token='', hypothesis_token='', cancel=None):
+        """
+        Rebuild the entire search index from scratch,
+        in a new generation next to the live index,
+        and swap it in once it is complete.
+
+        If any source fails, or the rebuild is
+        cancelled (see update_index), the new
+        generation is thrown away and the live
+        index is kept.
 
+        Returns True if the new index was swapped in.
+        """
+        shadow = self.open_shadow_index()
+        try:
+            failed = shadow.update_index(gdrive_token_path, gh_token, disqus_token, 'all', config,
+                                         groupsio_token=groupsio_token,
+                                         hypothesis_token=hypothesis_token,
+                                         cancel=cancel)
+        except:
+            self.discard_shadow_index(shadow)
+            raise
+
+        if len(failed) > 0:
+            msg = "ERROR: While rebuilding: failed to update %s. Keeping the current index."%(", ".join(failed))
+            logging.error(msg)
+            self.discard_shadow_index(shadow)
+            return False
+
+        self.swap_index(shadow, config)
+        return True
+
+
+    def test_rebuild_index(self, config):
+        """
+        Rebuild the entire search index using
+        fake documents (see rebuild_index).
+        """
+        shadow = self.open_shadow_index()
+        try:
+            shadow.test_update_index('all', config)
+        except:
+            self.discard_shadow_index(shadow)
+            raise
+        self.swap_index(shadow, config)
+        return True
+
+
+    def open_shadow_index(self):
+        """
+        Create a new, empty generation of the index
+        (with its own, empty sync state), and return
+        a Search object that writes to it.
+        """
+        generation = new_generation(self.root_folder)
+        msg = "centillion.search: Rebuilding the index in %s"%(generation)
+        logging.info(msg)
+        return Search(self.root_folder, generation=generation)
+
+
+    def discard_shadow_index(self, shadow):
+        """
+        Remove the generation of a failed rebuild.
+        """
+        shadow.ix.close()
+        remove_generation(self.root_folder, os.path.basename(shadow.index_folder))
+
+
+    def swap_index(self, shadow, config):
+        """
+        Make the generation of a completed rebuild
+        the live index (by replacing the pointer file),
+        switch this Search object over to it, and remove
+        old generations (keeping INDEX_KEEP_GENERATIONS).
+        """
+        generation = os.path.basename(shadow.index_folder)
+        set_current_generation(self.root_folder, generation)
+        msg = "centillion.search: Index generation %s is live"%(generation)
+        logging.info(msg)
+
+        self.ix = shadow.ix
+        self.index_folder = shadow.index_folder
+        self.index_folder_stat = shadow.index_folder_stat
+        self.generation = generation
+        self.close_searcher()
+        collect_generations(self.root_folder,
+                            keep=config.get('INDEX_KEEP_GENERATIONS', DEFAULT_INDEX_KEEP_GENERATIONS))
 
 
     def test_update_index(self, run_which, config):
@@ -308,6 +630,21 @@ class Search:
             self.ix = index.create_in(index_folder, schema)
         else:
             self.ix = index.open_dir(index_folder)
+        self.index_folder_stat = os.stat(index_folder)
+
+
+    def is_open_at(self, index_folder):
+        """
+        Whether this Search object has the index in
+        index_folder open (the same directory, not one
+        that was removed and created again since).
+        """
+        try:
+            st = os.stat(index_folder)
+        except OSError:
+            return False
+        opened = self.index_folder_stat
+        return (st.st_dev, st.st_ino) == (opened.st_dev, opened.st_ino)
 
 
     # ------------------------------
@@ -315,11 +652,59 @@ class Search:
     # Define how to add documents
 
 
-    def add_drive_file(self, writer, item, temp_dir, config, update=False):
+    def add_record(self, writer, record, update=False, searcher=None):
+        """
+        Write a document record (a dictionary of
+        schema fields) to the search index.
+
+        With update, the indexed document with the
+        same id (if any) is replaced; searcher is a
+        searcher of the writer to look it up with
+        (opening one per record is slow).
+
+        Records are built by the make_*_record methods,
+        which may run in worker threads; this method
+        must only be called by the thread that owns
+        the writer.
+        """
+        if update:
+            writer.delete_by_term('id',record['id'],searcher=searcher)
+        try:
+            writer.add_document(**record)
+        except ValueError:
+            err = " > XXXXXX Failed to index %s document \"%s\""%(record['kind'], record['title'])
+            logging.exception(err)
+
+
+    def add_drive_file(self, writer, item, scratch_dir, config, update=False):
         """
         Add a Google Drive document/file to a search index.
         If it is a document, extract the contents.
         """
+        record = self.make_drive_record(item, scratch_dir, config)
+        if update:
+            logging.info(" > Removing old record")
+        else:
+            logging.info(" > Creating a new record")
+        self.add_record(writer, record, update=True)
+
+
+    def make_drive_record(self, item, scratch_dir, config):
+        """
+        Build the search index record for a Google Drive
+        document/file. If it is a document, download it
+        and extract the contents.
+
+        Documents are converted from memory; scratch_dir
+        is only used if the pandoc fallback needs a
+        temporary file.
+
+        Raises an exception if the document could not
+        be exported or its text extracted.
+
+        This does not touch the search index, so it is
+        safe to call from worker threads.
+        """
 
         # There are two kinds of documents:
         # - documents with text that can be extracted (docx)
@@ -337,36 +722,6 @@ class Search:
             msg = "Indexing Google Drive file \"%s\" of type %s"%(item['name'], mimetype)
             logging.info(msg)
 
-            writer.delete_by_term('id',item['id'])
-
-            # Index a plain google drive file
-            created_time = dateutil.parser.parse(item['createdTime'])
-            modified_time = dateutil.parser.parse(item['modifiedTime'])
-            indexed_time = datetime.datetime.now().replace(microsecond=0)
-            try:
-                writer.add_document(
-                        id = item['id'],
-                        kind = 'gdoc',
-                        created_time = created_time,
-                        modified_time = modified_time,
-                        indexed_time = indexed_time,
-                        title = item['name'],
-                        url = item['webViewLink'],
-                        mimetype = mimetype,
-                        owner_email = item['owners'][0]['emailAddress'],
-                        owner_name = item['owners'][0]['displayName'],
-                        group='',
-                        repo_name='',
-                        repo_url='',
-                        github_user='',
-                        issue_title='',
-                        issue_url='',
-                        content = content
-                )
-            except ValueError:
-                err = " > XXXXXX Failed to index Google Drive file \"%s\""%(item['name'])
-                logging.exception(err)
-
         else:
             # Document with text
             # Perform content extraction
@@ -388,98 +743,56 @@ class Search:
             file_ext = mimemap[mimetype]
             file_url = "https://docs.google.com/document/d/%s/export?format=%s"%(item['id'], file_ext)
 
-            # This re could probablybe improved
-            name = re.sub('/','_',item['name'])
-
-            # Now make the pandoc input/output filenames
-            out_ext = 'txt'
-            pandoc_fmt = 'plain'
-            if name.endswith(file_ext):
-                infile_name = name
-                outfile_name = re.sub(file_ext,out_ext,infile_name)
-            else:
-                infile_name  = name+'.'+file_ext
-                outfile_name = name+'.'+out_ext
-
-
-            # Assemble input/output file paths
-            fullpath_input = os.path.join(temp_dir,infile_name)
-            fullpath_output = os.path.join(temp_dir,outfile_name)
-
-            # Use requests.get to download url to file
-            r = requests.get(file_url, allow_redirects=True)
-            with open(fullpath_input, 'wb') as f:
-                f.write(r.content)
-
-            # Try to convert docx file to plain text
-            try:
-                output = pypandoc.convert_file(fullpath_input,
-                                               pandoc_fmt,
-                                               format='docx',
-                                               outputfile=fullpath_output
-                )
-                assert output == ""
-            except RuntimeError:
-                err = " > XXXXXX Failed to index Google Drive document \"%s\""%(item['name'])
-                logging.exception(err)
-
-
-            # If export was successful, read contents of markdown
-            # into the content variable.
-            if os.path.isfile(fullpath_output):
-                # Export was successful
-                with codecs.open(fullpath_output, encoding='utf-8') as f:
-                    content = f.read()
-
-
-            # No matter what happens, clean up.
-            msg = " > Cleaning up \"%s\""%item['name']
-            logging.info(msg)
-
-            ## test
-            msg = " ".join(['rm','-fr',fullpath_output])
-            logging.info(msg)
-
-            msg = " ".join(['rm','-fr',fullpath_input])
-            logging.info(msg)
-
-            # do it
-            subprocess.call(['rm','-fr',fullpath_output])
-            subprocess.call(['rm','-fr',fullpath_input])
-
-            if update:
-                logging.info(" > Removing old record")
-                writer.delete_by_term('id',item['id'])
-            else:
-                logging.info(" > Creating a new record")
-
-            try:
-                created_time = dateutil.parser.parse(item['createdTime'])
-                modified_time = dateutil.parser.parse(item['modifiedTime'])
-                indexed_time = datetime.datetime.now()
-                writer.add_document(
-                        id = item['id'],
-                        kind = 'gdoc',
-                        created_time = created_time,
-                        modified_time = modified_time,
-                        indexed_time = indexed_time,
-                        title = item['name'],
-                        url = item['webViewLink'],
-                        mimetype = mimetype,
-                        owner_email = item['owners'][0]['emailAddress'],
-                        owner_name = item['owners'][0]['displayName'],
-                        group='',
-                        repo_name='',
-                        repo_url='',
-                        github_user='',
-                        issue_title='',
-                        issue_url='',
-                        content = content
-                )
-            except ValueError:
-                msg = " > XXXXXX Failed to index Google Drive file \"%s\""%(item['name'])
-                logging.exception(msg)
+            # Download url with the shared HTTP client;
+            # the export stays in memory. A failed export
+            # raises, so the document is not indexed blank
+            # (and is retried on the next run).
+            r = get_http_client().get(file_url, allow_redirects=True)
+            r.raise_for_status()
+
+            # Try to extract the text in-process first;
+            # fall back to pandoc for anything the
+            # fast path can't handle.
+            converter = config.get('GOOGLE_DRIVE_DOCX_CONVERTER', 'python')
+            extracted = False
+            if converter == 'python':
+                try:
+                    content = docx_to_text(r.content)
+                    extracted = True
+                except DocxException:
+                    err = " > Could not extract text from \"%s\" in-process, falling back to pandoc"%(item['name'])
+                    logging.warning(err)
 
+            if not extracted:
+                try:
+                    content = pandoc_docx_to_text(r.content, scratch_dir)
+                except DocxException:
+                    err = " > XXXXXX Failed to index Google Drive document \"%s\""%(item['name'])
+                    logging.error(err)
+                    raise
+
+        created_time = dateutil.parser.parse(item['createdTime'])
+        modified_time = dateutil.parser.parse(item['modifiedTime'])
+        indexed_time = datetime.datetime.now().replace(microsecond=0)
+        return dict(
+                id = item['id'],
+                kind = 'gdoc',
+                created_time = created_time,
+                modified_time = modified_time,
+                indexed_time = indexed_time,
+                title = item['name'],
+                url = item['webViewLink'],
+                mimetype = mimetype,
+                owner_email = item['owners'][0]['emailAddress'],
+                owner_name = item['owners'][0]['displayName'],
+                group='',
+                repo_name='',
+                repo_url='',
+                github_user='',
+                issue_title='',
+                issue_url='',
+                content = content
+        )
 
 
 
@@ -492,6 +805,26 @@ class Search:
         """
         Add a Github issue/comment to a search index.
         """
+        record = self.make_issue_record(issue)
+        self.add_record(writer, record, update=update)
+
+
+    def make_issue_record(self, issue, comments=None):
+        """
+        Build the search index record for a Github issue
+        and its comments (one record per issue thread,
+        containing the entire text of the thread).
+
+        comments is the list of the issue's comments,
+        if they have already been fetched (see
+        list_repo_comments); otherwise they are
+        fetched from the issue.
+        """
+        if issue is None:
+            err = "ERROR: Github issue passed to add_issue() was None!"
+            logging.exception(err)
+            raise Exception(err)
+
         repo = issue.repository
         repo_name = repo.owner.login+"/"+repo.name
         repo_url = repo.html_url
@@ -499,11 +832,6 @@ class Search:
         msg = "Indexing issue %s"%(issue.html_url)
         logging.info(msg)
         
-        if issue is None:
-            err = "ERROR: Github issue passed to add_issue() was None!"
-            logging.exception(err)
-            raise Exception(err)
-
         if issue.body is None:
             err = "ERROR: Github issue passed to add_issue() has no body! "
             err += "(continuing anyway...)"
@@ -522,7 +850,8 @@ class Search:
         if(issue.comments>0):
 
             try:
-                comments = issue.get_comments()
+                if comments is None:
+                    comments = issue.get_comments()
                 for comment in comments:
 
                     try:
@@ -532,7 +861,7 @@ class Search:
                     issue_comment_content += "\n"
 
             except GithubException:
-                err = "ERROR: could not get comments for this issue: %s"
+                err = "ERROR: could not get comments for this issue: %s"%(issue.html_url)
                 logging.exception(err)
                 pass
 
@@ -543,29 +872,25 @@ class Search:
         created_time = issue.created_at
         modified_time = issue.updated_at
         indexed_time = datetime.datetime.now()
-        try:
-            writer.add_document(
-                    id = issue.html_url,
-                    kind = 'issue',
-                    created_time = created_time,
-                    modified_time = modified_time,
-                    indexed_time = indexed_time,
-                    title = issue.title,
-                    url = issue.html_url,
-                    mimetype='',
-                    owner_email='',
-                    owner_name='',
-                    group='',
-                    repo_name = repo_name,
-                    repo_url = repo_url,
-                    github_user = issue.user.login,
-                    issue_title = issue.title,
-                    issue_url = issue.html_url,
-                    content = issue_comment_content
-            )
-        except ValueError:
-            err = "ERROR: Failed to index Github issue \"%s\""%(issue.title)
-            logging.exception(err)
+        return dict(
+                id = issue.html_url,
+                kind = 'issue',
+                created_time = created_time,
+                modified_time = modified_time,
+                indexed_time = indexed_time,
+                title = issue.title,
+                url = issue.html_url,
+                mimetype='',
+                owner_email='',
+                owner_name='',
+                group='',
+                repo_name = repo_name,
+                repo_url = repo_url,
+                github_user = issue.user.login,
+                issue_title = issue.title,
+                issue_url = issue.html_url,
+                content = issue_comment_content
+        )
 
 
 
@@ -578,8 +903,19 @@ class Search:
         Use a Github file API record to add a filename
         to the search index.
         """
-        MARKDOWN_EXTS = ['.md','.markdown']
+        record = self.make_ghfile_record(d, gh_token)
+        if record is not None:
+            self.add_record(writer, record, update=update)
 
+
+    def make_ghfile_record(self, d, gh_token, cache=None):
+        """
+        Build the search index record for a Github file
+        API record. Markdown files are downloaded (through
+        the HTTP cache, if one is given) and their contents
+        are indexed.
+        Returns None if the file could not be indexed.
+        """
         repo = d['repo']
         org = d['org']
         repo_name = org + "/" + repo
@@ -594,12 +930,12 @@ class Search:
         except:
             logging.exception("ERROR: Failed to find file info.")
             logging.error(d.keys())
-            return
+            return None
 
 
         indexed_time = datetime.datetime.now()
 
-        if fext in MARKDOWN_EXTS:
+        if fext in GITHUB_MARKDOWN_EXTS:
             msg = "Indexing markdown doc %s from repo %s"%(fname,repo_name)
             logging.info(msg)
 
@@ -610,57 +946,61 @@ class Search:
 
             headers = {'Authorization' : 'token %s'%(gh_token)}
 
-            response = requests.get(furl, headers=headers)
+            if cache is None:
+                response = get_http_client().get(furl, headers=headers)
+            else:
+                response = cache.get(get_http_client(), furl, headers=headers)
             if response.status_code==200:
                 jresponse = response.json()
                 content = ""
                 try:
                     binary_content = re.sub('\n','',jresponse['content'])
                     content = base64.b64decode(binary_content).decode('utf-8')
-                except KeyError:
-                    err = "ERROR: Failed to extract 'content' field. You probably hit the rate limit."
+                except (KeyError, ValueError):
+                    # The caller will try this file again next time
+                    err = "ERROR: Failed to extract 'content' field of %s from repo %s."%(fpath, repo_name)
                     logging.exception(err)
-                    return 
+                    return None
 
             else:
-                err = "ERROR: Failed to reach file URL. There may be a problem with authentication/headers."
+                # Requests refused because of the rate limit
+                # have already been retried by the HTTP client,
+                # so this is some other problem. The caller will
+                # try this file again next time.
+                err = "ERROR: Failed to reach file URL for %s from repo %s (status %d). "%(fpath, repo_name, response.status_code)
+                err += "There may be a problem with authentication/headers."
                 logging.error(err)
-                return 
+                return None
 
             usable_url = "https://github.com/%s/blob/master/%s"%(repo_name, fpath)
 
             # Now create the actual search index record
-            try:
-                writer.add_document(
-                        id = fsha,
-                        kind = 'markdown',
-                        created_time = None,
-                        modified_time = None,
-                        indexed_time = indexed_time,
-                        title = fname,
-                        url = usable_url,
-                        mimetype='',
-                        owner_email='',
-                        owner_name='',
-                        group='',
-                        repo_name = repo_name,
-                        repo_url = repo_url,
-                        github_user = '',
-                        issue_title = '',
-                        issue_url = '',
-                        content = content
-                )
-            except ValueError as e:
-                err = "ERROR: Failed to index Github markdown file \"%s\""%(fname)
-                logging.exception(err)
-                return 
+            return dict(
+                    id = fsha,
+                    kind = 'markdown',
+                    created_time = None,
+                    modified_time = None,
+                    indexed_time = indexed_time,
+                    title = fname,
+                    url = usable_url,
+                    mimetype='',
+                    owner_email='',
+                    owner_name='',
+                    group='',
+                    repo_name = repo_name,
+                    repo_url = repo_url,
+                    github_user = '',
+                    issue_title = '',
+                    issue_url = '',
+                    content = content
+            )
 
 
         else:
             msg = "Indexing github file %s from repo %s"%(fname,repo_name)
             logging.info(msg)
 
-            key = fname+"_"+fsha
+            key = ghfile_id(d)
 
             if d['type'] == 'blob':
                 usable_url = "https://github.com/%s/blob/master/%s"%(repo_name, fpath)
@@ -672,29 +1012,75 @@ class Search:
                 usable_url = repo_url
 
             # Now create the actual search index record
-            try:
-                writer.add_document(
-                        id = key,
-                        kind = 'ghfile',
-                        created_time = None,
-                        modified_time = None,
-                        indexed_time = indexed_time,
-                        title = fname,
-                        url = usable_url,
-                        mimetype='',
-                        owner_email='',
-                        owner_name='',
-                        group='',
-                        repo_name = repo_name,
-                        repo_url = repo_url,
-                        github_user = '',
-                        issue_title = '',
-                        issue_url = '',
-                        content = ''
-                )
-            except ValueError as e:
-                err = "ERROR: Failed to index Github file \"%s\""%(fname)
-                logging.exception(err)
+            return dict(
+                    id = key,
+                    kind = 'ghfile',
+                    created_time = None,
+                    modified_time = None,
+                    indexed_time = indexed_time,
+                    title = fname,
+                    url = usable_url,
+                    mimetype='',
+                    owner_email='',
+                    owner_name='',
+                    group='',
+                    repo_name = repo_name,
+                    repo_url = repo_url,
+                    github_user = '',
+                    issue_title = '',
+                    issue_url = '',
+                    content = ''
+            )
+
+
+
+    # ------------------------------
+    # Add a single groups.io email thread
+    # to the search index.
+
+    def add_emailthread(self, writer, d, config, update=True):
+        """
+        Use a Groups.io email thread record to add 
+        an email thread to the search index.
+        """
+        record = self.make_emailthread_record(d)
+        self.add_record(writer, record, update=update)
+
+
+    def make_emailthread_record(self, d):
+        """
+        Build the search index record for a
+        Groups.io email thread record (an archive
+        item from groupsio_util).
+        """
+        indexed_time = datetime.datetime.now()
+
+        # The Date header is a string
+        try:
+            created_time = utc_timestamp(dateutil.parser.parse(d['date']))
+        except (KeyError, TypeError, ValueError, OverflowError):
+            created_time = None
+
+        # Now create the actual search index record
+        return dict(
+                id = d['permalink'],
+                kind = 'emailthread',
+                created_time = created_time,
+                modified_time = created_time,
+                indexed_time = indexed_time,
+                title = d['subject'] or '',
+                url = d['permalink'],
+                mimetype='',
+                owner_email=d['sender_email'] or '',
+                owner_name=d['sender_name'] or '',
+                group=d['subgroup'],
+                repo_name = '',
+                repo_url = '',
+                github_user = '',
+                issue_title = '',
+                issue_url = '',
+                content = d['content']
+        )
 
 
 
@@ -708,107 +1094,463 @@ class Search:
         to add a disqus comment thread to the
         search index.
         """
+        record = self.make_disqusthread_record(d)
+        self.add_record(writer, record, update=update)
+
+
+    def make_disqusthread_record(self, d):
+        """
+        Build the search index record for a
+        disqus comment thread record.
+        """
         indexed_time = datetime.datetime.now()
 
         # created_time is already a timestamp
 
         # Now create the actual search index record
-        try:
-            writer.add_document(
-                    id = d['id'],
-                    kind = 'disqus',
-                    created_time = d['created_time'],
-                    modified_time = None,
-                    indexed_time = indexed_time,
-                    title = d['title'],
-                    url = d['link'],
-                    mimetype='',
-                    owner_email='',
-                    owner_name='',
-                    repo_name = '',
-                    repo_url = '',
-                    github_user = '',
-                    issue_title = '',
-                    issue_url = '',
-                    content = d['content']
-            )
-        except ValueError as e:
-            err = "ERROR: Failed to index Disqus comment thread \"%s\""%(d['title'])
-            logging.exception(err)
+        return dict(
+                id = d['id'],
+                kind = 'disqus',
+                created_time = d['created_time'],
+                modified_time = d.get('modified_time'),
+                indexed_time = indexed_time,
+                title = d['title'],
+                url = d['link'],
+                mimetype='',
+                owner_email='',
+                owner_name='',
+                repo_name = '',
+                repo_url = '',
+                github_user = '',
+                issue_title = '',
+                issue_url = '',
+                content = d['content']
+        )
 
 
 
 
     # ------------------------------
-    # Define how to update search index
-    # using different kinds of collections
+    # Add a single hypothesis annotation
+    # to the search index.
+
+    def add_annotation(self, writer, a, config, update=True):
+        """
+        Use a Hypothesis annotation (as returned by
+        the search API) to add an annotation to the
+        search index.
+        """
+        record = self.make_annotation_record(a)
+        self.add_record(writer, record, update=update)
 
 
-    # ------------------------------
-    # Google Drive Files/Documents
+    def make_annotation_record(self, a):
+        """
+        Build the search index record for a
+        Hypothesis annotation.
+        """
+        indexed_time = datetime.datetime.now()
+
+        created_time = utc_timestamp(dateutil.parser.parse(a['created']))
+        modified_time = utc_timestamp(dateutil.parser.parse(a['updated']))
 
+        # Title of the annotated page,
+        # or its url if it has none
+        titles = a.get('document', {}).get('title') or []
+        title = titles[0] if len(titles) > 0 else a['uri']
 
-    def update_index_gdocs(self, gdrive_token_path, config):
+        links = a.get('links', {})
+        url = links.get('incontext') or links.get('html') or a['uri']
+
+        # Users look like acct:username@hypothes.is
+        user = a.get('user', '')
+        owner_name = re.sub(r'^acct:(.*)@.*$', r'\1', user)
+
+        # The content is the quoted text
+        # followed by the annotation
+        quotes = []
+        for target in a.get('target', []):
+            for selector in target.get('selector', []):
+                if selector.get('type') == 'TextQuoteSelector' and selector.get('exact'):
+                    quotes.append('> ' + selector['exact'])
+        content = '\n\n'.join(quotes + [a.get('text', '')])
+
+        # Now create the actual search index record
+        return dict(
+                id = a['id'],
+                kind = 'annotation',
+                created_time = created_time,
+                modified_time = modified_time,
+                indexed_time = indexed_time,
+                title = title,
+                url = url,
+                mimetype='',
+                owner_email='',
+                owner_name=owner_name,
+                group=a.get('group', ''),
+                tags=','.join(a.get('tags', [])),
+                repo_name = '',
+                repo_url = '',
+                github_user = '',
+                issue_title = '',
+                issue_url = '',
+                content = content
+        )
+
+
+    def commit_records(self, records, drop_ids=frozenset(), replace=True, **writer_options):
         """
-        Update the search index using a collection of 
-        Google Drive documents and files.
-        
-        Uses the 'id' field to uniquely identify documents.
+        Write a batch of records (replacing any
+        indexed documents with the same ids, unless
+        replace is False) and drop the documents
+        with ids in drop_ids, in a single index commit.
+
+        replace=False is for writing to an index that
+        was empty when the run started (bulk indexing),
+        which has no documents to replace.
+
+        writer_options are passed to the Whoosh
+        index writer (see get_bulk_writer_options
+        and bulk_writer.py).
+        """
+        writer = open_writer(self.ix, **writer_options)
+
+        # One searcher for all the deletes of this
+        # commit, and none if nothing can be deleted
+        searcher = None
+        if replace or len(drop_ids) > 0:
+            searcher = writer.searcher()
+            if searcher.doc_count_all()==0:
+                replace = False
+        try:
+            for drop_id in drop_ids:
+                writer.delete_by_term('id',drop_id,searcher=searcher)
+            for record in records:
+                self.add_record(writer, record, update=replace, searcher=searcher)
+        finally:
+            if searcher is not None:
+                searcher.close()
+        writer.commit()
 
-        Also see:
-        https://developers.google.com/drive/api/v3/reference/files
+
+    def run_pipeline(self, connectors, config, cancel=None):
         """
+        Write the records of a source connector (or
+        of a list of connectors, run concurrently)
+        to the index as the sources yield them,
+        INDEX_BATCH_SIZE records per commit.
+        See pipeline.py.
 
-        # Updated algorithm:
-        # - get set of indexed ids
-        # - get set of remote ids
-        # - drop all indexed ids
-        # - index all remote ids
+        A single connector's error is raised; the
+        errors of a list of connectors are left in
+        their error attributes.
 
+        cancel is a threading.Event that cancels
+        the run (see IndexPipeline).
 
-        # Get the set of indexed ids:
-        # ------
-        indexed_ids = set()
-        p = QueryParser("kind", schema=self.ix.schema)
-        q = p.parse("gdoc")
-        with self.ix.searcher() as s:
-            results = s.search(q,limit=None)
-            for result in results:
-                indexed_ids.add(result['id'])
+        An empty index is written in bulk (see
+        get_bulk_writer_options), and its segments
+        are merged at the end of the run.
 
+        Returns the pipeline, with its totals.
+        """
+        batch_size = config.get('INDEX_BATCH_SIZE', DEFAULT_INDEX_BATCH_SIZE)
+        writer_options = {}
+        replace = True
+
+        # Writing to an empty index (a full rebuild):
+        # use the bulk indexing settings
+        if config.get('INDEX_BULK_ENABLED', True) and self.ix.doc_count_all()==0:
+            batch_size = config.get('INDEX_BULK_BATCH_SIZE', DEFAULT_INDEX_BULK_BATCH_SIZE)
+            writer_options = self.get_bulk_writer_options(config)
+            replace = False
+            msg = "centillion.search: Empty index, bulk indexing with %s"%(writer_options)
+            logging.info(msg)
 
-        # Get the set of remote ids:
-        # ------
-        # Start with google drive api object
-        gd = GDrive(gdrive_token_path,config)
-        service = gd.get_service()
-        drive = service.files()
+        pipeline = IndexPipeline(self,
+                                 batch_size=batch_size,
+                                 queue_size=config.get('INDEX_QUEUE_SIZE', DEFAULT_INDEX_QUEUE_SIZE),
+                                 writer_options=writer_options,
+                                 replace=replace,
+                                 cancel=cancel)
+        if isinstance(connectors, Connector):
+            pipeline.run(connectors)
+        else:
+            pipeline.run_all(connectors)
 
-        # Now index all the docs in the google drive folder
+        self.merge_bulk_segments(writer_options)
+        return pipeline
 
-        # The trick is to set next page token to None 1st time thru (fencepost)
-        nextPageToken = None
 
-        # Use the pager to return all the things
-        remote_ids = set()
+
+
+    def get_bulk_writer_options(self, config):
+        """
+        Whoosh index writer options for bulk indexing:
+        with INDEX_BULK_PROCS > 1, document text is
+        analyzed by that many processes, each using up
+        to INDEX_BULK_LIMITMB of memory, and (with
+        INDEX_BULK_MULTISEGMENT) each one writes its
+        own segment instead of merging at every commit
+        (see merge_bulk_segments).
+        """
+        procs = max(1, config.get('INDEX_BULK_PROCS', DEFAULT_INDEX_BULK_PROCS))
+        options = dict(limitmb=config.get('INDEX_BULK_LIMITMB', DEFAULT_INDEX_BULK_LIMITMB))
+        if procs > 1:
+            options['procs'] = procs
+            options['multisegment'] = config.get('INDEX_BULK_MULTISEGMENT', True)
+        return options
+
+
+    def merge_bulk_segments(self, writer_options):
+        """
+        With multisegment writer options, every bulk
+        commit adds one segment per writer process:
+        merge them all into a single segment, once,
+        at the end of the bulk run.
+        """
+        if not writer_options.get('multisegment', False):
+            return
+        segments = len(self.ix._segments())
+        start = time.time()
+        self.ix.optimize()
+        msg = "centillion.search: Merged %d bulk index segments in %0.1f s"%(segments, time.time() - start)
+        logging.info(msg)
+
+
+
+
+    # ------------------------------
+    # Define how to update search index
+    # using different kinds of collections
+
+
+    # ------------------------------
+    # Google Drive Files/Documents
+
+
+    def update_index_gdocs(self, gdrive_token_path, config, service=None):
+        """
+        Update the search index using a collection of 
+        Google Drive documents and files.
+        
+        Uses the 'id' field to uniquely identify documents.
+
+        If a Drive changes page token was saved by the
+        last run, only the changes since then are
+        fetched from the changes feed; otherwise (first
+        run, invalid token, or GOOGLE_DRIVE_DELTA_SYNC
+        is False) the full file listing is used.
+
+        service can be used to pass in a Drive API
+        service object (or a fake one, for testing)
+        instead of building one from the credentials.
+
+        Also see:
+        https://developers.google.com/drive/api/v3/reference/files
+        https://developers.google.com/drive/api/v3/reference/changes
+        """
+        self.run_pipeline(self.gdocs_connector(gdrive_token_path, config, service), config)
+
+
+    def gdocs_connector(self, gdrive_token_path, config, service=None):
+        """
+        Connector for the Google Drive files
+        (see update_index_gdocs).
+        """
+        def done(connector):
+            count = connector.count
+            elapsed = connector.elapsed
+            msg = "centillion.search: Done, updated %d Google Drive files in the index " % count
+            msg += "in %0.1f s (%0.2f docs/sec)" % (elapsed, count/max(elapsed, 1e-6))
+            logging.info(msg)
+
+        return Connector("Google Drive files",
+                         self.iter_gdocs_items(gdrive_token_path, config, service),
+                         done=done)
+
+
+    def iter_gdocs_items(self, gdrive_token_path, config, service=None):
+        """
+        List the new and changed Google Drive files,
+        and yield their records (exported and converted
+        by a pool of workers) for the index pipeline
+        (see update_index_gdocs).
+        """
+        # Updated algorithm:
+        # - get set of indexed ids (and their modified times)
+        # - get set of remote ids (full listing),
+        #   or set of changed/removed ids (changes feed)
+        # - drop indexed ids that are not remote
+        #   (or that were removed)
+        # - index remote ids that are new, or that
+        #   have changed since they were indexed
+        #   (if GOOGLE_DRIVE_INCREMENTAL is False,
+        #   re-index every remote id)
+
+
+        # Get the set of indexed ids:
+        # ------
+        indexed_ids = set()
+        indexed_times = {}
+        p = QueryParser("kind", schema=self.ix.schema)
+        q = p.parse("gdoc")
+        with self.ix.searcher() as s:
+            results = s.search(q,limit=None)
+            for result in results:
+                indexed_ids.add(result['id'])
+                indexed_times[result['id']] = result.get('modified_time')
+
+
+        # Get the set of remote ids:
+        # ------
+        # Start with google drive api object
+        if service is None:
+            gd = GDrive(gdrive_token_path,config)
+            service = gd.get_service()
+
+        state = SyncState(self.index_folder, GDRIVE_SYNC_STATE)
+        page_token = state.get('page_token')
+
+        full_items = None
+        if config.get('GOOGLE_DRIVE_DELTA_SYNC', True) and page_token is not None:
+            try:
+                full_items, removed_ids, new_page_token = self.list_drive_changes(service, page_token)
+            except HttpError:
+                err = "centillion.search: Google Drive changes page token %s is invalid, "%(page_token)
+                err += "falling back to a full listing"
+                logging.exception(err)
+                full_items = None
+
+        if full_items is None:
+            # Full listing. Ask for the page token first,
+            # so that anything that changes while we are
+            # listing is picked up by the next delta sync.
+            msg = "centillion.search: Listing all Google Drive files"
+            logging.info(msg)
+            new_page_token = service.changes().getStartPageToken().execute()['startPageToken']
+            full_items = self.list_drive_files(service, config)
+            remote_ids = set(full_items.keys())
+
+            # Drop any id in indexed_ids
+            # not in remote_ids
+            drop_ids = indexed_ids - remote_ids
+
+        else:
+            msg = "centillion.search: Applying %d Google Drive changes since page token %s"%(len(full_items)+len(removed_ids), page_token)
+            logging.info(msg)
+            remote_ids = set(full_items.keys())
+
+            # Drop any id in indexed_ids
+            # that was removed
+            drop_ids = indexed_ids & removed_ids
+
+        # Update any id in indexed_ids
+        # and in remote_ids,
+        # add any id in remote_ids
+        # and not in indexed_ids
+        update_ids = indexed_ids & remote_ids
+        add_ids = remote_ids - indexed_ids
+
+        # In incremental mode, only update documents
+        # whose modifiedTime has changed since they
+        # were indexed; the rest keep their records.
+        skip_ids = set()
+        if config.get('GOOGLE_DRIVE_INCREMENTAL', True):
+            for update_id in update_ids:
+                remote_time = dateutil.parser.parse(full_items[update_id]['modifiedTime'])
+                if utc_timestamp(remote_time) == utc_timestamp(indexed_times[update_id]):
+                    skip_ids.add(update_id)
+            update_ids = update_ids - skip_ids
+
+
+        scratch_dir = self.get_scratch_dir(config)
+
+        n_workers = config.get('GOOGLE_DRIVE_WORKERS', DEFAULT_GOOGLE_DRIVE_WORKERS)
+        failed = False
+
+        for drop_id in drop_ids:
+            yield Drop(drop_id)
+
+        # Workers download and convert documents;
+        # the pipeline writes the records to the
+        # index as they come in.
+        msg = "centillion.search: Exporting and converting %d Google Drive files with %d workers"%(len(update_ids | add_ids), n_workers)
+        logging.info(msg)
+
+        exports = [(full_items[item_id], scratch_dir, config) for item_id in update_ids | add_ids]
+        with ThreadPoolExecutor(max_workers=n_workers) as pool:
+            for args, future in iter_completed(pool, self.make_drive_record, exports, 2*n_workers):
+                item = args[0]
+                try:
+                    record = future.result()
+                except Exception:
+                    err = " > XXXXXX Failed to export Google Drive file \"%s\""%(item['name'])
+                    logging.exception(err)
+                    failed = True
+                    continue
+
+                yield record
+
+        msg = "centillion.search: Google Drive summary: "
+        msg += "%d skipped, %d updated, %d added, %d dropped"%(len(skip_ids), len(update_ids), len(add_ids), len(drop_ids))
+        logging.info(msg)
+
+        # Only remember the page token once the
+        # changes it covers are in the index.
+        # If anything failed, keep the old token:
+        # next time, the files that made it into
+        # the index are skipped as unchanged and
+        # the ones that failed are retried.
+        if not failed:
+            def save_page_token():
+                state.set('page_token', new_page_token)
+                state.save()
+            yield Checkpoint(save_page_token)
+
+
+    def get_scratch_dir(self, config):
+        """
+        Return the directory used for temporary files
+        (SCRATCH_DIR in the config file, or the system
+        temporary directory), creating it if needed.
+        Point SCRATCH_DIR at a tmpfs to keep temporary
+        files off the disk entirely.
+        """
+        scratch_dir = config.get('SCRATCH_DIR')
+        if not scratch_dir:
+            return tempfile.gettempdir()
+        if not os.path.isdir(scratch_dir):
+            os.makedirs(scratch_dir)
+        return scratch_dir
+
+
+    def list_drive_files(self, service, config):
+        """
+        Page through the full Google Drive file listing.
+        Returns a dictionary with file ids as keys and
+        file items as values.
+        """
+        drive = service.files()
+
+        # The trick is to set next page token to None 1st time thru (fencepost)
+        nextPageToken = None
+
+        # Use the pager to return all the things
         full_items = {}
         while True:
             ps = 100
             results = drive.list(
                     pageSize=ps,
                     pageToken=nextPageToken,
-                    fields = "nextPageToken, files(id, kind, createdTime, modifiedTime, mimeType, name, owners, webViewLink)",
+                    fields = "nextPageToken, files(%s)"%(GDRIVE_FILE_FIELDS),
                     spaces="drive"
             ).execute()
 
             nextPageToken = results.get("nextPageToken")
             files = results.get("files",[])
             for f in files:
-                
-                # Add all remote docs to a set
-                remote_ids.add(f['id'])
-
-                # Also store the doc
+                # Store the doc
                 full_items[f['id']] = f
             
             if nextPageToken is None or config['TRUNCATE_DRIVE_LISTING'] is True:
@@ -817,55 +1559,53 @@ class Search:
                 # drive files list
                 break
 
+        return full_items
 
-        writer = self.ix.writer()
-        count = 0
-        temp_dir = tempfile.mkdtemp(dir=os.getcwd())
-
-        err = "centillion.search: Update Google Docs search index: using temporary directory: %s"%(temp_dir)
-        logging.info(err)
 
-        try:
-
-            # Drop any id in indexed_ids
-            # not in remote_ids
-            drop_ids = indexed_ids - remote_ids
-            for drop_id in drop_ids:
-                writer.delete_by_term('id',drop_id)
+    def list_drive_changes(self, service, page_token):
+        """
+        Page through the Google Drive changes feed,
+        starting at page_token.
 
+        Returns a tuple (changed_items, removed_ids, new_page_token):
+        changed_items is a dictionary with file ids as keys and
+        file items as values, removed_ids is a set of file ids
+        that were removed, and new_page_token is the token to
+        start from next time.
 
-            # Update any id in indexed_ids
-            # and in remote_ids
-            update_ids = indexed_ids & remote_ids
-            for update_id in update_ids:
-                # cop out
-                writer.delete_by_term('id',update_id)
-                item = full_items[update_id]
-                self.add_drive_file(writer, item, temp_dir, config, update=True)
-                count += 1
-
-
-            # Add any id not in indexed_ids
-            # and in remote_ids
-            add_ids = remote_ids - indexed_ids
-            for add_id in add_ids:
-                item = full_items[add_id]
-                self.add_drive_file(writer, item, temp_dir, config, update=False)
-                count += 1
-
-        except Exception as e:
-            err = "ERROR: Could not add Google Drive files to search index. Continuing..."
-            logging.exception(err)
-            pass
+        Raises HttpError if page_token is not valid.
+        """
+        changes = service.changes()
+
+        changed_items = {}
+        removed_ids = set()
+        new_page_token = None
+        while page_token is not None:
+            results = changes.list(
+                    pageSize=100,
+                    pageToken=page_token,
+                    fields = "nextPageToken, newStartPageToken, changes(changeType, removed, fileId, file(%s))"%(GDRIVE_FILE_FIELDS),
+                    spaces="drive"
+            ).execute()
 
-        msg = "centillion.search: Cleaning temporary directory: %s"%(temp_dir)
-        logging.info(msg)
-        subprocess.call(['rm','-fr',temp_dir])
+            for change in results.get("changes",[]):
+                if change.get('changeType','file') != 'file':
+                    # shared drive changes, not files
+                    continue
+                file_id = change['fileId']
+                if change.get('removed',False):
+                    removed_ids.add(file_id)
+                    changed_items.pop(file_id, None)
+                else:
+                    removed_ids.discard(file_id)
+                    changed_items[file_id] = change['file']
 
-        writer.commit()
+            # The last page has newStartPageToken
+            # instead of nextPageToken
+            page_token = results.get("nextPageToken")
+            new_page_token = results.get("newStartPageToken", new_page_token)
 
-        msg = "centillion.search: Done, updated %d Google Drive files in the index" % count
-        logging.info(msg)
+        return changed_items, removed_ids, new_page_token
 
 
     def test_update_index_gdocs(self, config):
@@ -920,100 +1660,393 @@ class Search:
     # ------------------------------
     # Github Issues/Comments
 
-    def update_index_issues(self, gh_token, config):
+    def update_index_issues(self, gh_token, config, g=None):
         """
         Update the search index using a collection of 
         Github repo issues and comments.
+
+        For each repo, the updated_at time of the most
+        recently updated issue is saved as a watermark.
+        On later runs, only issues updated since the
+        watermark are fetched and their records replaced.
+
+        g can be used to pass in a Github API object
+        (or a fake one, for testing) instead of
+        creating one from gh_token.
+        """
+        self.run_pipeline(self.issues_connector(gh_token, config, g), config)
+
+
+    def issues_connector(self, gh_token, config, g=None):
+        """
+        Connector for the Github issues
+        (see update_index_issues).
+        """
+        def done(connector):
+            msg = "Done, updated %d Github issues in the index (%d dropped)" % (connector.count, connector.dropped)
+            logging.info(msg)
+
+        return Connector("Github issues",
+                         self.iter_issue_items(gh_token, config, g),
+                         done=done)
+
+
+    def iter_issue_items(self, gh_token, config, g=None):
+        """
+        Crawl the repositories for issues updated since
+        their watermarks, and yield their records, and
+        the ids of issues that are gone, for the index
+        pipeline (see update_index_issues).
         """
+        # Updated algorithm:
+        # - get set of indexed ids, grouped by repo
+        # - for each repo, get the issues updated since
+        #   the repo's watermark (all issues, first time)
+        # - re-index the issues that changed
+        # - if the repo's issue count says issues have
+        #   disappeared, or the repo's ids have not been
+        #   reconciled for GITHUB_ISSUES_RECONCILE_INTERVAL,
+        #   list the repo's issue ids, drop the indexed
+        #   ids that are gone and add the missing ones
+        # - drop issues from repos no longer in the config
+
         # Get the set of indexed ids:
         # ------
-        indexed_issues = set()
+        indexed_issues = {}
+        indexed_times = {}
         p = QueryParser("kind", schema=self.ix.schema)
         q = p.parse("issue")
         with self.ix.searcher() as s:
             results = s.search(q,limit=None)
             for result in results:
-                indexed_issues.add(result['id'])
+                repo_name = result['repo_name'].lower()
+                indexed_issues.setdefault(repo_name, set()).add(result['id'])
+                indexed_times[result['id']] = result.get('modified_time')
+
+        state = SyncState(self.index_folder, GITHUB_ISSUES_SYNC_STATE)
+        watermarks = state.get('watermarks', {})
 
+        # Time of the last full listing of each repo
+        reconciled = state.get('reconciled', {})
+        reconcile_interval = config.get('GITHUB_ISSUES_RECONCILE_INTERVAL', DEFAULT_GITHUB_ISSUES_RECONCILE_INTERVAL)
 
         # Get the set of remote ids:
         # ------
-        # Start with api object
-        g = Github(gh_token)
-
-        # Now index all issue threads in the user-specified repos
-
-        # Start by collecting all the things
-        remote_issues = set()
-        full_items = {}
+        # Now index all changed issue threads in the user-specified repos.
+        # Each repo is crawled by a worker thread; the records
+        # are handed to the pipeline, which is the only one
+        # that writes to the index.
 
-        # Iterate over each repo 
         list_of_repos = config['REPOSITORIES']
-        for k, r in enumerate(list_of_repos):
-
+        for r in list_of_repos:
             if '/' not in r:
                 err = "Error: specify org/reponame or user/reponame in list of repos"
                 logging.error(err)
                 raise Exception(err)
 
-            this_org, this_repo = re.split('/',r)
-            try:
-                org = g.get_organization(this_org)
-                repo = org.get_repo(this_repo)
-            except:
+        # Stop early if testing
+        crawl_repos = list_of_repos
+        if config['TRUNCATE_ISSUES_LISTING'] is True:
+            crawl_repos = list_of_repos[:2]
+
+        nworkers = max(1, config.get('GITHUB_WORKERS', DEFAULT_GITHUB_WORKERS))
+        bulk_threshold = config.get('GITHUB_BULK_COMMENTS_THRESHOLD', DEFAULT_GITHUB_BULK_COMMENTS_THRESHOLD)
+        limiter = get_rate_limiter(GITHUB_API)
+        crawl_start, start_used = time.time(), limiter.used
+        timings = []
+
+        # Each worker gets its own api object
+        now = time.time()
+        crawls = ((g if g is not None else Github(gh_token, per_page=100), r, indexed_issues.get(r.lower(), set()),
+                   indexed_times, watermarks.get(r), bulk_threshold,
+                   now - reconciled.get(r, 0) >= reconcile_interval) for r in crawl_repos)
+
+        with ThreadPoolExecutor(max_workers=nworkers) as executor:
+            for done, (args, future) in enumerate(iter_completed(executor, self.crawl_repo_issues, crawls, 2*nworkers)):
+                r = args[1]
+                logging.info(limiter.progress(done+1, len(crawl_repos), crawl_start, start_used))
                 try:
-                    user = g.get_user(this_org) 
-                    repo = user.get_repo(this_repo)
-                except:
-                    err = "ERROR: could not gain access to repository %s"%(r)
-                    logging.error(err)
+                    result = future.result()
+                except Exception:
+                    # Leave the watermark alone,
+                    # so the next run tries again
+                    err = "ERROR: could not crawl issues in repository %s"%(r)
+                    logging.exception(err)
                     continue
 
-            # Iterate over each issue thread
-            open_issues   = repo.get_issues(state='open')
-            closed_issues = repo.get_issues(state='closed')
-
-            for j, issue in enumerate(open_issues):
-                # For each issue/comment URL,
-                # grab the key and store the 
-                # corresponding issue object
-                key = issue.html_url
-                value = issue
-                remote_issues.add(key)
-                full_items[key] = value
-
-            for j, issue in enumerate(closed_issues):
-                key = issue.html_url
-                value = issue
-                remote_issues.add(key)
-                full_items[key] = value
-
-            # Stop early if testing
-            if config['TRUNCATE_ISSUES_LISTING'] is True and k>=1:
-                break
+                if result is None:
+                    continue
+
+                # Drop issues that are gone, and add
+                # (or replace) any issue that changed
+                records, repo_drop_ids, watermark, full, elapsed = result
+                for drop_id in repo_drop_ids:
+                    yield Drop(drop_id)
+                for record in records:
+                    yield record
+                watermarks[r] = watermark
+                if full:
+                    reconciled[r] = now
+
+                msg = "Crawled repository %s: %d changed issues in %0.1f s"%(r, len(records), elapsed)
+                logging.info(msg)
+                timings.append((elapsed, r))
+
+        self.log_repo_timings(timings)
+
+        # Drop issues from repos that are not
+        # in the list of repos anymore
+        configured = set(r.lower() for r in list_of_repos)
+        for repo_name in indexed_issues.keys():
+            if repo_name not in configured:
+                for drop_id in indexed_issues[repo_name]:
+                    yield Drop(drop_id)
+        for r in list(watermarks.keys()):
+            if r not in list_of_repos:
+                del watermarks[r]
+        for r in list(reconciled.keys()):
+            if r not in list_of_repos:
+                del reconciled[r]
+
+        # Only move the watermarks once
+        # the changes are in the index
+        def save_watermarks():
+            state.set('watermarks', watermarks)
+            state.set('reconciled', reconciled)
+            state.save()
+        yield Checkpoint(save_watermarks)
+
+
+    def crawl_repo_issues(self, g, r, repo_indexed, indexed_times, watermark, bulk_threshold=DEFAULT_GITHUB_BULK_COMMENTS_THRESHOLD, reconcile=False):
+        """
+        Crawl the issues of the repository r that have
+        been updated since the watermark (all issues,
+        if watermark is None), and build their records.
+        This is safe to run in a worker thread; it does
+        not touch the index writer.
+
+        repo_indexed is the set of ids of this repo's
+        indexed issues, and indexed_times maps indexed
+        ids to their modified time.
+
+        Issues that were deleted or transferred do not
+        show up in the listing of updated issues: when
+        the repository has fewer issues than are known,
+        or reconcile is True, every issue is listed, the
+        ones that are gone are dropped, and the ones
+        missing from the index are added.
+
+        Comments are fetched once per issue, or, when
+        that would take more API calls, listed for the
+        whole repo at once (see list_repo_comments).
+        After a full listing the number of pages needed
+        is known. After an incremental listing, only the
+        comments updated since the watermark are listed,
+        which takes at most as many pages as the changed
+        issues have comments; the bulk path is used when
+        that is fewer calls than fetching the comments of
+        the changed issues, and at least bulk_threshold of
+        them have comments. Issues with older comments
+        missing from that listing are fetched one by one.
+
+        Returns a tuple (records, drop_ids, watermark,
+        full, elapsed seconds), where full is True if
+        every issue id was listed, or None if the
+        repository can't be accessed.
+        """
+        start = time.time()
+
+        self.wait_for_github()
+        repo = self.get_repo(g, r)
+        if repo is None:
+            return None
+
+        # Iterate over each issue thread
+        # updated since the watermark
+        if watermark is None:
+            msg = "Listing all issues in repository %s"%(r)
+            since = None
+            changed_issues = repo.get_issues(state='all')
+        else:
+            msg = "Listing issues in repository %s updated since %s"%(r, watermark)
+            since = parse(watermark)
+            changed_issues = repo.get_issues(state='all', since=since, sort='updated', direction='asc')
+        logging.info(msg)
 
+        changed = []
+        drop_ids = set()
+        remote_issues = set()
+        for j, issue in enumerate(changed_issues):
+            # One request per page of issues
+            if j%100 == 0:
+                self.wait_for_github(g)
+
+            # For each issue/comment URL,
+            # grab the key and build the
+            # corresponding issue record
+            key = issue.html_url
+            remote_issues.add(key)
+
+            updated_at = utc_timestamp(issue.updated_at)
+            if since is None or updated_at > since:
+                since = updated_at
+
+            # since is inclusive, so skip issues
+            # we have already indexed
+            if key in indexed_times and utc_timestamp(indexed_times[key]) == updated_at:
+                continue
+            changed.append(issue)
 
-        writer = self.ix.writer()
-        count = 0
+        full = watermark is None
+        if full:
+            # We listed everything, so anything
+            # not listed is gone
+            drop_ids |= (repo_indexed - remote_issues)
+        else:
+            # Issues that have been deleted or transferred
+            # do not show up as updated. If there are fewer
+            # remote issues than we know about, or it is
+            # time to reconcile, list them all, drop the
+            # ones that are gone and add the missing ones.
+            known_issues = repo_indexed | remote_issues
+            if not reconcile:
+                self.wait_for_github(g)
+                remote_count = repo.get_issues(state='all').totalCount
+                if remote_count < len(known_issues):
+                    msg = "Repository %s has %d issues, %d are indexed, looking for removed issues"%(r, remote_count, len(known_issues))
+                    logging.info(msg)
+                    reconcile = True
+            if reconcile:
+                msg = "Listing all issue ids in repository %s"%(r)
+                logging.info(msg)
+                all_remote = set()
+                for j, issue in enumerate(repo.get_issues(state='all')):
+                    if j%100 == 0:
+                        self.wait_for_github(g)
+                    all_remote.add(issue.html_url)
+                    if issue.html_url not in known_issues:
+                        changed.append(issue)
+                drop_ids |= (repo_indexed - all_remote)
+                full = True
+
+        # Fetch the comments of the changed issues
+        # in bulk if that saves API calls
+        bulk_comments = {}
+        ncommented = len([issue for issue in changed if issue.comments>0])
+        total_comments = sum(issue.comments for issue in changed)
+        if watermark is None:
+            # Every issue was listed, so we know how many
+            # pages of comments (100 per page) there are
+            comments_since = None
+            use_bulk = bulk_threshold and ncommented > 0 and math.ceil(total_comments/100) < ncommented
+        else:
+            # Only the comments updated since the watermark
+            # are listed: at most the comments of the
+            # changed issues, 100 per page
+            comments_since = parse(watermark)
+            use_bulk = bulk_threshold and ncommented >= bulk_threshold and math.ceil(total_comments/100) < ncommented
+        if use_bulk:
+            msg = "Listing comments in repository %s (%d changed issues have comments)"%(r, ncommented)
+            logging.info(msg)
+            bulk_comments = self.list_repo_comments(repo, g, since=comments_since)
 
-        # Drop issues in indexed_issues
-        for drop_issue in indexed_issues:
-            writer.delete_by_term('id',drop_issue)
+        records = []
+        for issue in changed:
+            comments = bulk_comments.get(issue.url)
+            if comments is not None and len(comments) < issue.comments:
+                # Missing comments, fetch them from the issue
+                comments = None
+            if comments is None and issue.comments > 0:
+                self.wait_for_github(g)
+            records.append(self.make_issue_record(issue, comments))
 
+        if since is not None:
+            watermark = since.isoformat()
 
-        # Add any issue in remote_issues
-        for add_issue in remote_issues:
-            item = full_items[add_issue]
-            self.add_issue(writer, item, gh_token, config, update=False)
-            count += 1
+        return records, drop_ids, watermark, full, time.time()-start
 
 
-        writer.commit()
+    def list_repo_comments(self, repo, g=None, since=None):
+        """
+        List all of the issue comments in a repository
+        (one paginated listing, instead of one or more
+        calls per issue), or only the ones updated since
+        the datetime since, and group them by issue.
+        Returns a dictionary mapping issue API urls to
+        lists of comments, in the order they were made.
+        Returns an empty dictionary if the listing fails.
+        """
+        comments = {}
+        try:
+            if since is None:
+                listing = repo.get_issues_comments(sort='updated', direction='asc')
+            else:
+                listing = repo.get_issues_comments(sort='updated', direction='asc', since=since)
+            for j, comment in enumerate(listing):
+                # One request per page of comments
+                if j%100 == 0:
+                    self.wait_for_github(g)
+                comments.setdefault(comment.issue_url, []).append(comment)
+        except GithubException:
+            err = "ERROR: could not list comments for repository %s, fetching them by issue"%(repo.full_name)
+            logging.exception(err)
+            return {}
 
-        msg = "Done, updated %d Github issues in the index" % count
+        for issue_comments in comments.values():
+            issue_comments.sort(key=lambda comment: comment.created_at)
+        return comments
+
+
+    def log_repo_timings(self, timings, n=5):
+        """
+        Log the n slowest repositories of a crawl.
+        timings is a list of (elapsed seconds, repo) tuples.
+        """
+        if len(timings)==0:
+            return
+        slowest = sorted(timings, reverse=True)[:n]
+        msg = "Slowest repositories: %s"%(", ".join("%s (%0.1f s)"%(r, elapsed) for elapsed, r in slowest))
         logging.info(msg)
 
 
+    def get_repo(self, g, r):
+        """
+        Get the Github repository object for the
+        repository r (org/reponame or user/reponame)
+        from the Github API object g.
+        Returns None if the repository can't be accessed.
+        """
+        this_org, this_repo = re.split('/',r)
+        try:
+            org = g.get_organization(this_org)
+            repo = org.get_repo(this_repo)
+        except:
+            try:
+                user = g.get_user(this_org) 
+                repo = user.get_repo(this_repo)
+            except:
+                err = "ERROR: could not gain access to repository %s"%(r)
+                logging.exception(err)
+                return None
+        return repo
+
+
+    def wait_for_github(self, g=None):
+        """
+        Take one request from the Github API rate limit
+        budget, waiting for the rate limit to reset if
+        it is used up (see rate_limit.py). If a PyGithub
+        API object is given, the budget is first updated
+        from its last response. Call this before each
+        request made through PyGithub; requests made
+        through the HTTP client do this themselves.
+        """
+        limiter = get_rate_limiter(GITHUB_API)
+        if g is not None:
+            limiter.update_from_github(g)
+        limiter.wait()
+
+
     def test_update_index_issues(self, config):
         """
         Update the search index using fake
@@ -1053,127 +2086,365 @@ class Search:
     # ------------------------------
     # Github Files
 
-    def update_index_ghfiles(self, gh_token, config): 
+    def update_index_ghfiles(self, gh_token, config, g=None):
         """
         Update the search index using a collection of 
         files (and, separately, Markdown files) from 
         a Github repo.
+
+        Files are identified by their blob sha (see
+        ghfile_id), so only files that are new are
+        added (and, if markdown, downloaded), and only
+        files that are gone are dropped. Everything
+        else is left alone.
+
+        The head commit and directory trees of each
+        repo are saved, so repos that have not changed
+        are skipped, and only the directories that
+        changed are listed (see crawl_repo_files).
+
+        g can be used to pass in a Github API object
+        (or a fake one, for testing) instead of
+        creating one from gh_token.
         """
-        # Get the set of indexed ids:
+        self.run_pipeline(self.ghfiles_connector(gh_token, config, g), config)
+
+
+    def ghfiles_connector(self, gh_token, config, g=None):
+        """
+        Connector for the Github files
+        (see update_index_ghfiles).
+        """
+        # Trees and markdown files are fetched through
+        # the HTTP cache (unless an api object was
+        # passed in, whose calls are used as is)
+        cache = None
+        if g is None:
+            cache = self.get_http_cache(config)
+
+        def done(connector):
+            if cache is not None:
+                removed = cache.prune()
+                msg = "%s (%d entries evicted)"%(cache.summary(), removed)
+                logging.info(msg)
+
+            msg = "Done, updated Github files in the index: %d added, %d dropped" % (connector.count, connector.dropped)
+            logging.info(msg)
+
+        return Connector("Github files",
+                         self.iter_ghfile_items(gh_token, config, g, cache),
+                         done=done)
+
+
+    def iter_ghfile_items(self, gh_token, config, g=None, cache=None):
+        """
+        Crawl the repositories for new files, and yield
+        their records, and the ids of files that are
+        gone, for the index pipeline (see
+        update_index_ghfiles).
+        """
+        # Get the set of indexed ids, grouped by repo:
         # ------
-        indexed_ids = set()
+        indexed_files = {}
         p = QueryParser("kind", schema=self.ix.schema)
-        q = p.parse("ghfile")
-        with self.ix.searcher() as s:
-            results = s.search(q,limit=None)
-            for result in results:
-                indexed_ids.add(result['id'])
+        for kind in ["ghfile","markdown"]:
+            q = p.parse(kind)
+            with self.ix.searcher() as s:
+                results = s.search(q,limit=None)
+                for result in results:
+                    repo_name = result['repo_name'].lower()
+                    indexed_files.setdefault(repo_name, set()).add(result['id'])
 
-        q = p.parse("markdown")
-        with self.ix.searcher() as s:
-            results = s.search(q,limit=None)
-            for result in results:
-                indexed_ids.add(result['id'])
+        indexed_ids = set()
+        for repo_ids in indexed_files.values():
+            indexed_ids |= repo_ids
+
+        state = SyncState(self.index_folder, GITHUB_FILES_SYNC_STATE)
+        repo_states = state.get('repos', {})
 
         # Get the set of remote ids:
         # ------
-        # Start with api object
-        g = Github(gh_token)
-
-        # Now index all the files.
-
-        # Start by collecting all the things
-        remote_ids = set()
-        full_items = {}
+        # Now index all the new files.
+        # Each repo is crawled (and its new markdown
+        # files downloaded) by a worker thread; the
+        # records are handed to the pipeline, which
+        # is the only one that writes to the index.
 
-        # Iterate over each repo 
         list_of_repos = config['REPOSITORIES']
-        for j, r in enumerate(list_of_repos):
-
+        for r in list_of_repos:
             if '/' not in r:
                 err = "ERROR: specify org/reponame or user/reponame in list of repos"
                 logging.error(err)
                 raise Exception(err)
 
-            this_org, this_repo = re.split('/',r)
-            try:
-                org = g.get_organization(this_org)
-                repo = org.get_repo(this_repo)
-            except:
+        # TESTING should end early (after 5 repos)
+        crawl_repos = list_of_repos
+        if config['TESTING'] is True:
+            crawl_repos = list_of_repos[:5]
+
+        # Add any file in remote_ids that is
+        # not in indexed_ids, once (the same
+        # file can be in more than one repo)
+        remote_ids = set()
+        crawled = set()
+        timings = []
+        nworkers = max(1, config.get('GITHUB_WORKERS', DEFAULT_GITHUB_WORKERS))
+        limiter = get_rate_limiter(GITHUB_API)
+        crawl_start, start_used = time.time(), limiter.used
+
+        # Each worker gets its own api object
+        crawls = ((g if g is not None else Github(gh_token), r, gh_token, indexed_ids, repo_states.get(r), cache) for r in crawl_repos)
+
+        with ThreadPoolExecutor(max_workers=nworkers) as executor:
+            for done, (args, future) in enumerate(iter_completed(executor, self.crawl_repo_files, crawls, 2*nworkers)):
+                r = args[1]
+                logging.info(limiter.progress(done+1, len(crawl_repos), crawl_start, start_used))
                 try:
-                    user = g.get_user(this_org) 
-                    repo = user.get_repo(this_repo)
-                except:
-                    err = "ERROR: could not gain access to repository %s"%(r)
+                    result = future.result()
+                except Exception:
+                    err = "ERROR: could not crawl files in repository %s"%(r)
                     logging.exception(err)
                     continue
 
+                if result is None:
+                    continue
 
-            # Get head commit
-            commits = repo.get_commits()
-            try:
-                last = commits[0]
-                sha = last.sha
-            except GithubException:
-                err = "ERROR: could not get commits from repository %s"%(r)
-                logging.exception(err)
-                continue
+                records, repo_ids, repo_state, elapsed = result
+                for record in records:
+                    if record['id'] in remote_ids:
+                        continue
+                    remote_ids.add(record['id'])
+                    yield record
+                remote_ids |= repo_ids
+                crawled.add(r.lower())
+                if repo_state is None:
+                    repo_states.pop(r, None)
+                else:
+                    repo_states[r] = repo_state
 
+                msg = "Crawled repository %s: %d files, %d new, in %0.1f s"%(r, len(repo_ids), len(records), elapsed)
+                logging.info(msg)
+                timings.append((elapsed, r))
+
+        self.log_repo_timings(timings)
+
+        # Drop files that are gone from the repos
+        # we crawled, and files from repos that are
+        # not in the list of repos anymore. (If a repo
+        # could not be crawled, keep its files.)
+        configured = set(r.lower() for r in list_of_repos)
+        drop_ids = set()
+        for repo_name, repo_ids in indexed_files.items():
+            if repo_name in crawled or repo_name not in configured:
+                drop_ids |= (repo_ids - remote_ids)
+
+        for drop_id in drop_ids:
+            yield Drop(drop_id)
+
+        msg = "Github files: %d unchanged"%(len(indexed_ids & remote_ids))
+        logging.info(msg)
+
+        # Only save the trees once the
+        # changes are in the index
+        for r in list(repo_states.keys()):
+            if r not in list_of_repos:
+                del repo_states[r]
+        def save_trees():
+            state.set('repos', repo_states)
+            state.save()
+        yield Checkpoint(save_trees)
+
+
+    def crawl_repo_files(self, g, r, gh_token, indexed_ids=frozenset(), repo_state=None, cache=None):
+        """
+        Crawl the file tree at the head commit of the
+        repository r, download its new markdown files,
+        and build the records of new files. This is safe
+        to run in a worker thread; it does not touch the
+        index writer.
+
+        Files whose id is in indexed_ids are already
+        in the index, and are not downloaded again.
+
+        repo_state is what this method returned the
+        last time the repository was crawled: the head
+        commit, the sha of each directory's tree, and
+        the ids of the files in each directory. If the
+        head commit has not moved, the repository is
+        skipped; otherwise only the directories whose
+        tree sha changed are listed.
+
+        Trees and markdown files are fetched through
+        the HTTP cache, if one is given.
+
+        Returns a tuple (records of new files, ids of
+        all files, new repo state, elapsed seconds),
+        or None if the repository can't be accessed.
+        The new repo state is None if any file could
+        not be indexed, so it is tried again next time.
+        """
+        start = time.time()
+
+        self.wait_for_github()
+        repo = self.get_repo(g, r)
+        if repo is None:
+            return None
+        this_org, this_repo = re.split('/',r)
+
+        # Get head commit
+        self.wait_for_github(g)
+        commits = repo.get_commits()
+        try:
+            last = commits[0]
+            sha = last.sha
+        except GithubException:
+            err = "ERROR: could not get commits from repository %s"%(r)
+            logging.exception(err)
+            return None
+
+        # Only use the saved trees if everything
+        # they list is actually in the index
+        if repo_state is not None:
+            old_ids = set()
+            for ids in repo_state['files'].values():
+                old_ids.update(ids)
+            if not old_ids <= indexed_ids:
+                repo_state = None
+
+        if repo_state is not None and repo_state['commit'] == sha:
+            msg = "Repository %s has not changed since commit %s, skipping"%(r, sha)
+            logging.info(msg)
+            return [], old_ids, repo_state, time.time()-start
+
+        # Map of directory paths to tree shas,
+        # and of directory paths to the files
+        # directly under them
+        trees = {}
+        files = {}
+
+        if repo_state is None:
             # Get all the docs
-            tree = repo.get_git_tree(sha=sha, recursive=True)
-            docs = tree.raw_data['tree']
             msg = "Parsing file ids from repository %s"%(r)
             logging.info(msg)
-
+            tree = self.get_tree_data(repo, sha, gh_token, recursive=True, cache=cache)
+            trees[''] = tree['sha']
+            docs = tree['tree']
             for d in docs:
+                if d['type'] == 'tree' and not ignore_ghfile_path(d['path']):
+                    trees[d['path']] = d['sha']
 
-                # For each doc, get the file extension
-                # and decide what to do with it.
+        else:
+            # Walk down the tree, only listing
+            # directories whose tree changed
+            msg = "Parsing changed file ids from repository %s (commit %s to %s)"%(r, repo_state['commit'], sha)
+            logging.info(msg)
+            old_trees = repo_state['trees']
+            old_files = repo_state['files']
+
+            docs = []
+            tree = self.get_tree_data(repo, sha, gh_token, cache=cache)
+            trees[''] = tree['sha']
+            to_list = [('', tree)]
+            while len(to_list) > 0:
+                dirpath, tree = to_list.pop()
+                for d in tree['tree']:
+                    d = dict(d)
+                    if dirpath != '':
+                        d['path'] = dirpath + '/' + d['path']
+                    docs.append(d)
+
+                    if d['type'] != 'tree' or ignore_ghfile_path(d['path']):
+                        continue
+                    subpath = d['path']
+                    trees[subpath] = d['sha']
+                    if old_trees.get(subpath) == d['sha']:
+                        # Nothing under here changed
+                        prefix = subpath + '/'
+                        for p in old_trees:
+                            if p.startswith(prefix):
+                                trees[p] = old_trees[p]
+                        for p in old_files:
+                            if p == subpath or p.startswith(prefix):
+                                files[p] = list(old_files[p])
+                    else:
+                        to_list.append((subpath, self.get_tree_data(repo, d['sha'], gh_token, cache=cache)))
+
+        records = []
+        repo_ids = set()
+        failed = False
+        for d in docs:
+
+            # For each doc, get the file extension
+            # and decide what to do with it.
 
-                fpath = d['path']
-                _, fname = os.path.split(fpath)
-                _, fext = os.path.splitext(fpath)
-                fpathpieces = fpath.split('/')
+            fpath = d['path']
 
-                # Ignore anything whose name starts with . or _
-                ignore_file = fname[0]=='.' or fname[0]=='_'
-                ignore_dir = False
-                for piece in fpathpieces:
-                    if piece[0]=='.' or piece[0]=='_':
-                        ignore_dir = True
+            # Ignore anything whose name starts with . or _
+            if ignore_ghfile_path(fpath):
+                continue
 
-                if not ignore_file and not ignore_dir:
-                    key = d['sha']
+            key = ghfile_id(d)
+            if key in repo_ids:
+                continue
 
-                    d['org'] = this_org
-                    d['repo'] = this_repo
-                    value = d
+            # Unchanged files are left alone
+            if key not in indexed_ids:
+                d['org'] = this_org
+                d['repo'] = this_repo
 
-                    remote_ids.add(key)
-                    full_items[key] = value
+                record = self.make_ghfile_record(d, gh_token, cache)
+                if record is None:
+                    # Try again next time
+                    failed = True
+                    continue
+                records.append(record)
 
-            # TESTING should end early (after 3 repos)
-            if config['TESTING'] is True and j>3:
-                break
+            repo_ids.add(key)
+            dirpath, _ = os.path.split(fpath)
+            files.setdefault(dirpath, []).append(key)
 
-        writer = self.ix.writer()
-        count = 0
+        for ids in files.values():
+            repo_ids.update(ids)
 
-        # Drop any id in indexed_ids
-        for drop_id in indexed_ids:
-            writer.delete_by_term('id',drop_id)
+        new_state = None
+        if not failed:
+            new_state = dict(commit = sha, trees = trees, files = files)
 
-        # Add any issue in remote_ids
-        # and in remote_ids
-        for add_id in remote_ids:
-            item = full_items[add_id]
-            self.add_ghfile(writer, item, gh_token, config, update=False)
-            count += 1
+        return records, repo_ids, new_state, time.time()-start
 
-        writer.commit()
 
-        msg = "Done, updated %d Github files in the index" % count
-        logging.info(msg)
+    def get_tree_data(self, repo, sha, gh_token, recursive=False, cache=None):
+        """
+        Get the raw data (a dictionary with the tree's
+        sha and its list of entries) of the git tree
+        (or commit) sha in the Github repository repo.
+        If an HTTP cache is given, the tree is fetched
+        with a conditional request through the cache,
+        instead of through the Github API object.
+        """
+        if cache is None:
+            self.wait_for_github()
+            return repo.get_git_tree(sha=sha, recursive=recursive).raw_data
+
+        url = "%s/git/trees/%s"%(repo.url, sha)
+        if recursive:
+            url += "?recursive=1"
+        headers = {'Authorization' : 'token %s'%(gh_token)}
+        response = cache.get(get_http_client(), url, headers=headers)
+        if response.status_code != 200:
+            raise GithubException(response.status_code, response.text, None)
+        return response.json()
+
+
+    def get_http_cache(self, config):
+        """
+        Get the on-disk HTTP response cache in the
+        index folder, or None if it is disabled.
+        """
+        if not config.get('HTTP_CACHE_ENABLED', True):
+            return None
+        cache_dir = os.path.join(self.root_folder or self.index_folder, HTTP_CACHE_DIR)
+        return HttpCache(cache_dir, config.get('HTTP_CACHE_MAX_MB', DEFAULT_HTTP_CACHE_MAX_MB))
 
 
     def test_update_index_ghfiles(self, config):
@@ -1226,21 +2497,283 @@ class Search:
 
 
     
+    # ------------------------------
+    # Groups.io Email Threads
+
+
+    def update_index_emailthreads(self, groupsio_token, config, client=None):
+        """
+        Update the search index using the email archives
+        of groups.io subgroups. This method uses the Groups.io
+        API via methods defined in groupsio_util.py
+
+        The archives of the subgroups are downloaded in
+        parallel. For each subgroup, the highest message
+        number indexed is saved as a watermark, and on
+        later runs only the messages after it are parsed
+        and added.
+
+        client can be used to pass in an HTTP client
+        (or a fake one, for testing).
+        """
+        self.run_pipeline(self.emailthreads_connector(groupsio_token, config, client), config)
+
+
+    def emailthreads_connector(self, groupsio_token, config, client=None):
+        """
+        Connector for the Groups.io email threads
+        (see update_index_emailthreads).
+        """
+        def done(connector):
+            msg = "Done, updated %d Groups.io email threads in the index (%d dropped)" % (connector.count, connector.dropped)
+            logging.info(msg)
+
+        return Connector("Groups.io email threads",
+                         self.iter_emailthread_items(groupsio_token, config, client),
+                         done=done)
+
+
+    def iter_emailthread_items(self, groupsio_token, config, client=None):
+        """
+        Download the subgroup archives in parallel, and
+        yield the records of the new messages of each
+        subgroup for the index pipeline (see
+        update_index_emailthreads), as they are parsed.
+        """
+        # Updated algorithm:
+        # - get set of indexed ids, grouped by subgroup
+        # - list the subgroups
+        # - for each subgroup, download the archive and
+        #   extract the messages after the watermark
+        # - add the new messages
+        # - drop messages from subgroups that are gone
+
+        # Get the set of indexed ids:
+        # ------
+        indexed_ids = {}
+        p = QueryParser("kind", schema=self.ix.schema)
+        q = p.parse("emailthread")
+        with self.ix.searcher() as s:
+            results = s.search(q,limit=None)
+            for result in results:
+                indexed_ids.setdefault(result['group'], set()).add(result['id'])
+
+        # The watermarks are only changed by
+        # checkpoints, once the messages
+        # are in the index
+        state = SyncState(self.index_folder, GROUPSIO_SYNC_STATE)
+        watermarks = state.get('watermarks', {})
+        last_watermarks = dict(watermarks)
+
+        def save_watermark(group, highest):
+            watermarks[group] = highest
+            state.set('watermarks', watermarks)
+            state.save()
+
+        # Get the set of remote ids:
+        # ------
+        subgroups = get_all_subgroups(groupsio_token, client=client)
+
+        crawls = []
+        for subgroup_id, subgroup_name in subgroups.items():
+            group = get_short_subgroup_name(subgroup_name)
+            after = last_watermarks.get(group, 0)
+            if after > 0 and message_permalink(group, after) not in indexed_ids.get(group, set()):
+                # The index does not have the messages
+                # the watermark says it has
+                after = 0
+            crawls.append((subgroup_id, subgroup_name, groupsio_token, after, client))
+
+        nworkers = max(1, config.get('GROUPSIO_WORKERS', DEFAULT_GROUPSIO_WORKERS))
+        with ThreadPoolExecutor(max_workers=nworkers) as executor:
+            for args, future in iter_completed(executor, crawl_subgroup, crawls, nworkers):
+                group = get_short_subgroup_name(args[1])
+                # The archives are downloaded by the workers,
+                # and their messages parsed here, one at a
+                # time, as the pipeline takes the records
+                remote_ids = set()
+                try:
+                    crawl = future.result()
+                    if crawl is None:
+                        continue
+                    for item in crawl:
+                        remote_ids.add(item['permalink'])
+                        yield self.make_emailthread_record(item)
+                except Exception:
+                    # Leave the watermark alone,
+                    # so the next run tries again
+                    err = "ERROR: could not process mailbox for subgroup %s"%(group)
+                    logging.exception(err)
+                    continue
+
+                if crawl.reset:
+                    for drop_id in indexed_ids.get(group, set()) - remote_ids:
+                        yield Drop(drop_id)
+                yield Checkpoint(lambda group=group, highest=crawl.highest: save_watermark(group, highest))
+
+                msg = "Processed subgroup %s: %d new messages"%(group, crawl.count)
+                logging.info(msg)
+
+        # Drop messages from subgroups that are gone
+        groups = set(get_short_subgroup_name(name) for name in subgroups.values())
+        for group in indexed_ids.keys():
+            if group not in groups:
+                for drop_id in indexed_ids[group]:
+                    yield Drop(drop_id)
+
+        def forget_subgroups():
+            for group in list(watermarks.keys()):
+                if group not in groups:
+                    del watermarks[group]
+            state.set('watermarks', watermarks)
+            state.save()
+
+        yield Checkpoint(forget_subgroups)
+
+
+
+    # ------------------------------
+    # Hypothesis Annotations
+
+
+    def update_index_annotations(self, hypothesis_token, config, client=None):
+        """
+        Update the search index using the Hypothesis
+        annotations on pages matching HYPOTHESIS_URL_PATTERN.
+
+        Annotations are listed oldest updated first, and
+        the updated time of the last annotation indexed
+        is saved as a watermark. On later runs, only
+        annotations updated since the watermark are listed.
+
+        Records are committed to the index at least every
+        HYPOTHESIS_BATCH_SIZE annotations (or sooner, when
+        the pipeline batch of INDEX_BATCH_SIZE records is
+        full), and the watermark is saved after each page
+        is committed, so an interrupted run picks up where
+        it left off.
+
+        Deleted annotations are not listed by the search
+        API, so they are only dropped by a full listing
+        (the first run, or with HYPOTHESIS_INCREMENTAL off).
+
+        client can be used to pass in an HTTP client
+        (or a fake one, for testing).
+        """
+        self.run_pipeline(self.annotations_connector(hypothesis_token, config, client), config)
+
+
+    def annotations_connector(self, hypothesis_token, config, client=None):
+        """
+        Connector for the Hypothesis annotations
+        (see update_index_annotations).
+        """
+        def done(connector):
+            msg = "Done, updated %d Hypothesis annotations in the index (%d dropped)" % (connector.count, connector.dropped)
+            logging.info(msg)
+
+        return Connector("Hypothesis annotations",
+                         self.iter_annotation_items(hypothesis_token, config, client),
+                         batch_size=config.get('HYPOTHESIS_BATCH_SIZE', DEFAULT_HYPOTHESIS_BATCH_SIZE),
+                         done=done)
+
+
+    def iter_annotation_items(self, hypothesis_token, config, client=None):
+        """
+        Page through the Hypothesis annotations updated
+        since the last run, and yield their records for
+        the index pipeline (see update_index_annotations).
+        """
+        # Get the set of indexed ids:
+        # ------
+        indexed_ids = set()
+        p = QueryParser("kind", schema=self.ix.schema)
+        q = p.parse("annotation")
+        with self.ix.searcher() as s:
+            results = s.search(q,limit=None)
+            for result in results:
+                indexed_ids.add(result['id'])
+
+        state = SyncState(self.index_folder, HYPOTHESIS_SYNC_STATE)
+        since = None
+        if config.get('HYPOTHESIS_INCREMENTAL', True) and len(indexed_ids) > 0:
+            since = state.get('updated')
+        full = since is None
+
+        url_pattern = config.get('HYPOTHESIS_URL_PATTERN', DEFAULT_HYPOTHESIS_URL_PATTERN)
+
+        def save_watermark(updated):
+            state.set('updated', updated)
+            state.save()
+
+        # Page through the annotations
+        # ------
+        remote_ids = set()
+        for rows in iter_annotation_pages(hypothesis_token,
+                                          url_pattern=url_pattern,
+                                          since=since,
+                                          client=client):
+            for a in rows:
+                yield self.make_annotation_record(a)
+                remote_ids.add(a['id'])
+
+            # Only move the watermark once
+            # the page is in the index
+            yield Checkpoint(lambda updated=rows[-1]['updated']: save_watermark(updated))
+
+        # Drop annotations that are gone
+        if full:
+            for drop_id in indexed_ids - remote_ids:
+                yield Drop(drop_id)
+
+
+
     # ------------------------------
     # Disqus Threads
 
 
-    def update_index_disqus(self, disqus_token, config):
+    def update_index_disqus(self, disqus_token, config, client=None):
         """
         Update the search index using a collection of 
         Disqus comment threads from the dcppc-internal 
         forum.
+
+        The post count and last post time of each thread
+        are saved, and the posts of a thread are only
+        fetched again when these show it has changed.
+
+        client can be used to pass in an HTTP client
+        (or a fake one, for testing) for the crawler.
+        """
+        self.run_pipeline(self.disqus_connector(disqus_token, config, client), config)
+
+
+    def disqus_connector(self, disqus_token, config, client=None):
+        """
+        Connector for the Disqus comment threads
+        (see update_index_disqus).
+        """
+        def done(connector):
+            msg = "Done, updated %d Disqus comment threads in the index (%d dropped)" % (connector.count, connector.dropped)
+            logging.info(msg)
+
+        return Connector("Disqus comment threads",
+                         self.iter_disqus_items(disqus_token, config, client),
+                         done=done)
+
+
+    def iter_disqus_items(self, disqus_token, config, client=None):
+        """
+        Crawl the Disqus threads, and yield the records
+        of the threads that are new or have changed for
+        the index pipeline (see update_index_disqus).
         """
         # Updated algorithm:
         # - get set of indexed ids
-        # - get set of remote ids
-        # - drop all indexed ids
-        # - index all remote ids
+        # - crawl the threads, fetching the posts of
+        #   threads that are new or have changed
+        # - replace the threads that changed
+        # - drop indexed ids that are gone
 
         # Get the set of indexed ids:
         # --------------------
@@ -1252,44 +2785,47 @@ class Search:
             for result in results:
                 indexed_ids.add(result['id'])
 
+        state = SyncState(self.index_folder, DISQUS_SYNC_STATE)
+        known = {}
+        if config.get('DISQUS_INCREMENTAL', True):
+            # Only threads that are in the index
+            # can be left as they are
+            known = {k : v for k, v in state.get('threads', {}).items() if k in indexed_ids}
+
         # Get the set of remote ids:
         # ------
-        spider = DisqusCrawler(disqus_token,'dcppc-internal')
-
-        # ask spider to crawl disqus comments
-        spider.crawl_threads()
-
-        # spider.comments will be a dictionary
-        # with keys as thread IDs and values as
-        # a dictionary item
-
-        writer = self.ix.writer()
-        count = 0
-
-        # archives is a dictionary
-        # keys are IDs (urls)
-        # values are dictionaries
-        threads = spider.get_threads()
+        spider = DisqusCrawler(disqus_token,'dcppc-internal',
+                               workers=config.get('DISQUS_WORKERS', DEFAULT_DISQUS_WORKERS),
+                               client=client)
 
-        # Start by collecting all the things
+        # ask spider to crawl disqus comments,
+        # and add (or replace) threads that changed
+        # as they come in
         remote_ids = set()
-        for k in threads.keys():
-            remote_ids.add(k)
-
-        # drop indexed_ids
-        for drop_id in indexed_ids:
-            writer.delete_by_term('id',drop_id)
-
-        # add remote_ids
-        for add_id in remote_ids:
-            item = threads[add_id]
-            self.add_disqusthread(writer, item, config, update=False)
-            count += 1
-
-        writer.commit()
-
-        msg = "Done, updated %d Disqus comment threads in the index" % count
-        logging.info(msg)
+        for item in spider.iter_threads(known):
+            remote_ids.add(item['id'])
+            yield self.make_disqusthread_record(item)
+
+        unchanged = spider.get_unchanged()
+        remote_ids |= unchanged
+
+        # Threads whose posts could not be fetched
+        # this time are kept as they are
+        remote_ids |= spider.get_failed()
+
+        # drop indexed_ids that are gone
+        for drop_id in indexed_ids - remote_ids:
+            yield Drop(drop_id)
+
+        # Only save the thread state once
+        # the changes are in the index
+        thread_state = spider.get_thread_state()
+        def save_threads():
+            state.set('threads', thread_state)
+            state.save()
+            msg = "Disqus: %d threads unchanged"%(len(unchanged))
+            logging.info(msg)
+        yield Checkpoint(save_threads)
 
 
     def test_update_index_disqus(self, config):    
@@ -1336,7 +2872,15 @@ class Search:
     # Search results bundler
 
 
-    def create_search_result(self, results):
+    def read_search_hits(self, results):
+        """
+        Read what create_search_result needs from
+        the hits of a search: the stored fields, the
+        score and the highlighted content of each hit.
+        This needs the searcher; rendering the results
+        does not, so it can be done without holding
+        the shared searcher (see shared_searcher).
+        """
 
         # Allow larger fragments
         results.fragmenter.maxchars = 300
@@ -1344,8 +2888,13 @@ class Search:
         # Show more context before and after
         results.fragmenter.surround = 50
 
+        return [(r.fields(), r.score, r.highlights('content')) for r in results]
+
+
+    def create_search_result(self, hits):
+
         search_results = []
-        for r in results:
+        for r, score, highlights in hits:
 
             # Note: this is where we package things up 
             # for the Jinja template "search.html".
@@ -1354,7 +2903,7 @@ class Search:
             # and then an {{e.score}}
 
             sr = SearchResult()
-            sr.score = r.score
+            sr.score = score
 
             # IMPORTANT:
             # update search.html with what you want to see
@@ -1425,7 +2974,6 @@ class Search:
 
             # This is where we need to fix the markdown rendering problems
 
-            highlights = r.highlights('content')
             if not highlights:
                 # just use the first 1,000 words of the document
                 highlights = self.cap(r['content'], 1000)
@@ -1492,12 +3040,14 @@ class Search:
                 "issue" : None,
                 "ghfile" : None,
                 "markdown" : None,
+                "emailthread" : None,
                 "disqus" : None,
+                "annotation" : None,
                 "total" : None
         }
-        for key in counts.keys():
-            q = p.parse(key)
-            with self.ix.searcher() as s:
+        with self.shared_searcher() as s:
+            for key in counts.keys():
+                q = p.parse(key)
                 results = s.search(q,limit=None)
                 counts[key] = len(results)
 
@@ -1522,8 +3072,12 @@ class Search:
             item_keys = ['title','owner_name','url','mimetype','created_time','modified_time']
         elif doctype=='issue':
             item_keys = ['title','repo_name','repo_url','url','created_time','modified_time']
+        elif doctype=='emailthread':
+            item_keys = ['title','owner_name','url','group','created_time','modified_time']
         elif doctype=='disqus':
             item_keys = ['title','created_time','url']
+        elif doctype=='annotation':
+            item_keys = ['title','owner_name','url','created_time','modified_time']
         elif doctype=='ghfile':
             item_keys = ['title','repo_name','repo_url','url']
         elif doctype=='markdown':
@@ -1537,21 +3091,50 @@ class Search:
 
         p = QueryParser("kind", schema=self.ix.schema)
         q = p.parse(doctype)
-        with self.ix.searcher() as s:
+        with self.shared_searcher() as s:
             results = s.search(q,limit=None)
             for r in results:
                 d = {}
                 for k in item_keys:
-                    d[k] = r[k]
+                    d[k] = r.get(k)
                 json_results.append(d)
 
         return json_results
 
 
 
+    def shared_searcher(self):
+        """
+        Use the searcher of the index that is shared
+        by every thread using this Search object:
+
+            with search.shared_searcher() as s:
+                ...
+
+        The searcher is kept open and reused by later
+        calls (so Whoosh's caches stay warm), and is
+        only refreshed when the index has changed since
+        it was opened. Threads take turns using it, so
+        only read from it in the with block, and do
+        the rest (e.g. rendering results) after it.
+        """
+        return SharedSearcher(self)
+
+
+    def close_searcher(self):
+        """
+        Close the shared searcher (e.g. when this
+        Search object is replaced by another one).
+        """
+        with self.searcher_lock:
+            if self.searcher is not None:
+                self.searcher.close()
+                self.searcher = None
+
+
     def search(self, query_list, fields=None):
 
-        with self.ix.searcher() as searcher:
+        with self.shared_searcher() as searcher:
 
             query_list2 = []
             for qq in query_list:
@@ -1603,8 +3186,10 @@ class Search:
             msg = "query: %s" % parsed_query
             logging.info(msg)
             results = searcher.search(query, terms=False, scored=True, groupedby="kind")
-            search_result = self.create_search_result(results)
+            hits = self.read_search_hits(results)
 
+        # Render the results without holding the searcher
+        search_result = self.create_search_result(hits)
         return parsed_query, search_result
 
 
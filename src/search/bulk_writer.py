@@ -0,0 +1,70 @@
+import multiprocessing
+from multiprocessing.context import SpawnProcess
+
+from whoosh.multiproc import MpWriter, SubWriterTask
+
+
+"""
+Bulk index writer.
+
+With INDEX_BULK_PROCS > 1, a full rebuild analyzes the
+document text in several writer processes at once
+(Whoosh's MpWriter). Whoosh starts those processes
+with the default start method, which on Linux forks
+the webapp in the middle of an index update, while
+the source threads and HTTP client threads are
+running: a lock held by any of those threads at that
+moment stays locked forever in the child process.
+
+The BulkWriter here is an MpWriter whose processes are
+started with the spawn method instead (a new Python
+interpreter, which only imports what the writer needs),
+so they do not inherit the state of the other threads.
+
+Like any program using spawned processes, a script
+that starts centillion must guard its main code with
+if __name__=="__main__" (see the examples).
+"""
+
+
+# Context for the queues and processes of the bulk writer
+spawn = multiprocessing.get_context('spawn')
+
+
+class SpawnSubWriterTask(SubWriterTask):
+    """
+    Whoosh's writer subprocess,
+    started with the spawn method
+    """
+    _start_method = SpawnProcess._start_method
+    _Popen = staticmethod(SpawnProcess._Popen)
+
+
+class BulkWriter(MpWriter):
+    """
+    Whoosh's multi-process index writer,
+    with spawned writer processes
+    """
+    def __init__(self, ix, procs=None, **kwargs):
+        MpWriter.__init__(self, ix, procs=procs, **kwargs)
+        self.jobqueue = spawn.Queue(self.procs * 4)
+        self.resultqueue = spawn.Queue()
+
+    def _new_task(self):
+        task = SpawnSubWriterTask(self.storage, self.indexname,
+                                  self.jobqueue, self.resultqueue,
+                                  self.subargs, self.multisegment)
+        self.tasks.append(task)
+        task.start()
+        return task
+
+
+def open_writer(ix, procs=1, **writer_options):
+    """
+    Open a writer for the index ix, with the Whoosh
+    writer options writer_options: a BulkWriter if
+    procs > 1, a plain index writer otherwise.
+    """
+    if procs > 1:
+        return BulkWriter(ix, procs=procs, **writer_options)
+    return ix.writer(**writer_options)
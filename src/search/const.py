@@ -2,3 +2,77 @@ import os
 
 base = os.path.split(os.path.abspath(__file__))[0]
 call = os.getcwd()
+
+# Number of worker threads used to export and
+# convert Google Drive documents in parallel
+DEFAULT_GOOGLE_DRIVE_WORKERS = 8
+
+# Number of worker threads used to crawl
+# Github repositories in parallel
+DEFAULT_GITHUB_WORKERS = 4
+
+# Minimum number of changed issues with comments
+# in a repository for all of the repository's
+# comments to be listed at once (100 per page),
+# rather than once per issue
+DEFAULT_GITHUB_BULK_COMMENTS_THRESHOLD = 20
+
+# Seconds between full listings of a repository's
+# issue ids, to find issues that were deleted or
+# transferred (which incremental listings miss)
+DEFAULT_GITHUB_ISSUES_RECONCILE_INTERVAL = 24*3600
+
+# Shared HTTP client (see http_client.py):
+# default request timeout (seconds), number of
+# retries, retry backoff factor (seconds), kept-alive
+# connections per host, and concurrent requests per host
+DEFAULT_HTTP_TIMEOUT = 60
+DEFAULT_HTTP_RETRIES = 3
+DEFAULT_HTTP_BACKOFF = 1.0
+DEFAULT_HTTP_POOL_SIZE = 16
+DEFAULT_HTTP_MAX_PER_HOST = 8
+
+# Maximum size of the on-disk HTTP response
+# cache (see http_cache.py), in MB
+DEFAULT_HTTP_CACHE_MAX_MB = 256
+
+# Number of Github API requests to leave unused
+# in each rate limit window (see rate_limit.py)
+DEFAULT_GITHUB_RATE_LIMIT_RESERVE = 10
+
+# Number of worker threads used to fetch the
+# posts of Disqus threads in parallel
+DEFAULT_DISQUS_WORKERS = 4
+
+# Number of worker threads used to download
+# Groups.io subgroup archives in parallel
+DEFAULT_GROUPSIO_WORKERS = 4
+
+# Hypothesis annotations: pages to index the
+# annotations of (a wildcard pattern), and the
+# most annotations written to the index before
+# a commit (see Connector.batch_size): one page
+# of the search API, below DEFAULT_INDEX_BATCH_SIZE
+# so that it takes effect
+DEFAULT_HYPOTHESIS_URL_PATTERN = '*pilot.nihdatacommons.us*'
+DEFAULT_HYPOTHESIS_BATCH_SIZE = 200
+
+# Index pipeline (see pipeline.py): number of
+# records written to the index per commit, and
+# number of records the sources can get ahead
+# of the index writer
+DEFAULT_INDEX_BATCH_SIZE = 500
+DEFAULT_INDEX_QUEUE_SIZE = 1000
+
+# Bulk indexing (full rebuilds of an empty index):
+# number of processes analyzing documents (1: no
+# writer subprocesses), memory limit (MB) of each
+# writer process, and number of records written
+# per commit
+DEFAULT_INDEX_BULK_PROCS = 1
+DEFAULT_INDEX_BULK_LIMITMB = 256
+DEFAULT_INDEX_BULK_BATCH_SIZE = 10000
+
+# Number of old index generations kept
+# after a rebuild (see generations.py)
+DEFAULT_INDEX_KEEP_GENERATIONS = 1
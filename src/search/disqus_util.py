@@ -1,10 +1,13 @@
 import os, re
-import requests
 import json
 import dateutil.parser
 import logging
 
 from pprint import pprint
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .http_client import get_http_client
+from .const import DEFAULT_DISQUS_WORKERS
 
 """
 Convenience class wrapper for Disqus comments.
@@ -14,18 +17,32 @@ API OAuth application credentials (in which case
 a user needs to authenticate with the application
 so it can access the comments that they can see)
 or user credentials from a previous login.
+
+Threads are listed one page at a time, and the
+posts of each thread are fetched concurrently
+by a small pool of worker threads. All requests
+go through the shared HTTP client, which paces
+them to stay within the Disqus rate limit.
 """
 
 class DisqusCrawler(object):
 
     def __init__(self,
                  credentials,
-                 group_name):
+                 group_name,
+                 workers=DEFAULT_DISQUS_WORKERS,
+                 client=None):
 
         self.credentials = credentials
         self.group_name = group_name
+        self.workers = workers
+        self.client = client
         self.crawled_comments = False
         self.threads = None
+        self.unchanged = set()
+        self.failed = set()
+        self.known = {}
+        self.thread_state = {}
 
 
     def get_threads(self):
@@ -37,21 +54,102 @@ class DisqusCrawler(object):
         return self.threads
 
 
-    def crawl_threads(self):
+    def get_unchanged(self):
+        """
+        Return the set of ids of the threads that
+        were not fetched again, because they have
+        not changed since the last crawl.
+        """
+        return self.unchanged
+
+
+    def get_failed(self):
+        """
+        Return the set of ids of the threads whose
+        posts could not be fetched. They are still
+        there, so they must not be dropped from the
+        search index; they are fetched again by the
+        next crawl.
+        """
+        return self.failed
+
+
+    def get_thread_state(self):
+        """
+        Return the post count and last post time
+        of each thread with posts, keyed by thread
+        id, to pass to the next crawl_threads call.
+        """
+        return self.thread_state
+
+
+    def get(self, url, params):
+        """
+        Make a Disqus API call, through the shared
+        HTTP client (which keeps within the Disqus
+        rate limit) unless another client was given.
+        """
+        client = self.client
+        if client is None:
+            client = get_http_client()
+        return client.get(url, params=params).json()
+
+
+    def crawl_threads(self, known=None):
         """
         This will use the API to get every thread,
         and will iterate through every thread to 
         get every comment thread. 
+
+        The posts of each thread are fetched by a
+        pool of worker threads, while the listing
+        of threads carries on.
+
+        known is the thread state (get_thread_state)
+        of the last crawl, for the threads that are
+        still in the search index. The posts of a
+        known thread are only fetched again if its
+        post count changed, or if it has posts newer
+        than its last post (see list_recent_posts).
+        The other known threads go in get_unchanged().
         """
-        # The money shot
         threads = {}
+        for thread_info in self.iter_threads(known):
+            threads[thread_info['id']] = thread_info
+        self.threads = threads
+
+
+    def iter_threads(self, known=None):
+        """
+        Crawl the threads like crawl_threads, but
+        yield each crawled thread (a dictionary)
+        as soon as its posts have been fetched,
+        instead of keeping them all.
+
+        get_unchanged(), get_failed() and
+        get_thread_state() are complete once
+        the generator is exhausted.
+        """
+        # The money shot
+        unchanged = set()
+        thread_state = {}
+        self.unchanged = unchanged
+        self.failed = set()
+        self.thread_state = thread_state
+
+        # Find the threads with new posts
+        # since the last crawl
+        if known is None:
+            known = {}
+        self.known = known
+        last_posts = [k['last_post'] for k in known.values() if k['last_post'] is not None]
+        recent = {}
+        if len(last_posts) > 0:
+            recent = self.list_recent_posts(max(last_posts))
 
         # list all threads
         list_threads_url = 'https://disqus.com/api/3.0/threads/list.json'
 
-        # list all posts (comments)
-        list_posts_url = 'https://disqus.com/api/3.0/threads/listPosts.json'
-
         base_params = dict(
                 api_key=self.credentials,
                 forum=self.group_name
@@ -62,98 +160,204 @@ class DisqusCrawler(object):
         for k in base_params.keys():
             params[k] = base_params[k]
 
-        # make api call (first loop in fencepost)
-        results = requests.request('GET', list_threads_url, params=params).json()
-        cursor = results['cursor']
-        responses = results['response']
+        futures = {}
+        with ThreadPoolExecutor(max_workers=max(1,self.workers)) as executor:
 
-        while True:
+            # make api call (first loop in fencepost)
+            results = self.get(list_threads_url, params)
+            cursor = results['cursor']
+            responses = results['response']
+
+            while True:
+
+                for response in responses:
+                    if '127.0.0.1' not in response['link'] and 'localhost' not in response['link']:
+
+                        # Save thread info
+                        thread_id = response['id']
+                        thread_count = response['posts']
 
-            for response in responses:
-                if '127.0.0.1' not in response['link'] and 'localhost' not in response['link']:
-
-                    # Save thread info
-                    thread_id = response['id']
-                    thread_count = response['posts']
-
-                    msg = "Working on thread %s (%d posts)"%(thread_id,thread_count)
-                    logging.info(msg)
-
-                    if thread_count > 0:
-
-                        # prepare url params
-                        params_comments = {}
-                        for k in base_params.keys():
-                            params_comments[k] = base_params[k]
-
-                        params_comments['thread'] = thread_id
-
-                        # make api call
-                        results_comments = requests.request('GET', list_posts_url, params=params_comments).json()
-                        cursor_comments = results_comments['cursor']
-                        responses_comments = results_comments['response']
-
-                        # Save comments for this thread
-                        thread_comments = []
-
-                        while True:
-                            for comment in responses_comments:
-                                # Save comment info
-                                msg = "    + %s"%(comment['message'])
-                                logging.info(msg)
-
-                                thread_comments.append(comment['message'])
-                       
-                            if cursor_comments['hasNext']:
-                       
-                                # Prepare for the next URL call
-                                params_comments = {}
-                                for k in base_params.keys():
-                                    params_comments[k] = base_params[k]
-                                params_comments['thread'] = thread_id
-                                params_comments['cursor'] = cursor_comments['next']
-                       
-                                # Make the next URL call
-                                results_comments = requests.request('GET', list_posts_url, params=params_comments).json()
-                                cursor_comments = results_comments['cursor']
-                                responses_comments = results_comments['response']
-                       
-                            else:
-                               break
-
-                        link = response['link']
-                        clean_link = re.sub('data-commons.us','nihdatacommons.us',link)
-                        clean_link += "#disqus_comments"
-
-                        # Finished working on thread.
-
-                        # We need to make this value a dictionary
-                        thread_info = dict(
-                                id = response['id'],
-                                created_time = dateutil.parser.parse(response['createdAt']),
-                                title = response['title'],
-                                forum = response['forum'],
-                                link = clean_link,
-                                content = "\n\n-----".join(thread_comments)
-                        )
-                        threads[thread_id] = thread_info
+                        msg = "Working on thread %s (%d posts)"%(thread_id,thread_count)
+                        logging.info(msg)
 
+                        if thread_count > 0:
+                            k = known.get(thread_id)
+                            if k is not None and k['posts'] == thread_count and k['last_post'] is not None and \
+                                    (thread_id not in recent or recent[thread_id] <= k['last_post']):
+                                # Nothing new, keep it as it is
+                                unchanged.add(thread_id)
+                                thread_state[thread_id] = k
+                                continue
 
+                            future = executor.submit(self.crawl_posts, thread_id)
+                            futures[future] = response
+
+
+                # Hand over the threads whose posts
+                # are done, before listing more
+                for future in [f for f in futures if f.done()]:
+                    thread_info = self.finish_thread(futures.pop(future), future)
+                    if thread_info is not None:
+                        yield thread_info
+
+                if 'hasNext' in cursor.keys() and cursor['hasNext']:
+
+                    # Prepare for next URL call
+                    params = {}
+                    for k in base_params.keys():
+                        params[k] = base_params[k]
+                    params['cursor'] = cursor['next']
+
+                    # Make the next URL call
+                    results = self.get(list_threads_url, params)
+                    cursor = results['cursor']
+                    responses = results['response']
+
+                else:
+                    break
+
+            for future in as_completed(futures):
+                thread_info = self.finish_thread(futures[future], future)
+                if thread_info is not None:
+                    yield thread_info
+
+
+    def finish_thread(self, response, future):
+        """
+        Build the dictionary for a thread (response,
+        from the thread listing) once its posts have
+        been fetched by future, and record its state.
+        Returns None if the posts could not be fetched.
+        """
+        thread_id = response['id']
+        try:
+            thread_comments, last_post = future.result()
+        except Exception:
+            err = "ERROR: could not get posts for Disqus thread %s"%(thread_id)
+            logging.exception(err)
+            self.failed.add(thread_id)
+            # Keep its previous state, without a last
+            # post time, so the next crawl fetches it
+            # again whether or not it changed
+            if thread_id in self.known:
+                self.thread_state[thread_id] = dict(self.known[thread_id], last_post=None)
+            return None
+
+        link = response['link']
+        clean_link = re.sub('data-commons.us','nihdatacommons.us',link)
+        clean_link += "#disqus_comments"
+
+        # Finished working on thread.
+
+        # We need to make this value a dictionary
+        thread_info = dict(
+                id = response['id'],
+                created_time = dateutil.parser.parse(response['createdAt']),
+                modified_time = dateutil.parser.parse(last_post) if last_post else None,
+                title = response['title'],
+                forum = response['forum'],
+                link = clean_link,
+                content = "\n\n-----".join(thread_comments)
+        )
+        self.thread_state[thread_id] = dict(posts = response['posts'], last_post = last_post)
+        return thread_info
+
+
+    def list_recent_posts(self, since):
+        """
+        List the posts made in the whole forum since
+        the time since (an ISO timestamp, inclusive),
+        and return the time of the newest post in each
+        thread, keyed by thread id.
+        """
+        list_forum_posts_url = 'https://disqus.com/api/3.0/forums/listPosts.json'
+
+        base_params = dict(
+                api_key=self.credentials,
+                forum=self.group_name,
+                since=since,
+                order='asc',
+                limit=100
+        )
+
+        recent = {}
+        params = dict(base_params)
+        while True:
+            results = self.get(list_forum_posts_url, params)
+            for post in results['response']:
+                thread_id = post['thread']
+                if thread_id not in recent or post['createdAt'] > recent[thread_id]:
+                    recent[thread_id] = post['createdAt']
+
+            cursor = results['cursor']
             if 'hasNext' in cursor.keys() and cursor['hasNext']:
+                params = dict(base_params)
+                params['cursor'] = cursor['next']
+            else:
+                break
+
+        msg = "Disqus: %d threads have posts since %s"%(len(recent), since)
+        logging.info(msg)
+        return recent
+
+
+    def crawl_posts(self, thread_id):
+        """
+        Page through the posts (comments) of one
+        thread, and return the list of messages
+        and the time of the newest post.
+        This runs in a worker thread.
+        """
+        # list all posts (comments)
+        list_posts_url = 'https://disqus.com/api/3.0/threads/listPosts.json'
+
+        base_params = dict(
+                api_key=self.credentials,
+                forum=self.group_name
+        )
+
+        # prepare url params
+        params_comments = {}
+        for k in base_params.keys():
+            params_comments[k] = base_params[k]
+
+        params_comments['thread'] = thread_id
 
-                # Prepare for next URL call
-                params = {}
+        # make api call
+        results_comments = self.get(list_posts_url, params_comments)
+        cursor_comments = results_comments['cursor']
+        responses_comments = results_comments['response']
+
+        # Save comments for this thread
+        thread_comments = []
+        last_post = None
+
+        while True:
+            for comment in responses_comments:
+                # Save comment info
+                msg = "    + %s"%(comment['message'])
+                logging.info(msg)
+
+                thread_comments.append(comment['message'])
+                created = comment.get('createdAt')
+                if created is not None and (last_post is None or created > last_post):
+                    last_post = created
+
+            if cursor_comments['hasNext']:
+
+                # Prepare for the next URL call
+                params_comments = {}
                 for k in base_params.keys():
-                    params[k] = base_params[k]
-                params['cursor'] = cursor['next']
+                    params_comments[k] = base_params[k]
+                params_comments['thread'] = thread_id
+                params_comments['cursor'] = cursor_comments['next']
 
                 # Make the next URL call
-                results = requests.request('GET', list_threads_url, params=params).json()
-                cursor = results['cursor']
-                responses = results['response']
+                results_comments = self.get(list_posts_url, params_comments)
+                cursor_comments = results_comments['cursor']
+                responses_comments = results_comments['response']
 
             else:
-                break
-
-        self.threads = threads
+               break
 
+        return thread_comments, last_post
@@ -0,0 +1,150 @@
+import os, io
+import tempfile
+import pypandoc
+from zipfile import ZipFile, BadZipFile
+from xml.etree import ElementTree
+
+
+"""
+Plain text extraction for docx files.
+
+A docx file is a zip archive; the text of the
+document lives in word/document.xml. This module
+streams that XML straight out of the (in-memory)
+zip archive and pulls out the text, paragraph by
+paragraph, without starting a pandoc process.
+
+Anything this can't handle raises a DocxException,
+and the caller should fall back to pandoc
+(pandoc_docx_to_text).
+"""
+
+
+class DocxException(Exception):
+    pass
+
+
+W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+MC = '{http://schemas.openxmlformats.org/markup-compatibility/2006}'
+
+# Parts of the archive that contain text, in order
+DOCX_TEXT_PARTS = ['word/document.xml', 'word/footnotes.xml', 'word/endnotes.xml']
+
+
+def docx_to_text(docx):
+    """
+    Extract the plain text from a docx file.
+    docx can be the bytes of the file, or a
+    file-like object opened in binary mode.
+
+    Paragraphs (including the paragraphs in
+    table cells) are separated by blank lines.
+    """
+    if isinstance(docx, (bytes, bytearray)):
+        docx = io.BytesIO(docx)
+
+    try:
+        with ZipFile(docx) as z:
+            names = set(z.namelist())
+            if DOCX_TEXT_PARTS[0] not in names:
+                raise DocxException("Not a docx file: no %s in archive"%(DOCX_TEXT_PARTS[0]))
+
+            paragraphs = []
+            for part in DOCX_TEXT_PARTS:
+                if part in names:
+                    with z.open(part) as f:
+                        paragraphs.extend(iter_paragraphs(f))
+
+    except BadZipFile as e:
+        raise DocxException("Not a docx file: %s"%(e))
+    except ElementTree.ParseError as e:
+        raise DocxException("Could not parse docx XML: %s"%(e))
+
+    return "\n\n".join(paragraphs) + "\n"
+
+
+def iter_paragraphs(f):
+    """
+    Stream a WordprocessingML part and yield the
+    text of each non-empty paragraph. Paragraphs
+    are cleared as soon as they have been read, so
+    memory use does not grow with document size.
+
+    A text box holds paragraphs of its own, inside
+    a paragraph of the document: those are yielded
+    separately, before the paragraph around them.
+    """
+    # Tags of the open elements, the text pieces of
+    # the open paragraphs (innermost last), and the
+    # depth of markup-compatibility fallbacks (which
+    # repeat the text of the content before them)
+    tags = []
+    paragraphs = []
+    fallback = 0
+    for event, elem in ElementTree.iterparse(f, events=('start', 'end')):
+        tag = elem.tag
+
+        if event == 'start':
+            tags.append(tag)
+            if tag == W+'p':
+                paragraphs.append([])
+            elif tag == MC+'Fallback':
+                fallback += 1
+            continue
+
+        tags.pop()
+
+        if tag == W+'p':
+            text = ''.join(paragraphs.pop()).strip()
+            elem.clear()
+            if text and not fallback:
+                yield text
+            continue
+
+        if tag == MC+'Fallback':
+            fallback -= 1
+            continue
+
+        if fallback or len(paragraphs) == 0:
+            continue
+        pieces = paragraphs[-1]
+
+        if tag == W+'t':
+            if elem.text:
+                pieces.append(elem.text)
+
+        elif tag == W+'tab':
+            # Only tabs in runs, not the tab stops
+            # of the paragraph properties (w:tabs)
+            if len(tags) > 0 and tags[-1] == W+'r':
+                pieces.append('\t')
+
+        elif tag == W+'br' or tag == W+'cr':
+            pieces.append('\n')
+
+
+def pandoc_docx_to_text(docx, scratch_dir=None):
+    """
+    Extract the plain text from a docx file (bytes)
+    using pandoc. pandoc needs a real input file, so
+    the docx is written to a uniquely named temporary
+    file in scratch_dir (default: the system temporary
+    directory), which is removed as soon as pandoc is
+    done. The output is read from pandoc's stdout.
+
+    Raises a DocxException if pandoc fails.
+    """
+    fd, fullpath_input = tempfile.mkstemp(suffix='.docx', dir=scratch_dir)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(docx)
+
+        # Try to convert docx file to plain text
+        try:
+            return pypandoc.convert_file(fullpath_input, 'plain', format='docx')
+        except (RuntimeError, OSError) as e:
+            raise DocxException("pandoc failed: %s"%(e))
+
+    finally:
+        # No matter what happens, clean up.
+        os.remove(fullpath_input)
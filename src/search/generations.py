@@ -0,0 +1,152 @@
+import os
+import re
+import shutil
+import logging
+import tempfile
+
+from .const import DEFAULT_INDEX_KEEP_GENERATIONS
+
+
+"""
+Search index generations.
+
+A full rebuild of the search index never touches the
+live index. Instead, the new index is built in a new
+generation directory inside INDEX_DIR:
+
+    INDEX_DIR/
+        CURRENT              <- name of the live generation
+        generation-000001/   <- live Whoosh index, and the
+                                sync state of the sources
+        generation-000002/   <- rebuild in progress
+        http_cache/          <- shared by all generations
+
+Once the rebuild is complete, the CURRENT pointer file
+is replaced (atomically, with a rename), so a Search
+object opened at any time sees either the old index
+or the new one, never a partial or empty index. Old
+generations are then removed, keeping the last few so
+that searchers still reading them are not disturbed.
+
+An INDEX_DIR without a CURRENT file is a plain Whoosh
+index (the layout from before generations), which is
+used as is until the first rebuild.
+"""
+
+
+# Name of the pointer file in INDEX_DIR
+CURRENT_FILE = "CURRENT"
+
+GENERATION_PREFIX = "generation-"
+GENERATION_RE = re.compile(r'^generation-(\d+)$')
+
+# Files of a plain Whoosh index (and of the sync
+# state kept next to it) in INDEX_DIR, removed once
+# the first generation is live
+PLAIN_INDEX_RE = re.compile(r'^(_?MAIN_.*|.*_sync\.json)$')
+
+
+def get_current_generation(root_folder):
+    """
+    Name of the live generation of the index in
+    root_folder, or None if there is no pointer
+    file (a plain index, or no index yet).
+    """
+    path = os.path.join(root_folder, CURRENT_FILE)
+    try:
+        with open(path, 'r') as f:
+            name = f.read().strip()
+    except IOError:
+        return None
+    if GENERATION_RE.match(name) is None or not os.path.isdir(os.path.join(root_folder, name)):
+        err = "ERROR: Index pointer file %s names no generation: %s"%(path, name)
+        logging.error(err)
+        return None
+    return name
+
+
+def list_generations(root_folder):
+    """
+    Names of all generation directories in
+    root_folder, oldest first.
+    """
+    if not os.path.isdir(root_folder):
+        return []
+    generations = []
+    for name in os.listdir(root_folder):
+        m = GENERATION_RE.match(name)
+        if m is not None and os.path.isdir(os.path.join(root_folder, name)):
+            generations.append((int(m.group(1)), name))
+    return [name for n, name in sorted(generations)]
+
+
+def new_generation(root_folder):
+    """
+    Create the directory of a new (empty) generation
+    in root_folder, and return its name.
+    """
+    if not os.path.isdir(root_folder):
+        os.makedirs(root_folder)
+    generations = list_generations(root_folder)
+    n = 1
+    if len(generations) > 0:
+        n = int(GENERATION_RE.match(generations[-1]).group(1)) + 1
+    while True:
+        name = "%s%06d"%(GENERATION_PREFIX, n)
+        try:
+            os.mkdir(os.path.join(root_folder, name))
+            return name
+        except FileExistsError:
+            # Another rebuild got there first
+            n += 1
+
+
+def set_current_generation(root_folder, name):
+    """
+    Make generation name the live index, by
+    replacing the pointer file in one rename.
+    """
+    fd, temp_path = tempfile.mkstemp(dir=root_folder, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        f.write(name + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, os.path.join(root_folder, CURRENT_FILE))
+
+
+def remove_generation(root_folder, name):
+    """
+    Remove a generation directory
+    (e.g. a failed rebuild).
+    """
+    shutil.rmtree(os.path.join(root_folder, name), ignore_errors=True)
+
+
+def collect_generations(root_folder, keep=DEFAULT_INDEX_KEEP_GENERATIONS):
+    """
+    Remove the generations older than the live one,
+    except for the keep most recent of them, and the
+    plain index in root_folder (if any). Generations
+    newer than the live one may be rebuilds still in
+    progress, and are left alone.
+
+    Returns the names of the generations removed.
+    """
+    current = get_current_generation(root_folder)
+    if current is None:
+        return []
+
+    generations = list_generations(root_folder)
+    older = generations[:generations.index(current)]
+    removed = older[:max(0, len(older)-keep)]
+    for name in removed:
+        remove_generation(root_folder, name)
+        msg = "centillion.search: Removed old index generation %s"%(name)
+        logging.info(msg)
+
+    for name in os.listdir(root_folder):
+        path = os.path.join(root_folder, name)
+        if PLAIN_INDEX_RE.match(name) is not None and os.path.isfile(path):
+            os.remove(path)
+
+    return removed
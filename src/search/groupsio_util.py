@@ -1,15 +1,17 @@
-import requests, os, io, re
+import os, io, re
 import json
 import logging
 
 import dateutil.parser
 import datetime
 
+import email
 from zipfile import ZipFile, BadZipFile
-from mailbox import mbox
 
 from bs4 import BeautifulSoup
 
+from .http_client import get_http_client
+
 class GroupsIOException(Exception):
     pass
 
@@ -41,7 +43,20 @@ def get_mbox_archives(groupsio_token,config):
     }
     """
     final_archive = {}
+    for permalink, archive_item in iter_mbox_archives(groupsio_token,config):
+        # Don't overwrite items already in the archive
+        if permalink not in final_archive:
+            final_archive[permalink] = archive_item
+    return final_archive
+
 
+def iter_mbox_archives(groupsio_token,config):
+    """
+    Use the Groups.io API to obtain an mbox file
+    for every subgroup, and yield the email threads
+    in each one as (permalink, archive item) tuples
+    (see get_mbox_archives), one at a time.
+    """
     subgroup_ids = get_all_subgroups(groupsio_token)
 
     for j, subgroup_id in enumerate(subgroup_ids.keys()):
@@ -49,37 +64,29 @@ def get_mbox_archives(groupsio_token,config):
         subgroup_name = subgroup_ids[subgroup_id]
 
         try:
-            # This function call below will call
-            # get_archive_zip for each subgroup,
-            # and extract the mbox contents from
-            # the zip file.
-            html = extract_mbox_from_zip(subgroup_name, subgroup_id, groupsio_token)
-            if html is None:
+            # Get the zip file for this subgroup;
+            # it stays in memory, and the mbox file
+            # is streamed out of it
+            z = get_archive_zip(subgroup_name, subgroup_id, groupsio_token)
+            if z is None:
                 raise Exception("Could not extract mbox")
+            f = open_mbox_in_zip(z)
 
         except:
             logging.exception("FAILURE: Could not process mailbox for subgroup %s"%(subgroup_name))
             # skip the rest and continue with the loop
             continue
 
-        # Now extract each email thread and 
-        # add to final_archive dictionary
-        subgroup_archive = extract_threads_from_mbox(html, subgroup_name)
-
+        # Now extract each email thread
         # keys = permalinks
         # values = dictionary of thread info
-
-        # Merge subgroup archive into final archive
-        merge_dicts(
-                merge_from = subgroup_archive,
-                merge_into = final_archive
-        )
+        with f:
+            for item in iter_threads_from_mbox(f, subgroup_name):
+                yield item
 
         if config['TESTING'] is True and j>=1:
             break
 
-    return final_archive
-
 
 def merge_dicts(merge_from,merge_into):
     """
@@ -97,37 +104,45 @@ def extract_threads_from_mbox(mbox_file, subgroup_name):
     This comes after you've already downloaded the 
     zip file from the Groups.io API, extracted the
     HTML contents of the mbox file, and passed it 
-    here (mbox_file).
-    """
-    subgroup_archive = {}
-
-    # Clean up temporary mbox file
-    tempf = '.delete_me'
-    if os.path.exists(tempf):
-        os.remove(tempf)
+    here (mbox_file, the bytes of the mbox file or
+    a binary file object).
 
-    # Dump temporary mbox file
-    with open(tempf,'wb') as f:
-        f.write(mbox_file)
-
-    # Read temporary mbox file
-    m = mbox(tempf)
+    Returns a dictionary of archive items keyed
+    by permalink (see iter_threads_from_mbox).
+    """
+    if isinstance(mbox_file, (bytes, bytearray)):
+        mbox_file = io.BytesIO(mbox_file)
 
-    # Delete temporary mbox file
-    os.remove(tempf)
+    subgroup_archive = {}
+    for permalink, archive_item in iter_threads_from_mbox(mbox_file, subgroup_name):
+        subgroup_archive[permalink] = archive_item
+    return subgroup_archive
 
-    msgs = m.items()
-    n_msgs = len(msgs)
 
+def iter_threads_from_mbox(f, subgroup_name, after=0):
+    """
+    Stream an mbox file (a binary file object) and
+    yield a (permalink, archive item) tuple for each
+    message, one at a time. Only one message is held
+    in memory at a time.
+
+    Messages are numbered from 1 in the order they
+    appear in the mbox file. If after is given, the
+    first after messages are skipped without being
+    parsed.
+    """
     logging.info("=============================")
-    logging.info("Processing mbox %s with %s messages"%(tempf,n_msgs))
+    logging.info("Processing mbox for subgroup %s"%(subgroup_name))
 
     findall_email_pattern  = re.compile('.*<.*>')
     finditer_email_pattern = re.compile('"(.*)" <(.*)>')
 
-    for i,msg in msgs:
+    short_subgroup_name = get_short_subgroup_name(subgroup_name)
+
+    n_msgs = 0
+    for i, msg in enumerate(iter_mbox_messages(f, skip=after), after):
 
-        logging.info("Processing message %02d of %02d"%(i+1, n_msgs))
+        logging.info("Processing message %02d"%(i+1))
 
         #{
         #    <permalink> : {
@@ -141,13 +156,12 @@ def extract_threads_from_mbox(mbox_file, subgroup_name):
         #                }
         #}
 
-        short_subgroup_name = re.findall('\+(.*)$',subgroup_name)[0]
-
-        permalink = "https://dcppc.groups.io/g/%s/message/%d"%(short_subgroup_name,i+1)
+        permalink = message_permalink(short_subgroup_name,i+1)
 
         archive_item = {}
 
         archive_item['permalink']   = permalink
+        archive_item['number']      = i+1
         archive_item['date']        = msg['Date']
         archive_item['subject']     = msg['Subject']
         archive_item['subgroup']    = short_subgroup_name
@@ -170,6 +184,7 @@ def extract_threads_from_mbox(mbox_file, subgroup_name):
             raise Exception(err)
 
         # process the email content
+        body = b''
         if msg.is_multipart():
             for part in msg.walk():
                 if part.is_multipart():
@@ -183,9 +198,165 @@ def extract_threads_from_mbox(mbox_file, subgroup_name):
 
         archive_item['content'] = str(body)
 
-        subgroup_archive[permalink] = archive_item
+        n_msgs += 1
+        yield permalink, archive_item
+
+    logging.info("Processed %d messages for subgroup %s"%(n_msgs, subgroup_name))
+
+
+def get_short_subgroup_name(subgroup_name):
+    """
+    Subgroup names look like dcppc+subgroup;
+    return the part after the +.
+    """
+    return re.findall(r'\+(.*)$',subgroup_name)[0]
+
+
+def message_permalink(short_subgroup_name, number):
+    """
+    Permalink of message number number (starting
+    from 1) in a subgroup's archive.
+    """
+    return "https://dcppc.groups.io/g/%s/message/%d"%(short_subgroup_name,number)
 
-    return subgroup_archive
+
+def iter_mbox_messages(f, skip=0):
+    """
+    Stream an mbox file (a binary file object),
+    yielding one email.message.Message at a time.
+    Like the mailbox module, every line starting
+    with "From " starts a new message.
+
+    The first skip messages are not parsed
+    (or yielded).
+    """
+    for i, lines in enumerate(iter_mbox_chunks(f)):
+        if i >= skip:
+            yield parse_mbox_message(lines)
+
+
+def iter_mbox_chunks(f):
+    """
+    Stream an mbox file (a binary file object),
+    yielding the lines of one message at a time,
+    without the From line that starts it.
+    """
+    lines = []
+    started = False
+    for line in f:
+        if line.startswith(b'From '):
+            if started:
+                yield lines
+            # The From line is not part of the message
+            lines = []
+            started = True
+            continue
+        if started:
+            lines.append(line)
+
+    if started:
+        yield lines
+
+
+def count_mbox_messages(f):
+    """
+    Count the messages in an mbox file
+    (a binary file object), without
+    parsing them.
+    """
+    n = 0
+    for line in f:
+        if line.startswith(b'From '):
+            n += 1
+    return n
+
+
+def parse_mbox_message(lines):
+    """
+    Parse the lines of one mbox message. The blank
+    line separating it from the next message is not
+    part of it.
+    """
+    if len(lines) > 0 and lines[-1].strip() == b'':
+        lines = lines[:-1]
+    return email.message_from_bytes(b''.join(lines))
+
+
+def open_mbox_in_zip(z):
+    """
+    Open the mbox file in the (in-memory) zip file
+    for a subgroup, as a binary file object that
+    decompresses it as it is read.
+    """
+    mbox_filename = 'messages.mbox'
+    return z.open(mbox_filename)
+
+
+def crawl_subgroup(subgroup_id, subgroup_name, groupsio_token, after=0, client=None):
+    """
+    Download the archive of one subgroup, to extract
+    the messages numbered after the watermark after
+    (the highest message number seen on the last run).
+    This is safe to call from worker threads.
+
+    Returns a SubgroupCrawl, which parses the new
+    messages as it is iterated over, or None if the
+    archive can't be downloaded.
+    """
+    z = get_archive_zip(subgroup_name, subgroup_id, groupsio_token, client=client)
+    if z is None:
+        return None
+    return SubgroupCrawl(z, subgroup_name, after)
+
+
+class SubgroupCrawl(object):
+    """
+    The new messages in the (downloaded) archive of
+    one subgroup. Iterating over it yields the archive
+    items (see get_mbox_archives) of the new messages,
+    parsed one at a time, so memory use does not grow
+    with the size of the archive. Once the iteration
+    is done:
+    - highest is the highest message number in
+      the archive
+    - reset is True if the archive has fewer messages
+      than the watermark (messages were deleted, so
+      the numbering changed), in which case every
+      message in the archive was yielded
+    - count is the number of messages yielded
+    """
+    def __init__(self, z, subgroup_name, after=0):
+        self.z = z
+        self.subgroup_name = subgroup_name
+        self.after = after
+        self.highest = None
+        self.reset = False
+        self.count = 0
+
+    def __iter__(self):
+        with self.z:
+            with open_mbox_in_zip(self.z) as f:
+                for permalink, item in iter_threads_from_mbox(f, self.subgroup_name, self.after):
+                    self.count += 1
+                    self.highest = item['number']
+                    yield item
+            if self.count > 0:
+                return
+
+            # No new messages: check whether the
+            # archive has shrunk below the watermark
+            with open_mbox_in_zip(self.z) as f:
+                self.highest = count_mbox_messages(f)
+            if self.highest >= self.after:
+                return
+
+            msg = "Subgroup %s has %d messages, fewer than the %d seen on the last run; re-indexing it"%(self.subgroup_name, self.highest, self.after)
+            logging.warning(msg)
+            self.reset = True
+            with open_mbox_in_zip(self.z) as f:
+                for permalink, item in iter_threads_from_mbox(f, self.subgroup_name):
+                    self.count += 1
+                    yield item
 
 
 def extract_mbox_from_zip(subgroup_name, subgroup_id, groupsio_token):
@@ -195,19 +366,18 @@ def extract_mbox_from_zip(subgroup_name, subgroup_id, groupsio_token):
     """
     z = get_archive_zip(subgroup_name, subgroup_id, groupsio_token)
     if z is not None:
-        file_contents = {name:z.read(name) for name in z.namelist()}
-        mbox_filename = 'messages.mbox'
-        html = file_contents[mbox_filename]
-        if os.path.exists(mbox_filename):
-            os.remove(mbox_filename)
-        return html
+        with open_mbox_in_zip(z) as f:
+            return f.read()
 
 
-def get_all_subgroups(groupsio_token):
+def get_all_subgroups(groupsio_token, client=None):
     """
     Returns a dictionary where keys are subgroup ids
     and values are subgroup names
     """
+    if client is None:
+        client = get_http_client()
+
     MAX_GROUPS=100
     url = 'https://api.groups.io/v1/getsubgroups'
 
@@ -216,7 +386,7 @@ def get_all_subgroups(groupsio_token):
     data = [ ('group_name','dcppc'),
              ('limit',MAX_GROUPS)]
 
-    response = requests.post(url,data=data,auth=(key,''))
+    response = client.post(url,data=data,auth=(key,''))
     response = response.json()
     try:
         dat = response['data']
@@ -224,7 +394,7 @@ def get_all_subgroups(groupsio_token):
         msg = "ERROR: Groups.io utility: Could not get subgroups"
         logging.error(msg)
         logging.error(response)
-        raise Exception(msg)
+        raise GroupsIOException(msg)
 
     all_subgroups = {}
     for group in dat:
@@ -232,11 +402,14 @@ def get_all_subgroups(groupsio_token):
     return all_subgroups
 
 
-def get_archive_zip(group_name, group_id, groupsio_token): 
+def get_archive_zip(group_name, group_id, groupsio_token, client=None): 
     """
     Use the API to extract a zipped .mbox email archive
     for one subgroup, and return the contents as z.
     """
+    if client is None:
+        client = get_http_client()
+
     url = "https://api.groups.io/v1/downloadarchives"
     
     key = groupsio_token
@@ -246,11 +419,10 @@ def get_archive_zip(group_name, group_id, groupsio_token):
     msg = "get_archive_zip(): getting .mbox archive for subgroup %s (%s)"%(group_name,group_id)
     logging.info(msg)
 
-    r = requests.post(url,data=data,auth=(key,''),stream=True)
+    r = client.post(url,data=data,auth=(key,''),stream=True)
     
     try:
         z = ZipFile(io.BytesIO(r.content))
-        z.extractall()
 
         msg = "SUCCESS: subgroup %s worked"%(group_name)
         logging.info(msg)
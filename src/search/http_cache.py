@@ -0,0 +1,204 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from .const import DEFAULT_HTTP_CACHE_MAX_MB
+
+
+"""
+On-disk HTTP response cache with conditional requests.
+
+Responses that come with an ETag or Last-Modified
+validator are saved in the cache directory. The next
+time the same URL is requested (with the same auth
+scope), the validators are sent back as If-None-Match
+and If-Modified-Since; if the server answers 304 Not
+Modified, the saved response is used. The Github API
+does not count 304 responses against the rate limit.
+
+Entries are keyed by a hash of the URL and of the
+Authorization header, so responses are never shared
+between tokens, and tokens are never written to disk.
+Each entry is a .json file (validators and headers)
+and a .body file.
+
+The cache is bounded in size; prune() removes the
+least recently used entries until it fits.
+"""
+
+
+# Response headers saved with each entry
+CACHED_HEADERS = ['Content-Type', 'ETag', 'Last-Modified']
+
+
+class HttpCache(object):
+
+    def __init__(self, cache_dir, max_mb=DEFAULT_HTTP_CACHE_MAX_MB):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_mb*1024*1024)
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.lock = threading.Lock()
+
+
+    def key(self, url, headers=None):
+        """
+        Cache key for url, requested with headers:
+        a hash of the url and the auth scope
+        """
+        auth = ''
+        if headers is not None:
+            auth = headers.get('Authorization', '')
+        scope = hashlib.sha256(auth.encode('utf-8')).hexdigest()
+        return hashlib.sha256((url + '\n' + scope).encode('utf-8')).hexdigest()
+
+
+    def paths(self, key):
+        base = os.path.join(self.cache_dir, key)
+        return base + '.json', base + '.body'
+
+
+    def load(self, key):
+        """
+        Load the cache entry for key.
+        Returns (metadata, body), or None.
+        """
+        meta_path, body_path = self.paths(key)
+        try:
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+            with open(body_path, 'rb') as f:
+                body = f.read()
+        except (IOError, OSError, ValueError):
+            return None
+        # Mark the entry as recently used
+        try:
+            os.utime(meta_path, None)
+        except OSError:
+            pass
+        return meta, body
+
+
+    def store(self, key, url, response):
+        """
+        Save a response with its validators.
+        Responses without validators are not saved.
+        """
+        headers = {h : response.headers[h] for h in CACHED_HEADERS if h in response.headers}
+        if 'ETag' not in headers and 'Last-Modified' not in headers:
+            return
+
+        meta_path, body_path = self.paths(key)
+        meta = dict(url = url, headers = headers)
+        # Write the body first, and swap each
+        # file in atomically, so readers never
+        # see a half-written entry
+        for path, mode, data in [(body_path, 'wb', response.content), (meta_path, 'w', meta)]:
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            try:
+                with os.fdopen(fd, mode) as f:
+                    if mode=='w':
+                        json.dump(data, f)
+                    else:
+                        f.write(data)
+                os.replace(tmp_path, path)
+            except:
+                os.remove(tmp_path)
+                raise
+
+        with self.lock:
+            self.stored += 1
+
+
+    def get(self, client, url, headers=None, **kwargs):
+        """
+        GET url with the HTTP client, using (and
+        updating) the cache. Returns a requests
+        Response; a response served from the cache
+        has status 200 and from_cache set to True.
+        """
+        key = self.key(url, headers)
+        entry = self.load(key)
+
+        request_headers = dict(headers or {})
+        if entry is not None:
+            meta, body = entry
+            if 'ETag' in meta['headers']:
+                request_headers['If-None-Match'] = meta['headers']['ETag']
+            if 'Last-Modified' in meta['headers']:
+                request_headers['If-Modified-Since'] = meta['headers']['Last-Modified']
+
+        response = client.get(url, headers=request_headers, **kwargs)
+
+        if response.status_code == 304 and entry is not None:
+            with self.lock:
+                self.hits += 1
+            cached = requests.Response()
+            cached.status_code = 200
+            cached.url = url
+            cached.headers = CaseInsensitiveDict(meta['headers'])
+            cached._content = body
+            cached.encoding = response.encoding
+            cached.from_cache = True
+            return cached
+
+        with self.lock:
+            self.misses += 1
+        if response.status_code == 200:
+            self.store(key, url, response)
+        response.from_cache = False
+        return response
+
+
+    def prune(self):
+        """
+        Remove the least recently used entries
+        until the cache is under its size limit.
+        Returns the number of entries removed.
+        """
+        entries = []
+        total = 0
+        names = set(os.listdir(self.cache_dir))
+        for name in names:
+            if name.endswith('.body') and name[:-len('.body')]+'.json' not in names:
+                # Left over from an interrupted store
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except OSError:
+                    pass
+            if not name.endswith('.json'):
+                continue
+            meta_path, body_path = self.paths(name[:-len('.json')])
+            try:
+                used = os.path.getmtime(meta_path)
+                nbytes = os.path.getsize(meta_path) + os.path.getsize(body_path)
+            except OSError:
+                continue
+            entries.append((used, nbytes, meta_path, body_path))
+            total += nbytes
+
+        removed = 0
+        for used, nbytes, meta_path, body_path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            for path in [meta_path, body_path]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= nbytes
+            removed += 1
+        return removed
+
+
+    def summary(self):
+        """One line summary of the cache counters"""
+        return "HTTP cache: %d hits, %d misses, %d stored"%(self.hits, self.misses, self.stored)
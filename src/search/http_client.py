@@ -0,0 +1,196 @@
+import threading
+import requests
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .const import DEFAULT_HTTP_TIMEOUT, DEFAULT_HTTP_RETRIES, DEFAULT_HTTP_BACKOFF, \
+        DEFAULT_HTTP_POOL_SIZE, DEFAULT_HTTP_MAX_PER_HOST, DEFAULT_GITHUB_RATE_LIMIT_RESERVE
+from .rate_limit import get_rate_limiter
+
+
+"""
+Shared HTTP client for the crawlers.
+
+Every crawler (Google Drive exports, Github files,
+Disqus, Groups.io, Hypothesis) makes its HTTP calls
+through one HttpClient, so that connections are
+pooled and kept alive per host instead of opened
+(with a new TLS handshake) for every request.
+
+The client also sets a default timeout on every
+request, retries failed requests (connection errors,
+429 and 5xx responses) with exponential backoff, and
+caps the number of concurrent requests to each host,
+so that crawler worker threads can't flood one API.
+Requests to rate limited APIs (RATE_LIMITED_HOSTS)
+are paced by the API's rate limiter (see rate_limit.py),
+and requests refused because the rate limit was used
+up are made again once it resets.
+
+Use get_http_client() to get the process-wide client,
+and configure_http_client(config) to (re)create it
+from the centillion config.
+"""
+
+
+# Responses with these status codes are retried
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Hosts whose requests go through a rate limiter,
+# and the name of the rate limiter
+GITHUB_API = "Github API"
+DISQUS_API = "Disqus API"
+RATE_LIMITED_HOSTS = {
+        'api.github.com' : GITHUB_API,
+        'disqus.com' : DISQUS_API
+}
+
+# Number of times a request refused because the
+# rate limit was used up is made again
+RATE_LIMIT_ATTEMPTS = 3
+
+
+class HttpClient(object):
+
+    def __init__(self,
+                 timeout=DEFAULT_HTTP_TIMEOUT,
+                 retries=DEFAULT_HTTP_RETRIES,
+                 backoff=DEFAULT_HTTP_BACKOFF,
+                 pool_size=DEFAULT_HTTP_POOL_SIZE,
+                 max_per_host=DEFAULT_HTTP_MAX_PER_HOST):
+        """
+        timeout:        default (connect, read) timeout in seconds
+        retries:        number of times to retry a failed request
+        backoff:        backoff factor; retries wait backoff*2^n seconds
+                        (or as long as the Retry-After header says)
+        pool_size:      number of kept-alive connections per host
+        max_per_host:   maximum number of concurrent requests per host
+        """
+        self.timeout = timeout
+        self.max_per_host = max_per_host
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+                pool_connections=pool_size,
+                pool_maxsize=pool_size,
+                max_retries=make_retry(retries, backoff)
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self.host_semaphores = {}
+        self.lock = threading.Lock()
+
+
+    def host_semaphore(self, url):
+        """
+        Return the semaphore capping the number of
+        concurrent requests to the host of url.
+        """
+        host = urlsplit(url).netloc.lower()
+        with self.lock:
+            if host not in self.host_semaphores:
+                self.host_semaphores[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self.host_semaphores[host]
+
+
+    def request(self, method, url, **kwargs):
+        """
+        Make an HTTP request, like requests.request,
+        using the pooled session. If no timeout is
+        given, the default timeout is used.
+
+        Note that with stream=True, the host slot is
+        released once the headers have been received,
+        before the body is read.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+
+        limiter = None
+        host = urlsplit(url).netloc.lower()
+        if host in RATE_LIMITED_HOSTS:
+            limiter = get_rate_limiter(RATE_LIMITED_HOSTS[host])
+
+        for attempt in range(RATE_LIMIT_ATTEMPTS):
+            if limiter is not None:
+                limiter.wait()
+            with self.host_semaphore(url):
+                response = self.session.request(method, url, **kwargs)
+            if limiter is None:
+                break
+            limiter.update_from_headers(response.headers)
+            if not limiter.is_rate_limited(response):
+                break
+        return response
+
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+
+    def close(self):
+        self.session.close()
+
+
+def make_retry(retries, backoff):
+    """
+    Make the urllib3 Retry policy: retry connection
+    errors and RETRY_STATUS_CODES responses for any
+    method (the POST calls the crawlers make are
+    read-only), honoring Retry-After headers.
+    """
+    kwargs = dict(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=RETRY_STATUS_CODES,
+            raise_on_status=False,
+            respect_retry_after_header=True
+    )
+    try:
+        return Retry(allowed_methods=None, **kwargs)
+    except TypeError:
+        # urllib3 < 1.26
+        return Retry(method_whitelist=False, **kwargs)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_http_client():
+    """
+    Return the process-wide HTTP client,
+    creating it with the defaults if needed.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HttpClient()
+        return _client
+
+
+def configure_http_client(config):
+    """
+    (Re)create the process-wide HTTP client from
+    the HTTP_* settings in the centillion config.
+    """
+    global _client
+    client = HttpClient(
+            timeout = config.get('HTTP_TIMEOUT', DEFAULT_HTTP_TIMEOUT),
+            retries = config.get('HTTP_RETRIES', DEFAULT_HTTP_RETRIES),
+            backoff = config.get('HTTP_BACKOFF', DEFAULT_HTTP_BACKOFF),
+            pool_size = config.get('HTTP_POOL_SIZE', DEFAULT_HTTP_POOL_SIZE),
+            max_per_host = config.get('HTTP_MAX_PER_HOST', DEFAULT_HTTP_MAX_PER_HOST)
+    )
+    get_rate_limiter(GITHUB_API).reserve = config.get('GITHUB_RATE_LIMIT_RESERVE', DEFAULT_GITHUB_RATE_LIMIT_RESERVE)
+
+    # The old client is not closed, since
+    # other threads may still be using it
+    with _client_lock:
+        _client = client
+    return client
@@ -1,54 +1,109 @@
-import requests
 import json
 import os
 import logging
 
-def get_headers():
+from .http_client import get_http_client
+from .const import DEFAULT_HYPOTHESIS_URL_PATTERN
 
-    if 'HYPOTHESIS_TOKEN' in os.environ:
-        token = os.environ['HYPOTHESIS_TOKEN']
-    else:
-        raise Exception("Need to specify Hypothesis token with HYPOTHESIS_TOKEN env var")
+
+"""
+Hypothesis annotations.
+
+Annotations are listed with the Hypothesis search
+API, sorted by the time they were last updated
+(oldest first), one page at a time. Each page asks
+for the annotations updated after the last one on
+the previous page (a search_after cursor), so the
+listing can start from the last updated time seen
+on the previous run.
+"""
+
+
+HYPOTHESIS_API = 'https://hypothes.is/api'
+
+# Largest page of annotations the search API returns
+SEARCH_LIMIT = 200
+
+
+class HypothesisException(Exception):
+    pass
+
+
+def get_headers(token=None):
+
+    if token is None:
+        if 'HYPOTHESIS_TOKEN' in os.environ:
+            token = os.environ['HYPOTHESIS_TOKEN']
+        else:
+            raise Exception("Need to specify Hypothesis token with HYPOTHESIS_TOKEN env var")
     
     auth_header = 'Bearer %s'%(token)
 
     return {'Authorization': auth_header}
 
 
-def basic_auth():
+def iter_annotation_pages(token=None,
+                          url_pattern=DEFAULT_HYPOTHESIS_URL_PATTERN,
+                          since=None,
+                          limit=SEARCH_LIMIT,
+                          client=None):
+    """
+    Page through the annotations on pages matching
+    url_pattern (a wildcard pattern), oldest updated
+    first, and yield one page (a list of annotations)
+    at a time.
 
-    url = ' https://hypothes.is/api'
+    since is an updated timestamp (as returned by
+    the API); only annotations updated after it
+    are listed.
 
-    # Get the authorization header
-    headers = get_headers()
+    client can be used to pass in an HTTP client
+    (or a fake one, for testing).
+    """
+    if client is None:
+        client = get_http_client()
 
-    # Make the request
-    response = requests.get(url, headers=headers)
+    url = HYPOTHESIS_API + '/search'
+    headers = get_headers(token)
 
-    if response.status_code==200:
+    params = dict(
+            wildcard_uri = url_pattern,
+            limit = limit,
+            sort = 'updated',
+            order = 'asc'
+    )
 
-        # Interpret results as JSON
-        dat = response.json()
+    search_after = since
+    while True:
+        if search_after is not None:
+            params['search_after'] = search_after
 
-        msg = json.dumps(dat, indent=4)
-        logging.info(msg)
+        response = client.get(url, headers=headers, params=params)
+        if response.status_code != 200:
+            err = "ERROR: Hypothesis search failed, response status code was not OK: %d"%(response.status_code)
+            logging.error(err)
+            raise HypothesisException(err)
 
-    else:
+        rows = response.json().get('rows', [])
+        if len(rows) == 0:
+            return
 
-        msg = "Response status code was not OK: %d"%(response.status_code)
-        logging.info(msg)
+        yield rows
 
+        if len(rows) < limit:
+            return
+        search_after = rows[-1]['updated']
 
-def list_annotations():
-    # kEaohJC9Eeiy_UOozkpkyA
 
-    url = 'https://hypothes.is/api/annotations/kEaohJC9Eeiy_UOozkpkyA'
+def basic_auth():
+
+    url = HYPOTHESIS_API
 
     # Get the authorization header
     headers = get_headers()
 
     # Make the request
-    response = requests.get(url, headers=headers)
+    response = get_http_client().get(url, headers=headers)
 
     if response.status_code==200:
 
@@ -64,21 +119,16 @@ def list_annotations():
         logging.info(msg)
 
 
-def search_annotations():
-    url = ' https://hypothes.is/api/search'
+def list_annotations():
+    # kEaohJC9Eeiy_UOozkpkyA
+
+    url = HYPOTHESIS_API + '/annotations/kEaohJC9Eeiy_UOozkpkyA'
 
     # Get the authorization header
     headers = get_headers()
 
-    # Set query params
-    params = dict(
-            url = '*pilot.nihdatacommons.us*',
-            limit = 200
-    )
-    #http://pilot.nihdatacommons.us/organize/CopperInternalDeliveryWorkFlow/',
-
     # Make the request
-    response = requests.get(url, headers=headers, params=params)
+    response = get_http_client().get(url, headers=headers)
 
     if response.status_code==200:
 
@@ -94,6 +144,21 @@ def search_annotations():
         logging.info(msg)
 
 
+def search_annotations():
+    """
+    Log every annotation on the pilot site.
+    """
+    n = 0
+    for rows in iter_annotation_pages():
+        for row in rows:
+            msg = json.dumps(row, indent=4)
+            logging.info(msg)
+        n += len(rows)
+
+    msg = "Found %d annotations"%(n)
+    logging.info(msg)
+
+
 if __name__=="__main__":
     search_annotations()
 
@@ -0,0 +1,344 @@
+import time
+import queue
+import logging
+import threading
+
+from concurrent.futures import wait, FIRST_COMPLETED
+
+from .const import DEFAULT_INDEX_BATCH_SIZE, DEFAULT_INDEX_QUEUE_SIZE
+
+
+"""
+Index pipeline.
+
+Each source of documents (Google Drive, Github
+issues, Github files, ...) is a Connector: a name,
+and an iterable (usually a generator) that lazily
+yields the changes the source wants to make to the
+search index:
+
+    - records (dictionaries of schema fields, built
+      by the Search make_*_record methods), which
+      are added to the index, replacing any document
+      with the same id
+    - Drop(id), to remove a document from the index
+      (within a commit, drops are applied before
+      records are added)
+    - Checkpoint(fn), to call fn once everything
+      yielded before it is in the index (this is
+      where a source saves its sync state)
+
+An IndexPipeline runs each connector in its own
+producer thread, and the producers put their items
+in one bounded queue. The calling thread is the
+single writer: it takes items off the queue and
+commits them to the index in batches. When the
+writer falls behind, the queue fills up and the
+producers block, so only a bounded number of
+records are ever held in memory, and fetching
+overlaps with indexing. Several sources can be
+run at once (run_all), sharing the one writer.
+
+A run can be cancelled by setting the cancel event
+passed to the pipeline: the writer commits what it
+has, stops the producers, and raises IndexCancelled.
+"""
+
+
+class IndexCancelled(Exception):
+    """
+    Raised by the pipeline when
+    its run has been cancelled.
+    """
+    pass
+
+
+class Drop(object):
+    """
+    Pipeline item: drop the
+    document with id from the index.
+    """
+    def __init__(self, id):
+        self.id = id
+
+
+class Checkpoint(object):
+    """
+    Pipeline item: call fn (with no arguments)
+    once every item before it is committed.
+    """
+    def __init__(self, fn):
+        self.fn = fn
+
+
+class Connector(object):
+    """
+    A source of documents for the index pipeline.
+
+    name:       name of the source, for the logs
+    items:      iterable of records, Drop and
+                Checkpoint items (see above)
+    batch_size: if given, commit whenever this many
+                records (and drops) of this source
+                are waiting, even if the pipeline
+                batch is not full
+    done:       if given, called with the connector
+                once all of its items are committed
+    """
+    def __init__(self, name, items, batch_size=None, done=None):
+        self.name = name
+        self.items = items
+        self.batch_size = batch_size
+        self.done = done
+
+        # Totals, filled in by the pipeline:
+        # records and drops written, seconds from the
+        # start of the run until everything was
+        # committed, and the exception the source
+        # failed with (if it did)
+        self.count = 0
+        self.dropped = 0
+        self.elapsed = None
+        self.error = None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def close(self):
+        """
+        Stop a generator that has not been
+        run to the end (e.g. after an error
+        in the writer), so it can clean up.
+        """
+        close = getattr(self.items, 'close', None)
+        if close is not None:
+            close()
+
+
+# Marks the end of a connector's items in the queue
+_END = object()
+
+
+class IndexPipeline(object):
+
+    def __init__(self, search, batch_size=DEFAULT_INDEX_BATCH_SIZE, queue_size=DEFAULT_INDEX_QUEUE_SIZE, writer_options=None, replace=True, cancel=None):
+        """
+        search:         the Search object whose index
+                        the records are written to
+        batch_size:     number of records (and drops)
+                        written per index commit
+        queue_size:     number of items the producers
+                        can get ahead of the writer
+        writer_options: keyword arguments for the
+                        index writer of each commit
+                        (e.g. bulk indexing options)
+        replace:        whether records replace indexed
+                        documents with the same ids
+                        (False when the index was empty
+                        at the start, see commit_records)
+        cancel:         threading.Event that cancels
+                        the run when it is set
+        """
+        self.search = search
+        self.writer_options = writer_options or {}
+        self.replace = replace
+        self.cancel = cancel
+        self.batch_size = max(1, batch_size)
+        self.queue_size = max(1, queue_size)
+
+        # Totals of the last run
+        self.count = 0
+        self.dropped = 0
+        self.commits = 0
+        self.elapsed = 0.0
+
+
+    def run(self, connector):
+        """
+        Run the connector, and write its items
+        to the index until it is done.
+
+        If the connector fails, what it yielded up
+        to that point is still committed, but the
+        checkpoints after that point never run, and
+        the exception is raised again here.
+        """
+        self.run_all([connector])
+        if connector.error is not None:
+            raise connector.error
+
+
+    def run_all(self, connectors):
+        """
+        Run the connectors concurrently, each in its
+        own producer thread, and write their items to
+        the index until they are all done.
+
+        If a connector fails, what it yielded up to
+        that point is still committed, but its
+        checkpoints after that point never run and
+        its done callback is not called; the other
+        connectors carry on. The exception is saved
+        in connector.error.
+
+        If the writer fails, every producer is
+        stopped, and the exception is raised.
+
+        If the run is cancelled, what is waiting is
+        committed, every producer is stopped, and
+        IndexCancelled is raised.
+        """
+        start = time.time()
+        self.count = 0
+        self.dropped = 0
+        self.commits = 0
+
+        q = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+
+        def put(item):
+            # Block while the queue is full, unless
+            # the writer has given up
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def produce(connector):
+            try:
+                for item in connector:
+                    if not put((connector, item)):
+                        connector.close()
+                        break
+            except Exception as e:
+                connector.error = e
+            finally:
+                put((connector, _END))
+
+        producers = []
+        for connector in connectors:
+            connector.count = 0
+            connector.dropped = 0
+            connector.elapsed = None
+            connector.error = None
+            producer = threading.Thread(target=produce, args=(connector,))
+            producer.daemon = True
+            producer.start()
+            producers.append(producer)
+
+        # Waiting to be committed: records, drops,
+        # checkpoints, and the number of records
+        # and drops of each connector
+        self.records = []
+        self.drops = []
+        self.checkpoints = []
+        self.pending = {}
+
+        try:
+            running = len(connectors)
+            while running > 0:
+                if self.cancel is not None and self.cancel.is_set():
+                    # Keep what was fetched (and the sync
+                    # state that goes with it)
+                    self.commit()
+                    raise IndexCancelled("Index update cancelled")
+                try:
+                    connector, item = q.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+
+                if item is _END:
+                    # Commit what the connector left, so
+                    # its checkpoints run and its time
+                    # is final
+                    running -= 1
+                    self.commit()
+                    connector.elapsed = time.time() - start
+                    if connector.error is None and connector.done is not None:
+                        connector.done(connector)
+                    continue
+
+                if isinstance(item, Drop):
+                    self.drops.append(item.id)
+                    connector.dropped += 1
+                elif isinstance(item, Checkpoint):
+                    self.checkpoints.append(item.fn)
+                    if len(self.records) + len(self.drops) == 0:
+                        # Nothing waiting to be committed
+                        self.commit()
+                    continue
+                else:
+                    self.records.append(item)
+                    connector.count += 1
+
+                n = self.pending.get(connector, 0) + 1
+                self.pending[connector] = n
+                if len(self.records) + len(self.drops) >= self.batch_size or \
+                        (connector.batch_size is not None and n >= connector.batch_size):
+                    self.commit()
+
+        except:
+            # Let the producers go, and wait for them
+            stop.set()
+            for producer in producers:
+                producer.join()
+            raise
+
+        for producer in producers:
+            producer.join()
+        self.elapsed = time.time() - start
+
+        for connector in connectors:
+            msg = "%s: indexed %d documents and dropped %d in %0.1f s"%(
+                    connector.name, connector.count, connector.dropped, connector.elapsed)
+            logging.info(msg)
+
+
+    def commit(self):
+        """
+        Commit the waiting records and drops to
+        the index (if there are any), then run
+        the checkpoints that were waiting for it.
+        """
+        records, drops, checkpoints = self.records, self.drops, self.checkpoints
+        self.records, self.drops, self.checkpoints = [], [], []
+        self.pending = {}
+
+        if len(records) + len(drops) > 0:
+            self.search.commit_records(records, drops, replace=self.replace, **self.writer_options)
+            self.count += len(records)
+            self.dropped += len(drops)
+            self.commits += 1
+        for fn in checkpoints:
+            fn()
+
+
+def iter_completed(executor, fn, args_list, max_pending):
+    """
+    Submit fn(*args) to executor for each args in
+    args_list, and yield (args, future) tuples as
+    the futures complete. At most max_pending calls
+    are submitted but not yet yielded at a time, so
+    that results don't pile up when the consumer
+    is slower than the workers.
+    """
+    pending = {}
+    args_iter = iter(args_list)
+
+    def fill():
+        while len(pending) < max(1, max_pending):
+            try:
+                args = next(args_iter)
+            except StopIteration:
+                return
+            pending[executor.submit(fn, *args)] = args
+
+    fill()
+    while len(pending) > 0:
+        done, _ = wait(list(pending.keys()), return_when=FIRST_COMPLETED)
+        for future in done:
+            yield pending.pop(future), future
+        fill()
@@ -0,0 +1,213 @@
+import time
+import datetime
+import logging
+import threading
+
+
+"""
+API rate limit budget.
+
+The Github API (and the Disqus API) say how many
+requests are left in the current rate limit window,
+and when the window resets, in the X-RateLimit-Remaining
+and X-RateLimit-Reset response headers.
+
+A RateLimiter keeps track of that budget for one API,
+across all the crawler threads using it. Before each
+request, wait() takes one request from the budget;
+when the budget is down to the reserve, it blocks
+until the window resets, instead of letting requests
+fail. After each response, update_from_headers()
+(or update_from_github(), for PyGithub calls) brings
+the budget back in line with what the API says.
+
+The HTTP client (see http_client.py) does this for
+every request to a host that has a rate limiter.
+Use get_rate_limiter(name) to get the process-wide
+rate limiter for an API.
+"""
+
+
+# Length of a rate limit window, in seconds
+RATE_LIMIT_WINDOW = 3600
+
+
+class RateLimiter(object):
+
+    def __init__(self, name, reserve=0):
+        """
+        name:       name of the API, for the logs
+        reserve:    number of requests to leave unused
+                    in each rate limit window
+        """
+        self.name = name
+        self.reserve = reserve
+
+        # Budget: requests remaining in the window,
+        # requests per window, and the time (epoch
+        # seconds) the window resets. None if unknown.
+        self.remaining = None
+        self.limit = None
+        self.reset = None
+
+        # Number of requests made, and number
+        # of seconds spent waiting for a reset
+        self.used = 0
+        self.waited = 0.0
+
+        self.cond = threading.Condition()
+
+
+    def wait(self):
+        """
+        Take one request from the budget, first
+        waiting for the rate limit window to reset
+        if the budget is used up.
+        """
+        with self.cond:
+            logged = False
+            while True:
+                now = time.time()
+                if self.remaining is None or self.remaining > self.reserve:
+                    if self.remaining is not None:
+                        self.remaining -= 1
+                    self.used += 1
+                    return
+
+                if self.reset is None or self.reset <= now:
+                    # New window; the budget is unknown
+                    # until the next response says
+                    self.remaining = None
+                    continue
+
+                delay = self.reset - now + 1
+                if not logged:
+                    msg = "%s rate limit used up (%s requests left), pausing %d s until %s"%(
+                            self.name, self.remaining, delay, format_time(self.reset))
+                    logging.warning(msg)
+                    logged = True
+                self.cond.wait(delay)
+                self.waited += time.time() - now
+
+
+    def update(self, remaining, limit=None, reset=None):
+        """
+        Update the budget with what the API says.
+        Responses can arrive out of order, so within
+        a window the budget can only go down.
+        """
+        with self.cond:
+            if reset is not None and self.reset is not None and reset < self.reset:
+                # Response from an earlier window
+                return
+            if reset is not None and self.reset is not None and reset == self.reset \
+                    and self.remaining is not None:
+                remaining = min(remaining, self.remaining)
+            self.remaining = remaining
+            if limit is not None:
+                self.limit = limit
+            if reset is not None:
+                self.reset = reset
+            self.cond.notify_all()
+
+
+    def update_from_headers(self, headers):
+        """
+        Update the budget from the X-RateLimit-*
+        headers of a response, if there are any.
+        """
+        try:
+            remaining = int(headers['X-RateLimit-Remaining'])
+        except (KeyError, ValueError):
+            return
+        limit = None
+        reset = None
+        try:
+            limit = int(headers['X-RateLimit-Limit'])
+        except (KeyError, ValueError):
+            pass
+        try:
+            reset = int(headers['X-RateLimit-Reset'])
+        except (KeyError, ValueError):
+            pass
+        self.update(remaining, limit, reset)
+
+
+    def update_from_github(self, g):
+        """
+        Update the budget from a PyGithub API object,
+        which remembers the rate limit headers of the
+        last response it got.
+        """
+        try:
+            remaining, limit = g.rate_limiting
+            reset = g.rate_limiting_resettime
+        except AttributeError:
+            return
+        if remaining is None or remaining < 0:
+            return
+        self.update(remaining, limit, reset)
+
+
+    def is_rate_limited(self, response):
+        """
+        True if response was refused because
+        the rate limit was used up.
+        """
+        return response.status_code in (403, 429) and \
+                response.headers.get('X-RateLimit-Remaining') == '0'
+
+
+    def progress(self, done, total, start, start_used=0):
+        """
+        Project when a crawl of total units of work
+        (e.g. repositories), started at start (epoch
+        seconds) when start_used requests had been made,
+        will finish, given that done units are finished.
+        Both the time taken so far and the rate limit
+        budget are taken into account.
+        Returns a message for the log.
+        """
+        now = time.time()
+        used = self.used - start_used
+        if done == 0:
+            return "%s: %d requests made"%(self.name, used)
+
+        finish = now + (now - start)*(total - done)/done
+
+        # If the rest of the crawl needs more requests
+        # than are left, it has to wait for resets
+        needed = used*(total - done)/done
+        with self.cond:
+            remaining, limit, reset = self.remaining, self.limit, self.reset
+        if remaining is not None and reset is not None and limit and needed > remaining - self.reserve:
+            windows = (needed - (remaining - self.reserve)) / max(limit - self.reserve, 1)
+            finish = max(finish, reset + RATE_LIMIT_WINDOW*int(windows))
+
+        msg = "%s: %d of %d done, %d requests made"%(self.name, done, total, used)
+        if remaining is not None:
+            msg += ", %d left until %s"%(remaining, format_time(reset))
+        msg += ", projected completion at %s"%(format_time(finish))
+        return msg
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(name):
+    """
+    Return the process-wide rate limiter
+    for the API name, creating it if needed.
+    """
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = RateLimiter(name)
+        return _limiters[name]
+
+
+def format_time(t):
+    """Format epoch seconds as a local time for the logs"""
+    if t is None:
+        return "?"
+    return datetime.datetime.fromtimestamp(t).strftime('%Y-%m-%d %H:%M:%S')
@@ -0,0 +1,58 @@
+import os
+import json
+import logging
+import tempfile
+
+
+"""
+Convenience class wrapper for incremental sync state.
+
+Incremental updates need to remember things between
+runs (page tokens, watermarks, last-seen SHAs, etc.).
+Each source keeps a small JSON file next to the
+search index (in its generation directory in
+INDEX_DIR, see generations.py), so that state is
+thrown away together with the index when the index
+is rebuilt from scratch.
+"""
+
+
+class SyncState(object):
+
+    def __init__(self, index_folder, name):
+        """
+        Load the sync state called name from the
+        index folder. If there is no state on disk
+        (first run) or it can't be read, start empty.
+        """
+        self.path = os.path.join(index_folder, name + '.json')
+        self.data = {}
+        if os.path.isfile(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    self.data = json.load(f)
+            except (IOError, ValueError):
+                err = "ERROR: Could not read sync state file %s, starting from scratch"%(self.path)
+                logging.exception(err)
+                self.data = {}
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def set(self, key, value):
+        self.data[key] = value
+
+    def clear(self):
+        self.data = {}
+
+    def save(self):
+        """
+        Write the sync state to disk. Write to a
+        temporary file first and rename it, so a
+        crash never leaves a half-written file.
+        """
+        folder = os.path.dirname(self.path)
+        fd, temp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.data, f, indent=4, default=str)
+        os.replace(temp_path, self.path)
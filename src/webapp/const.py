@@ -3,3 +3,13 @@ import os
 base = os.path.split(os.path.abspath(__file__))[0]
 call = os.getcwd()
 DEFAULT_CONFIG = 'config_centillion.py'
+
+# Number of finished index jobs kept
+# in the index job queue history
+DEFAULT_INDEX_JOB_HISTORY = 50
+
+# Index scheduler: maximum random stretch of each
+# source's interval (as a fraction of it), and
+# seconds between checks of the schedule
+DEFAULT_INDEX_SCHEDULE_JITTER = 0.1
+DEFAULT_INDEX_SCHEDULE_TICK = 30
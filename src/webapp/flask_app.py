@@ -161,7 +161,7 @@ class CentillionFlask(Flask):
         config = self.config
 
         # which doc types are enabled
-        need_at_least_one = ['GOOGLE_DRIVE_ENABLED','GITHUB_ENABLED','DISQUS_ENABLED']
+        need_at_least_one = ['GOOGLE_DRIVE_ENABLED','GITHUB_ENABLED','GROUPSIO_ENABLED','DISQUS_ENABLED','HYPOTHESIS_ENABLED']
         found_one = False
         for n in need_at_least_one:
             if n in config.keys():
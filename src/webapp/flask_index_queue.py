@@ -0,0 +1,244 @@
+from .const import DEFAULT_INDEX_JOB_HISTORY
+from .flask_index_task import UpdateIndexTask
+from ..search import IndexCancelled
+
+import time
+import logging
+import threading
+import itertools
+from collections import deque
+
+
+"""
+Centillion Flask: Index Job Queue
+
+Requests to update the search index (from the control
+panel, or from the scheduler) are queued as jobs, and
+a single background worker thread runs them one at a
+time, so there is only ever one crawl writing to the
+search index.
+
+A request for a source that already has a job waiting
+in the queue is merged into that job (as is a request
+for one source while an 'all' job is waiting). A job
+that is already running is not merged into, since it
+may have fetched its source before the new request.
+
+Jobs can be cancelled: a waiting job is taken out of
+the queue, and a running job is asked to stop (the
+index update stops at its next commit, keeping what
+it has indexed so far).
+
+The queue keeps a history of finished jobs, with
+their durations, for the JSON status endpoint.
+"""
+
+
+# Values of run_which that can be queued
+RUN_WHICH = ['all', 'gdocs', 'ghfiles', 'issues', 'emailthreads', 'disqus', 'annotations', 'rebuild']
+
+
+class IndexJob(object):
+    """
+    One queued update of the search index.
+    """
+    def __init__(self, job_id, run_which):
+        self.id = job_id
+        self.run_which = run_which
+        self.cancel = threading.Event()
+
+        # queued, running, cancelling, done,
+        # partial (some sources failed to
+        # update), failed or cancelled
+        self.status = 'queued'
+        self.requests = 1
+        self.error = None
+
+        self.queued_time = time.time()
+        self.start_time = None
+        self.end_time = None
+
+    def covers(self, run_which):
+        """
+        Whether a request for run_which
+        can be merged into this job
+        """
+        if run_which == self.run_which:
+            return True
+        return self.run_which == 'all' and run_which != 'rebuild'
+
+    def to_dict(self):
+        duration = None
+        if self.start_time is not None:
+            duration = (self.end_time or time.time()) - self.start_time
+        return dict(
+            id = self.id,
+            run_which = self.run_which,
+            status = self.status,
+            requests = self.requests,
+            error = self.error,
+            queued_time = self.queued_time,
+            start_time = self.start_time,
+            end_time = self.end_time,
+            duration = duration
+        )
+
+
+class IndexJobQueue(object):
+
+    def __init__(self, app_config):
+        self.app_config = app_config
+        self.history_size = app_config.get('INDEX_JOB_HISTORY', DEFAULT_INDEX_JOB_HISTORY)
+
+        self.ids = itertools.count(1)
+        self.queued = deque()
+        self.current = None
+        self.history = deque(maxlen=self.history_size)
+
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.worker = None
+
+
+    def submit(self, run_which):
+        """
+        Queue an update of the search index, unless a
+        waiting job already covers it. Returns the job
+        (new or merged into) and whether it is new.
+        """
+        if run_which not in RUN_WHICH:
+            raise ValueError("Unknown index job: %s"%(run_which))
+
+        with self.lock:
+            for job in self.queued:
+                if job.covers(run_which):
+                    job.requests += 1
+                    msg = "IndexJobQueue: Merged request for %s into queued job %d (%s)"%(run_which, job.id, job.run_which)
+                    logging.info(msg)
+                    return job, False
+
+            job = IndexJob(next(self.ids), run_which)
+            self.queued.append(job)
+            msg = "IndexJobQueue: Queued job %d (%s)"%(job.id, run_which)
+            logging.info(msg)
+
+            self.start_worker()
+            self.wakeup.notify()
+            return job, True
+
+
+    def cancel(self, job_id):
+        """
+        Cancel a waiting or running job.
+        Returns the job, or None if there
+        is no such job to cancel.
+        """
+        with self.lock:
+            for job in self.queued:
+                if job.id == job_id:
+                    self.queued.remove(job)
+                    job.status = 'cancelled'
+                    job.end_time = time.time()
+                    self.history.append(job)
+                    return job
+
+            job = self.current
+            if job is not None and job.id == job_id:
+                job.cancel.set()
+                job.status = 'cancelling'
+                return job
+
+        return None
+
+
+    def is_running(self, run_which):
+        """
+        Whether a job that covers run_which
+        is waiting or running.
+        """
+        with self.lock:
+            jobs = list(self.queued)
+            if self.current is not None:
+                jobs.append(self.current)
+            return any(job.covers(run_which) for job in jobs)
+
+
+    def status(self):
+        """
+        Status of the queue: the running job,
+        the waiting jobs, and the finished jobs
+        (most recent first), as dictionaries.
+        """
+        with self.lock:
+            current = None
+            if self.current is not None:
+                current = self.current.to_dict()
+            return dict(
+                current = current,
+                queued = [job.to_dict() for job in self.queued],
+                history = [job.to_dict() for job in reversed(self.history)]
+            )
+
+
+    def start_worker(self):
+        """
+        Start the worker thread if it is
+        not running (call with the lock held).
+        """
+        if self.worker is None:
+            self.worker = threading.Thread(target=self.work, args=())
+            self.worker.daemon = True
+            self.worker.start()
+
+
+    def work(self):
+        """
+        Worker thread: run the
+        queued jobs, one at a time.
+        """
+        while True:
+            with self.lock:
+                while len(self.queued) == 0:
+                    self.wakeup.wait()
+                job = self.queued.popleft()
+                self.current = job
+                job.status = 'running'
+                job.start_time = time.time()
+
+            self.run_job(job)
+
+            with self.lock:
+                job.end_time = time.time()
+                self.current = None
+                self.history.append(job)
+
+
+    def run_job(self, job):
+        """
+        Run one job, and record how it ended.
+        """
+        msg = "IndexJobQueue: Running job %d (%s)"%(job.id, job.run_which)
+        logging.info(msg)
+        try:
+            result = UpdateIndexTask(self.app_config, run_which=job.run_which, cancel=job.cancel).execute()
+            if result is False:
+                # A rebuild that was thrown away
+                job.status = 'failed'
+                job.error = "Rebuild failed, kept the current index"
+            elif result:
+                # An update of all the sources that failed
+                # for some of them is only partly done
+                job.status = 'partial' if job.run_which == 'all' else 'failed'
+                job.error = "Failed to update %s"%(", ".join(result))
+            else:
+                job.status = 'done'
+        except IndexCancelled:
+            job.status = 'cancelled'
+        except Exception as e:
+            err = "ERROR: IndexJobQueue: Job %d (%s) failed"%(job.id, job.run_which)
+            logging.exception(err)
+            job.status = 'failed'
+            job.error = str(e)
+
+        msg = "IndexJobQueue: Job %d (%s) %s in %0.1f s"%(job.id, job.run_which, job.status, time.time() - job.start_time)
+        logging.info(msg)
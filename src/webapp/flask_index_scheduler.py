@@ -0,0 +1,146 @@
+from .const import DEFAULT_INDEX_SCHEDULE_JITTER, DEFAULT_INDEX_SCHEDULE_TICK
+from .flask_index_queue import RUN_WHICH
+from ..search.sync_state import SyncState
+
+import os
+import time
+import random
+import logging
+import threading
+
+
+"""
+Centillion Flask: Index Scheduler
+
+Update the search index periodically, without an
+external cron job. The INDEX_SCHEDULE config setting
+maps each source (gdocs, ghfiles, issues, disqus,
+...) to the number of seconds between its updates.
+
+When a source is due, an update job is submitted to
+the index job queue (see flask_index_queue.py). Each
+interval is stretched by a random jitter, so that
+sources with the same interval do not all start at
+once. If the source's previous job is still queued
+or running, the run is skipped.
+
+The time each source was last submitted is saved in
+INDEX_DIR, so after a restart, a source whose update
+is overdue runs right away (once), instead of waiting
+for a full interval.
+"""
+
+
+# Name of the state file (in INDEX_DIR)
+SCHEDULE_STATE = "index_schedule"
+
+
+class IndexScheduler(object):
+
+    def __init__(self, app_config, index_queue, clock=time.time):
+        """
+        app_config:  the webapp config, with the
+                     INDEX_SCHEDULE intervals
+        index_queue: the IndexJobQueue to submit
+                     the update jobs to
+        clock:       function returning the time
+                     (can be replaced for testing)
+        """
+        self.index_queue = index_queue
+        self.clock = clock
+        self.jitter = app_config.get('INDEX_SCHEDULE_JITTER', DEFAULT_INDEX_SCHEDULE_JITTER)
+        self.tick = app_config.get('INDEX_SCHEDULE_TICK', DEFAULT_INDEX_SCHEDULE_TICK)
+
+        self.intervals = {}
+        for run_which, interval in app_config.get('INDEX_SCHEDULE', {}).items():
+            if run_which not in RUN_WHICH:
+                err = "ERROR: IndexScheduler: Unknown source %s in INDEX_SCHEDULE, ignoring it"%(run_which)
+                logging.error(err)
+                continue
+            self.intervals[run_which] = interval
+
+        self.thread = None
+        self.stopped = threading.Event()
+
+        self.next_run = {}
+        if len(self.intervals) == 0:
+            return
+
+        index_dir = app_config['INDEX_DIR']
+        if not os.path.isdir(index_dir):
+            os.makedirs(index_dir)
+        self.state = SyncState(index_dir, SCHEDULE_STATE)
+
+        # Next time each source is due: its last run
+        # plus an interval, or now if it never ran
+        now = self.clock()
+        for run_which in self.intervals:
+            last_run = self.state.get(run_which)
+            if last_run is None:
+                self.next_run[run_which] = now
+            else:
+                self.next_run[run_which] = last_run + self.get_interval(run_which)
+
+
+    def get_interval(self, run_which):
+        """
+        Seconds until the next run of a source:
+        its interval plus a random jitter (up to
+        INDEX_SCHEDULE_JITTER of the interval).
+        """
+        interval = self.intervals[run_which]
+        return interval + random.uniform(0, self.jitter*interval)
+
+
+    def check(self):
+        """
+        Submit an update job for each source
+        that is due. Returns the sources
+        submitted.
+        """
+        now = self.clock()
+        submitted = []
+        for run_which in sorted(self.intervals):
+            if now < self.next_run[run_which]:
+                continue
+            self.next_run[run_which] = now + self.get_interval(run_which)
+
+            if self.index_queue.is_running(run_which):
+                msg = "IndexScheduler: Previous update of %s is still going, skipping this run"%(run_which)
+                logging.info(msg)
+                continue
+
+            self.index_queue.submit(run_which)
+            self.state.set(run_which, now)
+            submitted.append(run_which)
+
+        if len(submitted) > 0:
+            self.state.save()
+        return submitted
+
+
+    def start(self):
+        """
+        Start checking the schedule
+        in a background thread.
+        """
+        if self.thread is None and len(self.intervals) > 0:
+            msg = "IndexScheduler: Updating %s on a schedule"%(", ".join(sorted(self.intervals)))
+            logging.info(msg)
+            self.thread = threading.Thread(target=self.run, args=())
+            self.thread.daemon = True
+            self.thread.start()
+
+
+    def stop(self):
+        self.stopped.set()
+
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.check()
+            except Exception:
+                err = "ERROR: IndexScheduler: Failed to check the schedule. Continuing..."
+                logging.exception(err)
+            self.stopped.wait(self.tick)
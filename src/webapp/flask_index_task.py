@@ -1,6 +1,5 @@
 from ..search import Search
 
-import threading
 import subprocess
 import markdown
 import logging
@@ -20,9 +19,10 @@ Centillion Flask: Index Task
 
 Define a class to handle updating the search index.
 
-This class spawns a new thread to collect 
-information from the respective API and use 
-it to update the search index in the background.
+This class collects information from the respective
+API and uses it to update the search index. Tasks
+are run in the background, one at a time, by the
+index job queue (see flask_index_queue.py).
 
 IMPORTANT: This class is the glue between the 
 webapp and search submodules.
@@ -30,17 +30,33 @@ webapp and search submodules.
 
 
 class UpdateIndexTask(object):
-    def __init__(self, app_config, run_which='all'):
+    def __init__(self, app_config, run_which='all', cancel=None):
+        """
+        run_which is the source to update ('all' for
+        every source, 'rebuild' to rebuild the index
+        from scratch); cancel is a threading.Event
+        that stops the update when it is set.
+        """
         self.run_which = run_which
         self.app_config = app_config
+        self.cancel = cancel
+
+
+    def execute(self):
+        """
+        Run the task in the calling thread.
+
+        Returns the names of the sources that failed
+        to update (see Search.update_index), or, for a
+        rebuild, whether the new index was swapped in
+        (see Search.rebuild_index).
+        """
         if self.app_config['FAKEDOCS']:
             logging.info("Found FAKEDOCS = True in config file, running test update index task")
-            thread = threading.Thread(target=self.test, args=())
+            return self.test()
         else:
             logging.info("Found FAKEDOCS = False in config file, running real update index task")
-            thread = threading.Thread(target=self.run, args=())
-        thread.daemon = True
-        thread.start()
+            return self.run()
 
 
     def test(self):
@@ -51,9 +67,13 @@ class UpdateIndexTask(object):
         # Load the search index
         search = Search(self.app_config["INDEX_DIR"])
 
-        # Update the index with fake docs
-        search.test_update_index(self.run_which,
-                                 self.app_config)
+        # Update (or rebuild) the index with fake docs
+        if self.run_which=='rebuild':
+            return search.test_rebuild_index(self.app_config)
+        else:
+            search.test_update_index(self.run_which,
+                                     self.app_config)
+            return []
 
 
     def run(self):
@@ -82,22 +102,48 @@ class UpdateIndexTask(object):
         else:
             self.disqus_token = ''
 
+        if self.app_config.get('GROUPSIO_ENABLED', False):
+            self.groupsio_token = self.app_config['GROUPSIO_TOKEN']
+        else:
+            self.groupsio_token = ''
+
+        if self.app_config.get('HYPOTHESIS_ENABLED', False):
+            self.hypothesis_token = self.app_config['HYPOTHESIS_TOKEN']
+        else:
+            self.hypothesis_token = ''
+
         
         # Note that you need SOMETHING enabled...
         if (not self.app_config['GOOGLE_DRIVE_ENABLED'] ) \
             and (not self.app_config['GITHUB_ENABLED'] ) \
-            and (not self.app_config['DISQUS_ENABLED'] ):
-                raise Exception("Error: Google Drive, Github, and Disqus all disabled.")
+            and (not self.app_config['DISQUS_ENABLED'] ) \
+            and (not self.app_config.get('GROUPSIO_ENABLED', False) ) \
+            and (not self.app_config.get('HYPOTHESIS_ENABLED', False) ):
+                raise Exception("Error: Google Drive, Github, Groups.io, Disqus, and Hypothesis all disabled.")
 
 
 
         # Load the search index
         search = Search(self.app_config["INDEX_DIR"])
 
+        # Rebuild the index from scratch next to the
+        # live one, and swap it in when it is complete
+        if self.run_which=='rebuild':
+            return search.rebuild_index(self.gdrive_token_path,
+                                        self.gh_token,
+                                        self.disqus_token,
+                                        self.app_config,
+                                        groupsio_token=self.groupsio_token,
+                                        hypothesis_token=self.hypothesis_token,
+                                        cancel=self.cancel)
+
         # Update the index with real docs
-        search.update_index(self.gdrive_token_path,
-                            self.gh_token,
-                            self.disqus_token,
-                            self.run_which,
-                            self.app_config)
+        return search.update_index(self.gdrive_token_path,
+                                   self.gh_token,
+                                   self.disqus_token,
+                                   self.run_which,
+                                   self.app_config,
+                                   groupsio_token=self.groupsio_token,
+                                   hypothesis_token=self.hypothesis_token,
+                                   cancel=self.cancel)
 
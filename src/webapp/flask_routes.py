@@ -1,7 +1,8 @@
 from .const import base, call
-from .flask_index_task import UpdateIndexTask
+from .flask_index_queue import IndexJobQueue
+from .flask_index_scheduler import IndexScheduler
 
-from ..search import Search
+from ..search import get_shared_search
 
 from werkzeug.contrib.fixers import ProxyFix
 from flask import Flask, request, redirect, url_for, abort, render_template
@@ -43,6 +44,15 @@ def setup_routes(app):
 
     last_searches_file = app.config["INDEX_DIR"] + "/last_searches.txt" 
 
+    # All updates of the search index go
+    # through this queue, one at a time
+    index_queue = IndexJobQueue(app.config)
+    app.index_queue = index_queue
+
+    # Periodic updates (see INDEX_SCHEDULE)
+    app.index_scheduler = IndexScheduler(app.config, index_queue)
+    app.index_scheduler.start()
+
 
 
     ##############################
@@ -165,7 +175,7 @@ def setup_routes(app):
         if fields == 'None':
             fields = None
     
-        search = Search(app.config["INDEX_DIR"])
+        search = get_shared_search(app.config["INDEX_DIR"])
         if not query:
             parsed_query = ""
             result = []
@@ -202,16 +212,16 @@ def setup_routes(app):
         search index.
         Example: /list/gdocs
         """
-        search = Search(app.config["INDEX_DIR"])
+        search = get_shared_search(app.config["INDEX_DIR"])
         results_list = search.get_list(doctype)
         for result in results_list:
-            if 'created_time' in result.keys():
+            if result.get('created_time') is not None:
                 ct = result['created_time']
                 result['created_time'] = datetime.strftime(ct,"%Y-%m-%d %I:%M %p")
-            if 'modified_time' in result.keys():
+            if result.get('modified_time') is not None:
                 mt = result['modified_time']
                 result['modified_time'] = datetime.strftime(mt,"%Y-%m-%d %I:%M %p")
-            if 'indexed_time' in result.keys():
+            if result.get('indexed_time') is not None:
                 it = result['indexed_time']
                 result['indexed_time'] = datetime.strftime(it,"%Y-%m-%d %I:%M %p")
         return jsonify(results_list)
@@ -282,25 +292,53 @@ def setup_routes(app):
     def update_index(run_which):
         """Update the centillion search index.
         """
-        # This is the task that links into the
+        # Queue the task that links into the
         # search submodule of centillion.
-        UpdateIndexTask(
-                app.config,
-                run_which = run_which
-        )
-        flash("Rebuilding index, check console output")
+        try:
+            job, new = index_queue.submit(run_which)
+        except ValueError as e:
+            flash(str(e))
+            return redirect(url_for("control_panel"))
+
+        if new:
+            flash("Queued index job %d (%s), check console output"%(job.id, job.run_which))
+        else:
+            flash("Index job %d (%s) is already queued"%(job.id, job.run_which))
         # This redirects user to /control_panel route
         # to prevent accidental re-indexing
         return redirect(url_for("control_panel"))
 
 
+    @centillion_github_auth(admin=True)
+    @app.route('/index_status')
+    def index_status():
+        """Return the status of the index job queue
+        (running, queued and finished jobs) as JSON.
+        """
+        return jsonify(index_queue.status())
+
+
+    @centillion_github_auth(admin=True)
+    @app.route('/cancel_index_job/<int:job_id>')
+    def cancel_index_job(job_id):
+        """Cancel a queued or running index job.
+        """
+        job = index_queue.cancel(job_id)
+        if job is None:
+            flash("No index job %d to cancel"%(job_id))
+        else:
+            flash("Cancelling index job %d (%s)"%(job.id, job.run_which))
+        return redirect(url_for("control_panel"))
+
+
     @centillion_github_auth(admin=True)
     @app.route('/control_panel')
     def control_panel():
         """Access the control panel interface to
         re-index the database.
         """
-        return render_template("controlpanel.html") # Proceed
+        jobs = index_queue.status()
+        return render_template("controlpanel.html", jobs=jobs) # Proceed
 
 
     ###############
@@ -21,7 +21,9 @@ var initGdocTable = false;
 var initIssuesTable = false;
 var initGhfilesTable = false;
 var initMarkdownTable = false;
+var initEmailTable = false;
 var initDisqusTable = false;
+var initAnnotationsTable = false;
 
 $(document).ready(function() {
     var url_string = document.location.toString();
@@ -44,10 +46,18 @@ $(document).ready(function() {
         load_markdown_table();
         var divList = $('div#collapseMarkdown').addClass('in');
 
+    } else if (d==='emailthread') {
+        load_emailthreads_table();
+        var divList = $('div#collapseEmail').addClass('in');
+
     } else if (d==='disqus') {
         load_disqusthreads_table();
         var divList = $('div#collapseDisqus').addClass('in');
 
+    } else if (d==='annotation') {
+        load_annotations_table();
+        var divList = $('div#collapseAnnotations').addClass('in');
+
     }
 });
 
@@ -87,6 +97,9 @@ var toType = function(obj) {
 // Github issues
 // Github files
 // Github markdown
+// Groups.io email threads
+// Disqus comment threads
+// Hypothesis annotations
 
 // ------------------------
 // Google Drive
@@ -313,6 +326,63 @@ function load_markdown_table(){
 }
 
 
+// ------------------------
+// Groups.io Email Threads
+
+function load_emailthreads_table(){
+    if(!initEmailTable) { 
+        var divList = $('div#collapseEmail').attr('class');
+        if (divList.indexOf('in') !== -1) {
+            console.log('Closing Groups.io email threads master list');
+        } else { 
+            console.log('Opening Groups.io email threads master list');
+    
+            $.getJSON("/list/emailthread", function(result){
+                var r = new Array(), j = -1, size=result.length;
+                r[++j] = '<thead>'
+                r[++j] = '<tr class="header-row">';
+                r[++j] = '<th width="50%">Subject</th>';
+                r[++j] = '<th width="20%">Sender</th>';
+                r[++j] = '<th width="15%">Mailing List</th>';
+                r[++j] = '<th width="15%">Date</th>';
+                r[++j] = '</tr>';
+                r[++j] = '</thead>'
+                r[++j] = '<tbody>'
+                for (var i=0; i<size; i++){
+                    r[++j] ='<tr><td>';
+                    r[++j] = '<a href="' + result[i]['url'] + '" target="_blank">'
+                    r[++j] = result[i]['title'];
+                    r[++j] = '</a>'
+                    r[++j] = '</td><td>';
+                    r[++j] = result[i]['owner_name'];
+                    r[++j] = '</td><td>';
+                    r[++j] = result[i]['group'];
+                    r[++j] = '</td><td>';
+                    r[++j] = result[i]['created_time'];
+                    r[++j] = '</td></tr>';
+                }
+                r[++j] = '</tbody>'
+
+                // Construct names of id tags
+                var doctype = 'emailthread';
+                var idlabel = '#' + doctype + '-master-list';
+                var filtlabel = idlabel + '_filter';
+
+                // Initialize the DataTable
+                $(idlabel).html(r.join(''));
+                $(idlabel).DataTable({
+                    responsive: true,
+                    lengthMenu: [50,100,250,500]
+                });
+
+                initEmailTable = true;
+            });
+            console.log('Finished loading Groups.io email threads list');
+        }
+    }
+}
+
+
 // ------------------------
 // Disqus Comment Threads
 
@@ -363,3 +433,56 @@ function load_disqusthreads_table(){
     }
 }
 
+
+// ------------------------
+// Hypothesis Annotations
+
+function load_annotations_table(){
+    if(!initAnnotationsTable) { 
+        var divList = $('div#collapseAnnotations').attr('class');
+        if (divList.indexOf('in') !== -1) {
+            console.log('Closing Hypothesis annotations master list');
+        } else { 
+            console.log('Opening Hypothesis annotations master list');
+    
+            $.getJSON("/list/annotation", function(result){
+                var r = new Array(), j = -1, size=result.length;
+                r[++j] = '<thead>'
+                r[++j] = '<tr class="header-row">';
+                r[++j] = '<th width="60%">Page Title</th>';
+                r[++j] = '<th width="20%">Annotated By</th>';
+                r[++j] = '<th width="20%">Updated</th>';
+                r[++j] = '</tr>';
+                r[++j] = '</thead>'
+                r[++j] = '<tbody>'
+                for (var i=0; i<size; i++){
+                    r[++j] ='<tr><td>';
+                    r[++j] = '<a href="' + result[i]['url'] + '" target="_blank">'
+                    r[++j] = result[i]['title'];
+                    r[++j] = '</a>'
+                    r[++j] = '</td><td>';
+                    r[++j] = result[i]['owner_name'];
+                    r[++j] = '</td><td>';
+                    r[++j] = result[i]['modified_time'];
+                    r[++j] = '</td></tr>';
+                }
+                r[++j] = '</tbody>'
+
+                // Construct names of id tags
+                var doctype = 'annotation';
+                var idlabel = '#' + doctype + '-master-list';
+                var filtlabel = idlabel + '_filter';
+
+                // Initialize the DataTable
+                $(idlabel).html(r.join(''));
+                $(idlabel).DataTable({
+                    responsive: true,
+                    lengthMenu: [50,100,250,500]
+                });
+
+                initAnnotationsTable = true;
+            });
+            console.log('Finished loading Hypothesis annotations list');
+        }
+    }
+}
@@ -0,0 +1,225 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from centillion.search import Search
+from centillion.search.disqus_util import DisqusCrawler
+
+
+"""
+test_disqus
+
+Test the Disqus crawler (thread listing, concurrent
+post fetching, and incremental updates of the
+search index) against a fake Disqus API client,
+without making any real API calls.
+
+To run, use pytest:
+
+    $ pytest
+    $ python -m unittest -q test_disqus.DisqusCrawlerTest
+    $ python -m unittest -q test_disqus.DisqusSyncTest
+"""
+
+
+class FakeResponse(object):
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+class FakeDisqusClient(object):
+    """
+    Fake HTTP client answering the Disqus
+    threads/list and threads/listPosts calls.
+
+    pages is a list of pages of threads; posts
+    maps thread ids to pages of posts.
+    """
+    def __init__(self, pages, posts):
+        self.pages = pages
+        self.posts = posts
+        self.last_page_listed = threading.Event()
+        self.listed_while_fetching = None
+        self.calls = []
+        self.lock = threading.Lock()
+        self.failing = set()
+
+    def get(self, url, params=None):
+        with self.lock:
+            self.calls.append((url.split('/')[-1], params.get('thread'), params.get('cursor')))
+        j = int(params.get('cursor') or 0)
+
+        if url.endswith('forums/listPosts.json'):
+            recent = []
+            for thread_id, pages in sorted(self.posts.items()):
+                for page in pages:
+                    for post in page:
+                        if post['createdAt'] >= params['since']:
+                            recent.append(dict(post, thread=thread_id))
+            return FakeResponse({'cursor' : {'hasNext' : False}, 'response' : recent})
+
+        if url.endswith('threads/list.json'):
+            if j == len(self.pages)-1:
+                self.last_page_listed.set()
+            cursor = {'hasNext' : j+1 < len(self.pages), 'next' : str(j+1)}
+            return FakeResponse({'cursor' : cursor, 'response' : self.pages[j]})
+
+        # The posts of thread 1 are only answered once
+        # the listing has reached the last page of threads
+        thread_id = params['thread']
+        if thread_id in self.failing:
+            raise IOError("Disqus API error")
+        if thread_id == '1':
+            self.listed_while_fetching = self.last_page_listed.wait(5)
+        pages = self.posts[thread_id]
+        cursor = {'hasNext' : j+1 < len(pages), 'next' : str(j+1)}
+        return FakeResponse({'cursor' : cursor, 'response' : pages[j]})
+
+    def posts_fetched(self, thread_id):
+        return len([c for c in self.calls if c[0]=='listPosts.json' and c[1]==thread_id])
+
+
+def make_post(message, day=1):
+    return {'message' : message, 'createdAt' : '2018-07-%02dT12:00:00'%(day)}
+
+
+def make_thread(thread_id, posts, link='https://pilot.nihdatacommons.us/page'):
+    return {
+        'id' : thread_id,
+        'posts' : posts,
+        'link' : link,
+        'createdAt' : '2018-07-01T12:00:00',
+        'title' : 'Thread %s'%(thread_id),
+        'forum' : 'dcppc-internal',
+    }
+
+
+class DisqusCrawlerTest(unittest.TestCase):
+    """
+    Test DisqusCrawler against a fake Disqus API client.
+    """
+    def setUp(self):
+        pages = [
+            [make_thread('1', 3), make_thread('2', 0)],
+            [make_thread('3', 1), make_thread('4', 1, link='http://localhost:8000/page')],
+        ]
+        posts = {
+            '1' : [[make_post('one'), make_post('two')], [make_post('three', 2)]],
+            '3' : [[make_post('four')]],
+        }
+        self.client = FakeDisqusClient(pages, posts)
+
+    def test_crawl_threads(self):
+        """Every thread with posts should be crawled, with all its pages of posts
+        """
+        spider = DisqusCrawler('token', 'dcppc-internal', workers=2, client=self.client)
+        spider.crawl_threads()
+        threads = spider.get_threads()
+
+        self.assertEqual(set(threads.keys()), {'1', '3'})
+        self.assertEqual(threads['1']['content'], 'one\n\n-----two\n\n-----three')
+        self.assertEqual(threads['3']['link'], 'https://pilot.nihdatacommons.us/page#disqus_comments')
+
+    def test_listing_continues_while_posts_are_fetched(self):
+        """Thread listing should not wait for the posts of earlier threads
+        """
+        spider = DisqusCrawler('token', 'dcppc-internal', workers=2, client=self.client)
+        spider.crawl_threads()
+
+        # The posts of thread 1 (on the first page)
+        # were still being fetched when the last
+        # page of threads was listed
+        self.assertTrue(self.client.listed_while_fetching)
+        self.assertEqual(len(spider.get_threads()), 2)
+
+
+class DisqusSyncTest(unittest.TestCase):
+    """
+    Test incremental Disqus updates of the search index.
+    """
+    def setUp(self):
+        self.index_dir = tempfile.mkdtemp()
+        self.search = Search(os.path.join(self.index_dir, 'search_index'))
+        self.pages = [[make_thread('1', 2), make_thread('2', 1)]]
+        self.posts = {
+            '1' : [[make_post('one'), make_post('two', 2)]],
+            '2' : [[make_post('three', 3)]],
+        }
+        self.client = FakeDisqusClient(self.pages, self.posts)
+        self.client.last_page_listed.set()
+
+    def tearDown(self):
+        shutil.rmtree(self.index_dir)
+
+    def indexed(self):
+        with self.search.ix.searcher() as s:
+            return {d['id'] : d for d in s.documents(kind='disqus')}
+
+    def update(self, **config):
+        self.search.update_index_disqus('token', config, client=self.client)
+
+    def test_unchanged_threads_are_not_fetched(self):
+        """Only threads with new posts or a new post count should be fetched again
+        """
+        self.update()
+        self.assertEqual(set(self.indexed().keys()), {'1', '2'})
+        self.assertEqual(self.client.posts_fetched('1'), 1)
+
+        # Nothing changed
+        self.update()
+        self.assertEqual(self.client.posts_fetched('1'), 1)
+        self.assertEqual(self.client.posts_fetched('2'), 1)
+
+        # A new post in thread 2
+        self.posts['2'][0].append(make_post('four', 4))
+        self.pages[0][1]['posts'] = 2
+        self.update()
+        self.assertEqual(self.client.posts_fetched('1'), 1)
+        self.assertEqual(self.client.posts_fetched('2'), 2)
+        self.assertIn('four', self.indexed()['2']['content'])
+
+        # A post deleted and another one added in thread 1
+        self.posts['1'][0] = [make_post('one'), make_post('five', 5)]
+        self.update()
+        self.assertEqual(self.client.posts_fetched('1'), 2)
+        self.assertIn('five', self.indexed()['1']['content'])
+
+    def test_removed_threads_are_dropped(self):
+        """Threads that are gone should be removed from the index
+        """
+        self.update()
+        del self.pages[0][0]
+        self.update()
+        self.assertEqual(set(self.indexed().keys()), {'2'})
+
+    def test_failed_threads_are_kept(self):
+        """A thread whose posts could not be fetched should stay in the index, and be fetched again
+        """
+        self.update()
+
+        # A new post in thread 1, but fetching it fails
+        self.posts['1'][0].append(make_post('four', 4))
+        self.pages[0][0]['posts'] = 3
+        self.client.failing.add('1')
+        self.update()
+        self.assertEqual(set(self.indexed().keys()), {'1', '2'})
+        self.assertNotIn('four', self.indexed()['1']['content'])
+
+        # Fetched again by the next run
+        self.client.failing.clear()
+        self.update()
+        self.assertEqual(self.client.posts_fetched('1'), 3)
+        self.assertIn('four', self.indexed()['1']['content'])
+
+    def test_not_incremental(self):
+        """With DISQUS_INCREMENTAL off, every thread should be fetched again
+        """
+        self.update()
+        self.update(DISQUS_INCREMENTAL=False)
+        self.assertEqual(self.client.posts_fetched('1'), 2)
+        self.assertEqual(len(self.indexed()), 2)
@@ -0,0 +1,100 @@
+import io
+import zipfile
+import unittest
+
+from centillion.search.docx_util import docx_to_text, DocxException
+
+
+"""
+test_docx
+
+Test the in-process docx text extractor used to
+index the contents of Google Drive documents.
+
+To run, use pytest:
+
+    $ pytest
+    $ python -m unittest -q test_docx.DocxTest
+"""
+
+
+DOCUMENT_XML = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">
+<w:body>
+<w:p><w:r><w:t>Crime and </w:t></w:r><w:r><w:t>Punishment</w:t></w:r></w:p>
+<w:p></w:p>
+<w:p><w:r><w:t>one</w:t><w:tab/><w:t>two</w:t><w:br/><w:t>three</w:t></w:r></w:p>
+<w:tbl><w:tr>
+<w:tc><w:p><w:r><w:t>cell one</w:t></w:r></w:p></w:tc>
+<w:tc><w:p><w:r><w:t>cell two</w:t></w:r></w:p></w:tc>
+</w:tr></w:tbl>
+<w:p><w:r><w:instrText>HYPERLINK "http://example.com"</w:instrText><w:t>rouble</w:t></w:r></w:p>
+</w:body>
+</w:document>"""
+
+
+# A paragraph with tab stops, and a text box in
+# the middle of it (with its fallback copy)
+TEXT_BOX_XML = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+            xmlns:mc="http://schemas.openxmlformats.org/markup-compatibility/2006">
+<w:body>
+<w:p>
+<w:pPr><w:tabs><w:tab w:val="left" w:pos="720"/><w:tab w:val="center" w:pos="4680"/></w:tabs></w:pPr>
+<w:r><w:t xml:space="preserve">before the box, </w:t></w:r>
+<w:r><mc:AlternateContent>
+<mc:Choice Requires="wps"><w:drawing><w:txbxContent>
+<w:p><w:pPr><w:tabs><w:tab w:val="left" w:pos="360"/></w:tabs></w:pPr><w:r><w:t>Boxed</w:t><w:tab/><w:t>text</w:t></w:r></w:p>
+</w:txbxContent></w:drawing></mc:Choice>
+<mc:Fallback><w:pict><w:txbxContent>
+<w:p><w:r><w:t>Boxed</w:t><w:tab/><w:t>text</w:t></w:r></w:p>
+</w:txbxContent></w:pict></mc:Fallback>
+</mc:AlternateContent></w:r>
+<w:r><w:t>after the box</w:t></w:r>
+</w:p>
+<w:p><w:r><w:t>next</w:t></w:r></w:p>
+</w:body>
+</w:document>"""
+
+
+def make_docx(files):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w') as z:
+        for name, data in files.items():
+            z.writestr(name, data)
+    return buf.getvalue()
+
+
+class DocxTest(unittest.TestCase):
+    """
+    Test docx_to_text on small handmade docx files.
+    """
+    def test_extract_text(self):
+        """Paragraphs, tabs, breaks and table cells should be extracted, field codes skipped
+        """
+        text = docx_to_text(make_docx({'word/document.xml' : DOCUMENT_XML}))
+        self.assertEqual(text, "Crime and Punishment\n\none\ttwo\nthree\n\ncell one\n\ncell two\n\nrouble\n")
+
+    def test_tab_stops_and_text_boxes(self):
+        """Tab stops should not add tabs, and text box paragraphs should not reset the paragraph around them
+        """
+        text = docx_to_text(make_docx({'word/document.xml' : TEXT_BOX_XML}))
+        self.assertEqual(text, "Boxed\ttext\n\nbefore the box, after the box\n\nnext\n")
+
+    def test_not_a_zip_file(self):
+        """Anything that is not a zip file should raise DocxException
+        """
+        with self.assertRaises(DocxException):
+            docx_to_text(b'<html>Sign in to continue to Google Docs</html>')
+
+    def test_no_document_part(self):
+        """A zip file without word/document.xml should raise DocxException
+        """
+        with self.assertRaises(DocxException):
+            docx_to_text(make_docx({'content.xml' : '<x/>'}))
+
+    def test_bad_xml(self):
+        """Malformed document XML should raise DocxException
+        """
+        with self.assertRaises(DocxException):
+            docx_to_text(make_docx({'word/document.xml' : '<w:document>'}))
@@ -0,0 +1,254 @@
+import io
+import os
+import shutil
+import zipfile
+import tempfile
+import unittest
+
+import httplib2
+import requests
+from apiclient.errors import HttpError
+
+import centillion
+from centillion.search import Search
+
+
+"""
+test_gdrive_sync
+
+Test the Google Drive sync logic (full listing,
+incremental updates, and the changes feed) of
+the centillion search index against a fake
+Google Drive API service object, without
+making any real API calls.
+
+To run, use pytest:
+
+    $ pytest
+    $ python -m unittest -q test_gdrive_sync.GDriveSyncTest
+"""
+
+
+CONFIG = {
+    'TRUNCATE_DRIVE_LISTING' : False,
+    'GOOGLE_DRIVE_WORKERS' : 2,
+}
+
+
+def make_item(file_id, modified_time='2018-07-01T12:00:00.000Z'):
+    """Make a fake Google Drive file item (a spreadsheet,
+    so that no document export is attempted)
+    """
+    return {
+        'id' : file_id,
+        'kind' : 'drive#file',
+        'createdTime' : '2018-07-01T12:00:00.000Z',
+        'modifiedTime' : modified_time,
+        'mimeType' : 'application/vnd.google-apps.spreadsheet',
+        'name' : 'Spreadsheet %s'%(file_id),
+        'owners' : [{'emailAddress' : 'edgar@example.com', 'displayName' : 'Edgar Allen Poe'}],
+        'webViewLink' : 'https://docs.google.com/spreadsheets/d/%s'%(file_id),
+    }
+
+
+def make_document(file_id):
+    """Make a fake Google Drive document item,
+    which is exported as docx to be indexed
+    """
+    item = make_item(file_id)
+    item['mimeType'] = 'application/vnd.google-apps.document'
+    item['name'] = 'Document %s'%(file_id)
+    return item
+
+
+DOCUMENT_XML = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">
+<w:body><w:p><w:r><w:t>Exported text</w:t></w:r></w:p></w:body>
+</w:document>"""
+
+
+class FakeExportClient(object):
+    """
+    Fake HTTP client for the document exports:
+    answers with status_code, and a small docx
+    """
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+    def get(self, url, **kwargs):
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, 'w') as z:
+            z.writestr('word/document.xml', DOCUMENT_XML)
+        r = requests.Response()
+        r.status_code = self.status_code
+        r.url = url
+        r._content = buf.getvalue()
+        return r
+
+
+class FakeRequest(object):
+    def __init__(self, result):
+        self.result = result
+
+    def execute(self):
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+class FakeDriveService(object):
+    """
+    Fake Google Drive API service object implementing
+    the files().list() and changes() calls centillion uses.
+
+    files is a dictionary of file items keyed by id;
+    pending_changes is a list of changes that will be
+    returned by the changes feed for the current token.
+    """
+    def __init__(self, files):
+        self.files_ = dict(files)
+        self.pending_changes = []
+        self.token = 1
+        self.calls = {'files.list' : 0, 'changes.list' : 0}
+
+    def files(self):
+        return self
+
+    def changes(self):
+        return FakeChanges(self)
+
+    def list(self, pageSize=100, pageToken=None, **kwargs):
+        self.calls['files.list'] += 1
+        items = sorted(self.files_.values(), key=lambda f: f['id'])
+        start = int(pageToken or 0)
+        result = {'files' : items[start:start+pageSize]}
+        if start+pageSize < len(items):
+            result['nextPageToken'] = str(start+pageSize)
+        return FakeRequest(result)
+
+    def modify(self, item):
+        self.files_[item['id']] = item
+        self.pending_changes.append({'changeType' : 'file', 'fileId' : item['id'], 'removed' : False, 'file' : item})
+
+    def remove(self, file_id):
+        del self.files_[file_id]
+        self.pending_changes.append({'changeType' : 'file', 'fileId' : file_id, 'removed' : True})
+
+
+class FakeChanges(object):
+    def __init__(self, service):
+        self.service = service
+
+    def getStartPageToken(self, **kwargs):
+        return FakeRequest({'startPageToken' : str(self.service.token)})
+
+    def list(self, pageToken=None, **kwargs):
+        self.service.calls['changes.list'] += 1
+        if pageToken != str(self.service.token):
+            resp = httplib2.Response({'status' : 404, 'reason' : 'Not Found'})
+            return FakeRequest(HttpError(resp, b'Invalid page token'))
+        result = {
+            'changes' : self.service.pending_changes,
+            'newStartPageToken' : str(self.service.token + 1)
+        }
+        self.service.pending_changes = []
+        self.service.token += 1
+        return FakeRequest(result)
+
+
+class GDriveSyncTest(unittest.TestCase):
+    """
+    Test Google Drive sync against a fake Drive service.
+    """
+    def setUp(self):
+        self.index_dir = tempfile.mkdtemp()
+        self.search = Search(os.path.join(self.index_dir, 'search_index'))
+        self.service = FakeDriveService({i : make_item(i) for i in ['a','b','c']})
+
+        # Count the files that get exported/converted
+        self.exported = []
+        make_drive_record = self.search.make_drive_record
+        def counting_make_drive_record(item, *args, **kwargs):
+            self.exported.append(item['id'])
+            return make_drive_record(item, *args, **kwargs)
+        self.search.make_drive_record = counting_make_drive_record
+
+    def tearDown(self):
+        shutil.rmtree(self.index_dir)
+
+    def indexed(self):
+        with self.search.ix.searcher() as s:
+            return {d['id'] : d for d in s.documents(kind='gdoc')}
+
+    def update(self, **config):
+        config = dict(CONFIG, **config)
+        self.search.update_index_gdocs('', config, service=self.service)
+
+    def test_1_first_run_lists_all_files(self):
+        """The first run should use the full listing and save a page token
+        """
+        self.update()
+        self.assertEqual(set(self.indexed().keys()), {'a','b','c'})
+        self.assertEqual(self.service.calls['files.list'], 1)
+        self.assertEqual(self.service.calls['changes.list'], 0)
+        self.assertTrue(os.path.isfile(os.path.join(self.search.index_folder, 'gdrive_sync.json')))
+
+    def test_2_delta_sync_applies_changes(self):
+        """Later runs should only apply adds, edits and removals from the changes feed
+        """
+        self.update()
+        self.service.modify(make_item('b', modified_time='2018-08-01T12:00:00.000Z'))
+        self.service.modify(make_item('d'))
+        self.service.remove('c')
+        self.update()
+
+        indexed = self.indexed()
+        self.assertEqual(set(indexed.keys()), {'a','b','d'})
+        self.assertEqual(indexed['b']['modified_time'].month, 8)
+        self.assertEqual(self.service.calls['files.list'], 1)
+        self.assertEqual(self.service.calls['changes.list'], 1)
+        self.assertEqual(sorted(self.exported), ['a','b','b','c','d'])
+
+    def test_3_invalid_token_falls_back_to_full_listing(self):
+        """An invalid page token should trigger a full listing
+        """
+        self.update()
+        self.service.token = 100
+        self.service.remove('a')
+        self.update()
+
+        self.assertEqual(set(self.indexed().keys()), {'b','c'})
+        self.assertEqual(self.service.calls['files.list'], 2)
+
+    def test_4_unchanged_files_keep_their_records(self):
+        """Files with an unchanged modifiedTime should not be re-indexed
+        """
+        self.update()
+        self.service.files_['a'] = make_item('a', modified_time='2018-08-01T12:00:00.000Z')
+        self.update(GOOGLE_DRIVE_DELTA_SYNC=False)
+        self.assertEqual(set(self.indexed().keys()), {'a','b','c'})
+        self.assertEqual(self.service.calls['files.list'], 2)
+        self.assertEqual(sorted(self.exported), ['a','a','b','c'])
+
+    def test_5_failed_export_is_retried(self):
+        """A document whose export fails should not be indexed blank, and should be retried
+        """
+        get_http_client = centillion.search.get_http_client
+        try:
+            self.service.modify(make_document('e'))
+            centillion.search.get_http_client = lambda: FakeExportClient(503)
+            self.update()
+            self.assertEqual(set(self.indexed().keys()), {'a','b','c'})
+
+            # No page token saved: the next run lists
+            # all files again, and exports the document
+            centillion.search.get_http_client = lambda: FakeExportClient(200)
+            self.update()
+        finally:
+            centillion.search.get_http_client = get_http_client
+
+        indexed = self.indexed()
+        self.assertEqual(set(indexed.keys()), {'a','b','c','e'})
+        self.assertEqual(indexed['e']['content'], 'Exported text\n')
+        self.assertEqual(self.service.calls['files.list'], 2)
+        self.assertEqual(sorted(self.exported), ['a','b','c','e','e'])
@@ -0,0 +1,186 @@
+import os
+import shutil
+import tempfile
+import unittest
+import threading
+
+from centillion.search import Search, get_shared_search
+from centillion.search.sync_state import SyncState
+from centillion.search.generations import get_current_generation, list_generations
+
+
+"""
+test_generations
+
+Test full rebuilds of the search index in a new
+generation directory, the atomic swap to the new
+generation, and the removal of old generations.
+
+Also test the process-wide Search object used by
+the webapp, and its searcher shared by all threads.
+
+To run, use pytest:
+
+    $ pytest
+    $ python -m unittest -q test_generations.GenerationsTest
+    $ python -m unittest -q test_generations.SharedSearchTest
+"""
+
+
+def make_record(doc_id, content):
+    return dict(id=doc_id, kind='gdoc', title=doc_id, content=content)
+
+
+class GenerationsTest(unittest.TestCase):
+    """
+    Test rebuilding the search index into new generations.
+    """
+    def setUp(self):
+        self.root = os.path.join(tempfile.mkdtemp(), 'search_index')
+        self.config = dict(INDEX_KEEP_GENERATIONS=1)
+
+        # A plain index, with some sync state
+        self.search = Search(self.root)
+        self.search.commit_records([make_record('old', 'old document')])
+        state = SyncState(self.search.index_folder, 'gdrive_sync')
+        state.set('page_token', '42')
+        state.save()
+
+    def tearDown(self):
+        shutil.rmtree(os.path.dirname(self.root))
+
+    def ids(self, search):
+        with search.ix.searcher() as s:
+            return sorted(d['id'] for d in s.all_stored_fields())
+
+    def test_swap(self):
+        """Searches should see the old index until the new one is swapped in
+        """
+        shadow = self.search.open_shadow_index()
+        self.assertEqual(SyncState(shadow.index_folder, 'gdrive_sync').get('page_token'), None)
+        shadow.commit_records([make_record('new', 'new document')])
+
+        # Still the old index
+        self.assertEqual(self.ids(Search(self.root)), ['old'])
+
+        self.search.swap_index(shadow, self.config)
+        self.assertEqual(self.ids(Search(self.root)), ['new'])
+        self.assertEqual(self.ids(self.search), ['new'])
+        self.assertEqual(get_current_generation(self.root), 'generation-000001')
+
+        # The plain index and its sync state are gone
+        self.assertNotIn('gdrive_sync.json', os.listdir(self.root))
+        self.assertFalse(any(f.endswith('.toc') for f in os.listdir(self.root)))
+
+    def test_old_generations_removed(self):
+        """Only the live generation and INDEX_KEEP_GENERATIONS older ones should be kept
+        """
+        for i in range(3):
+            shadow = self.search.open_shadow_index()
+            shadow.commit_records([make_record('doc%d'%(i), 'document')])
+            self.search.swap_index(shadow, self.config)
+
+        self.assertEqual(list_generations(self.root), ['generation-000002', 'generation-000003'])
+        self.assertEqual(self.ids(Search(self.root)), ['doc2'])
+
+    def test_failed_rebuild(self):
+        """A rebuild with a failed source should be thrown away
+        """
+        def update_index(shadow, *args, **kwargs):
+            shadow.commit_records([make_record('partial', 'partial document')])
+            return ['Github files']
+
+        Search.update_index, original = update_index, Search.update_index
+        try:
+            swapped = self.search.rebuild_index('', '', '', self.config)
+        finally:
+            Search.update_index = original
+
+        self.assertFalse(swapped)
+        self.assertEqual(list_generations(self.root), [])
+        self.assertEqual(self.ids(Search(self.root)), ['old'])
+
+
+class SharedSearchTest(unittest.TestCase):
+    """
+    Test get_shared_search and Search.shared_searcher.
+    """
+    def setUp(self):
+        self.root = os.path.join(tempfile.mkdtemp(), 'search_index')
+        Search(self.root).commit_records([make_record('old', 'old document')])
+
+    def tearDown(self):
+        shutil.rmtree(os.path.dirname(self.root))
+
+    def test_searcher_refreshed_on_commit(self):
+        """The searcher should be reused until the index changes
+        """
+        search = get_shared_search(self.root)
+        self.assertIs(get_shared_search(self.root), search)
+        with search.shared_searcher() as searcher:
+            pass
+        with search.shared_searcher() as s:
+            self.assertIs(s, searcher)
+        self.assertEqual(search.get_document_total_count()['gdoc'], 1)
+
+        # A commit by another Search object
+        Search(self.root).commit_records([make_record('new', 'new document')])
+        with search.shared_searcher() as s:
+            self.assertIsNot(s, searcher)
+        self.assertTrue(searcher.is_closed)
+        self.assertEqual(search.get_document_total_count()['gdoc'], 2)
+        self.assertEqual(len(search.get_list('gdoc')), 2)
+
+    def test_searcher_shared_by_threads(self):
+        """Searches from different threads should use the same searcher
+        """
+        search = get_shared_search(self.root)
+        searchers = []
+        def run():
+            search.search(['nothing'])
+            with search.shared_searcher() as s:
+                searchers.append(s)
+        threads = [threading.Thread(target=run) for i in range(2)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(searchers), 2)
+        self.assertIs(searchers[0], searchers[1])
+
+    def test_results_rendered_without_searcher(self):
+        """Search results should be rendered after the shared searcher is released
+        """
+        search = get_shared_search(self.root)
+        free = []
+        def create_search_result(hits):
+            # Another thread can use the searcher meanwhile
+            def use_searcher():
+                if search.searcher_lock.acquire(timeout=1):
+                    search.searcher_lock.release()
+                    free.append(True)
+            t = threading.Thread(target=use_searcher)
+            t.start()
+            t.join()
+            return []
+        search.create_search_result = create_search_result
+        search.search(['nothing'])
+        self.assertEqual(free, [True])
+
+    def test_new_generation(self):
+        """A rebuild swapped in by another Search object should be picked up
+        """
+        search = get_shared_search(self.root)
+        other = Search(self.root)
+        shadow = other.open_shadow_index()
+        shadow.commit_records([make_record('rebuilt', 'rebuilt document')])
+
+        # Not live yet
+        self.assertIs(get_shared_search(self.root), search)
+
+        search.get_document_total_count()
+        other.swap_index(shadow, {})
+        rebuilt = get_shared_search(self.root)
+        self.assertIsNot(rebuilt, search)
+        self.assertIsNone(search.searcher)
+        self.assertEqual([d['title'] for d in rebuilt.get_list('gdoc')], ['rebuilt'])
@@ -0,0 +1,439 @@
+import os
+import shutil
+import hashlib
+import tempfile
+import datetime
+import unittest
+
+from github import UnknownObjectException
+
+import centillion
+from centillion.search import Search
+
+
+"""
+test_gh_sync
+
+Test the Github sync logic (incremental issue
+updates, parallel repository crawls) of the
+centillion search index against
+a fake Github API object, without making any
+real API calls.
+
+To run, use pytest:
+
+    $ pytest
+    $ python -m unittest -q test_gh_sync.GithubSyncTest
+"""
+
+
+CONFIG = {
+    'TESTING' : False,
+    'TRUNCATE_ISSUES_LISTING' : False,
+    'REPOSITORIES' : ['fakeorg/fakerepo'],
+}
+
+T0 = datetime.datetime(2018, 7, 1, 12, 0, 0)
+
+
+class FakeList(list):
+    """List with a totalCount, like PyGithub's PaginatedList"""
+    @property
+    def totalCount(self):
+        return len(self)
+
+
+class FakeUser(object):
+    def __init__(self, login):
+        self.login = login
+
+
+class FakeComment(object):
+    def __init__(self, issue, body, created_at):
+        self.issue_url = issue.url
+        self.body = body
+        self.created_at = created_at
+        self.updated_at = created_at
+
+
+class FakeIssue(object):
+    def __init__(self, repo, number, body, updated_at):
+        self.repository = repo
+        self.number = number
+        self.url = 'https://api.github.com/repos/%s/issues/%d'%(repo.full_name, number)
+        self.html_url = 'https://github.com/%s/issues/%d'%(repo.full_name, number)
+        self.title = 'Issue %d'%(number)
+        self.body = body
+        self.user = FakeUser('pasteur')
+        self.created_at = T0
+        self.updated_at = updated_at
+        self.comment_list = []
+
+    @property
+    def comments(self):
+        return len(self.comment_list)
+
+    def get_comments(self):
+        self.repository.calls['issue.get_comments'] += 1
+        return FakeList(self.comment_list)
+
+
+class FakeCommit(object):
+    def __init__(self, sha):
+        self.sha = sha
+
+
+class FakeTree(object):
+    def __init__(self, sha, tree):
+        self.sha = sha
+        self.raw_data = {'sha' : sha, 'tree' : tree}
+
+
+class FakeRepo(object):
+    def __init__(self, owner, name):
+        self.owner = FakeUser(owner)
+        self.name = name
+        self.full_name = owner + '/' + name
+        self.html_url = 'https://github.com/' + self.full_name
+        self.issues = {}
+        self.files = {}
+        self.calls = {'get_issues' : 0, 'issue.get_comments' : 0, 'get_issues_comments' : 0, 'get_git_tree' : 0}
+
+    def get_issues_comments(self, sort=None, direction=None, since=None):
+        self.calls['get_issues_comments'] += 1
+        self.comments_since = since
+        comments = [c for i in self.issues.values() for c in i.comment_list]
+        if since is not None:
+            comments = [c for c in comments if c.updated_at >= since]
+        return FakeList(sorted(comments, key=lambda c: c.updated_at))
+
+    def add_file(self, path, sha):
+        """Add a (non-markdown) file, so no download is attempted"""
+        self.files[path] = sha
+
+    def tree_sha(self, prefix):
+        """Fake tree sha, which changes when anything under prefix changes"""
+        under = sorted((p, sha) for p, sha in self.files.items() if p.startswith(prefix))
+        return 'tree-' + hashlib.sha1(repr(under).encode('utf-8')).hexdigest()[:8]
+
+    def get_commits(self):
+        return FakeList([FakeCommit('head-' + self.tree_sha(''))])
+
+    def get_git_tree(self, sha, recursive=False):
+        self.calls['get_git_tree'] += 1
+        if sha.startswith('head-'):
+            sha = sha[len('head-'):]
+
+        # Find the directory with this tree sha
+        dirs = set([''])
+        for path in self.files:
+            pieces = path.split('/')
+            for i in range(1, len(pieces)):
+                dirs.add('/'.join(pieces[:i]) + '/')
+        prefix = [d for d in dirs if self.tree_sha(d) == sha][0]
+
+        # List the directory, recursively or not
+        entries = {}
+        for path, file_sha in self.files.items():
+            if not path.startswith(prefix):
+                continue
+            pieces = path[len(prefix):].split('/')
+            if not recursive:
+                pieces = pieces[:1]
+            for i in range(1, len(pieces)+1):
+                name = '/'.join(pieces[:i])
+                if name in entries:
+                    continue
+                if i < len(pieces) or prefix + name != path:
+                    entries[name] = ('tree', self.tree_sha(prefix + name + '/'))
+                else:
+                    entries[name] = ('blob', file_sha)
+
+        tree = []
+        for name, (kind, entry_sha) in sorted(entries.items()):
+            tree.append({
+                'path' : name,
+                'type' : kind,
+                'sha' : entry_sha,
+                'url' : 'https://api.github.com/repos/%s/git/%ss/%s'%(self.full_name, kind, entry_sha)
+            })
+        return FakeTree(sha, tree)
+
+    def add_issue(self, number, body, updated_at=T0, comments=()):
+        issue = FakeIssue(self, number, body, updated_at)
+        for j, comment in enumerate(comments):
+            issue.comment_list.append(FakeComment(issue, comment, updated_at))
+        self.issues[number] = issue
+        return issue
+
+    def get_issues(self, state='open', since=None, sort=None, direction=None):
+        self.calls['get_issues'] += 1
+        issues = sorted(self.issues.values(), key=lambda i: i.number)
+        if since is not None:
+            issues = [i for i in issues if i.updated_at >= since]
+        return FakeList(issues)
+
+
+class FakeOwner(object):
+    def __init__(self, github, login):
+        self.github = github
+        self.login = login
+
+    def get_repo(self, name):
+        key = self.login + '/' + name
+        if key not in self.github.repos:
+            raise UnknownObjectException(404, {}, {})
+        return self.github.repos[key]
+
+
+class FakeGithub(object):
+    """
+    Fake Github API object implementing the
+    calls centillion uses to crawl repositories.
+    """
+    def __init__(self, repos):
+        self.repos = {r.full_name : r for r in repos}
+
+    def get_organization(self, login):
+        return FakeOwner(self, login)
+
+    def get_user(self, login):
+        return FakeOwner(self, login)
+
+
+class GithubSyncTest(unittest.TestCase):
+    """
+    Test Github sync against a fake Github API object.
+    """
+    def setUp(self):
+        self.index_dir = tempfile.mkdtemp()
+        self.search = Search(os.path.join(self.index_dir, 'search_index'))
+        self.repo = FakeRepo('fakeorg', 'fakerepo')
+        self.repo.add_issue(1, 'bacteria', comments=['microscope'])
+        self.repo.add_issue(2, 'chicken')
+        self.repo.add_issue(3, 'waffles', comments=['syrup', 'butter'])
+        self.repo.add_file('README.txt', 'sha1')
+        self.repo.add_file('src/main.py', 'sha2')
+        self.repo.add_file('.gitignore', 'sha3')
+        self.other = FakeRepo('fakeuser', 'otherrepo')
+        self.other.add_issue(1, 'pancakes')
+        self.other.add_file('LICENSE', 'sha4')
+        self.other.add_file('docs/main.py', 'sha2')
+        self.github = FakeGithub([self.repo, self.other])
+
+    def tearDown(self):
+        shutil.rmtree(self.index_dir)
+
+    def indexed(self, kind):
+        with self.search.ix.searcher() as s:
+            return {d['id'] : d for d in s.documents(kind=kind)}
+
+    def update_issues(self, **config):
+        config = dict(CONFIG, **config)
+        self.search.update_index_issues('', config, g=self.github)
+
+    def update_files(self, **config):
+        config = dict(CONFIG, **config)
+        self.search.update_index_ghfiles('', config, g=self.github)
+
+    def test_1_issues_first_run(self):
+        """The first run should index every issue with its comments
+        """
+        self.update_issues()
+        indexed = self.indexed('issue')
+        self.assertEqual(len(indexed), 3)
+        issue3 = indexed['https://github.com/fakeorg/fakerepo/issues/3']
+        self.assertEqual(issue3['content'], 'waffles\nsyrup\nbutter\n')
+        self.assertEqual(issue3['repo_name'], 'fakeorg/fakerepo')
+
+    def test_2_issues_only_changed_are_refetched(self):
+        """Later runs should only fetch comments for issues updated since the watermark
+        """
+        self.update_issues()
+        comment_calls = self.repo.calls['issue.get_comments']
+
+        # Nothing changed
+        self.update_issues()
+        self.assertEqual(self.repo.calls['issue.get_comments'], comment_calls)
+
+        # One issue changed, one issue added
+        issue = self.repo.add_issue(3, 'waffles', updated_at=T0+datetime.timedelta(hours=1), comments=['syrup', 'butter', 'bananas'])
+        self.repo.add_issue(4, 'pineapple', updated_at=T0+datetime.timedelta(hours=2))
+        self.update_issues()
+        self.assertEqual(self.repo.calls['issue.get_comments'], comment_calls+1)
+
+        indexed = self.indexed('issue')
+        self.assertEqual(len(indexed), 4)
+        self.assertIn('bananas', indexed[issue.html_url]['content'])
+
+    def test_3_issues_removed_are_dropped(self):
+        """Issues that no longer exist should be removed from the index
+        """
+        self.update_issues()
+        del self.repo.issues[2]
+        self.update_issues()
+        indexed = self.indexed('issue')
+        self.assertEqual(len(indexed), 2)
+        self.assertNotIn('https://github.com/fakeorg/fakerepo/issues/2', indexed)
+
+    def test_4_issues_from_removed_repos_are_dropped(self):
+        """Issues from repos that are no longer configured should be removed
+        """
+        self.update_issues()
+        self.update_issues(REPOSITORIES=[])
+        self.assertEqual(len(self.indexed('issue')), 0)
+
+    def test_5_issues_from_several_repos(self):
+        """Repos crawled in parallel should all end up in the index, missing repos skipped
+        """
+        self.update_issues(GITHUB_WORKERS=3, REPOSITORIES=['fakeorg/fakerepo', 'fakeuser/otherrepo', 'fakeorg/missing'])
+        indexed = self.indexed('issue')
+        self.assertEqual(len(indexed), 4)
+        self.assertIn('https://github.com/fakeuser/otherrepo/issues/1', indexed)
+
+    def test_6_files_from_several_repos(self):
+        """Files from every repo should be indexed once, hidden files skipped
+        """
+        self.update_files(GITHUB_WORKERS=2, REPOSITORIES=['fakeorg/fakerepo', 'fakeuser/otherrepo'])
+        indexed = set(d['title'] for d in self.indexed('ghfile').values())
+        self.assertEqual(indexed, {'README.txt', 'src', 'main.py', 'LICENSE', 'docs'})
+
+        # A second run gives the same index
+        self.update_files(GITHUB_WORKERS=2, REPOSITORIES=['fakeorg/fakerepo', 'fakeuser/otherrepo'])
+        self.assertEqual(len(self.indexed('ghfile')), 5)
+
+    def test_7_bulk_comments(self):
+        """Comments should be listed for the whole repo when that takes fewer calls
+        """
+        for number in range(10, 20):
+            self.repo.add_issue(number, 'issue %d'%(number), comments=['first %d'%(number), 'second %d'%(number)])
+        self.update_issues()
+        self.assertEqual(self.repo.calls['get_issues_comments'], 1)
+        self.assertEqual(self.repo.calls['issue.get_comments'], 0)
+
+        indexed = self.indexed('issue')
+        self.assertEqual(len(indexed), 13)
+        self.assertEqual(indexed['https://github.com/fakeorg/fakerepo/issues/12']['content'], 'issue 12\nfirst 12\nsecond 12\n')
+        self.assertEqual(indexed['https://github.com/fakeorg/fakerepo/issues/3']['content'], 'waffles\nsyrup\nbutter\n')
+
+    def test_8_per_issue_comments(self):
+        """Comments should be fetched per issue when that is disabled
+        """
+        for number in range(10, 20):
+            self.repo.add_issue(number, 'issue %d'%(number), comments=['first %d'%(number)])
+        self.update_issues(GITHUB_BULK_COMMENTS_THRESHOLD=0)
+        self.assertEqual(self.repo.calls['get_issues_comments'], 0)
+        self.assertEqual(self.repo.calls['issue.get_comments'], 12)
+
+    def test_9_files_only_new_are_fetched(self):
+        """Unchanged files should be left alone, new files added and removed files dropped
+        """
+        fetched = []
+        make_ghfile_record = self.search.make_ghfile_record
+        def counting_make_ghfile_record(d, *args, **kwargs):
+            fetched.append(d['path'])
+            return make_ghfile_record(d, *args, **kwargs)
+        self.search.make_ghfile_record = counting_make_ghfile_record
+
+        self.update_files()
+        self.assertEqual(sorted(fetched), ['README.txt', 'src', 'src/main.py'])
+
+        # Nothing changed
+        self.update_files()
+        self.assertEqual(len(fetched), 3)
+
+        # One file changed, one file removed
+        self.repo.add_file('README.txt', 'sha5')
+        del self.repo.files['src/main.py']
+        self.update_files()
+        self.assertEqual(fetched[3:], ['README.txt'])
+        self.assertEqual(set(self.indexed('ghfile').keys()), {'README.txt_sha5'})
+
+    def test_10_files_kept_if_repo_fails(self):
+        """Files from a repo that can't be crawled should stay in the index
+        """
+        self.update_files()
+        del self.github.repos['fakeorg/fakerepo']
+        self.update_files()
+        self.assertEqual(len(self.indexed('ghfile')), 3)
+
+        # Unless the repo is removed from the config
+        self.update_files(REPOSITORIES=[])
+        self.assertEqual(len(self.indexed('ghfile')), 0)
+
+    def test_11_unchanged_repos_are_skipped(self):
+        """Repos whose head has not moved should be skipped, changed repos only list changed trees
+        """
+        self.repo.add_file('src/lib/util.py', 'sha6')
+        self.repo.add_file('docs/index.txt', 'sha7')
+        self.update_files()
+        self.assertEqual(self.repo.calls['get_git_tree'], 1)
+
+        # Nothing changed, no trees are listed
+        self.update_files()
+        self.assertEqual(self.repo.calls['get_git_tree'], 1)
+
+        # A change under src/lib lists the root, src and src/lib only
+        self.repo.add_file('src/lib/util.py', 'sha8')
+        self.update_files()
+        self.assertEqual(self.repo.calls['get_git_tree'], 4)
+
+        indexed = self.indexed('ghfile')
+        self.assertIn('util.py_sha8', indexed)
+        self.assertNotIn('util.py_sha6', indexed)
+        self.assertIn('index.txt_sha7', indexed)
+        self.assertIn('main.py_sha2', indexed)
+
+    def test_12_repo_crawled_again_if_index_cleared(self):
+        """Saved trees should not be trusted if their files are missing from the index
+        """
+        self.update_files()
+        writer = self.search.ix.writer()
+        writer.delete_by_term('id', 'README.txt_sha1')
+        writer.commit()
+        self.update_files()
+        self.assertIn('README.txt_sha1', self.indexed('ghfile'))
+
+    def test_13_issues_reconciled_when_counts_match(self):
+        """A deleted issue should be dropped by the periodic full listing, even if the issue count did not change
+        """
+        self.update_issues()
+
+        # One issue deleted, and one the incremental
+        # listing does not see: the counts match
+        del self.repo.issues[2]
+        self.repo.add_issue(4, 'pineapple', updated_at=T0-datetime.timedelta(hours=1))
+        self.update_issues()
+        self.assertIn('https://github.com/fakeorg/fakerepo/issues/2', self.indexed('issue'))
+
+        # Time to reconcile
+        self.update_issues(GITHUB_ISSUES_RECONCILE_INTERVAL=0)
+        indexed = self.indexed('issue')
+        self.assertNotIn('https://github.com/fakeorg/fakerepo/issues/2', indexed)
+        self.assertIn('https://github.com/fakeorg/fakerepo/issues/4', indexed)
+        self.assertEqual(len(indexed), 3)
+
+    def test_14_bulk_comments_since_watermark(self):
+        """Incremental runs should only list the comments updated since the watermark
+        """
+        self.repo.add_issue(20, 'old', updated_at=T0-datetime.timedelta(hours=1), comments=['older comment'])
+        self.update_issues(GITHUB_BULK_COMMENTS_THRESHOLD=3)
+        self.assertEqual(self.repo.comments_since, None)
+        comment_calls = self.repo.calls['issue.get_comments']
+
+        # New issues with comments, and a new
+        # comment on an issue with an older one
+        T1 = T0+datetime.timedelta(hours=1)
+        for number in range(30, 34):
+            self.repo.add_issue(number, 'issue %d'%(number), updated_at=T1, comments=['first %d'%(number)])
+        issue = self.repo.issues[20]
+        issue.updated_at = T1
+        issue.comment_list.append(FakeComment(issue, 'newer comment', T1))
+        self.update_issues(GITHUB_BULK_COMMENTS_THRESHOLD=3)
+
+        self.assertEqual(self.repo.comments_since, T0)
+        # Only the issue with an older comment is fetched by itself
+        self.assertEqual(self.repo.calls['issue.get_comments'], comment_calls+1)
+        indexed = self.indexed('issue')
+        self.assertEqual(indexed['https://github.com/fakeorg/fakerepo/issues/20']['content'], 'old\nolder comment\nnewer comment\n')
+        self.assertEqual(indexed['https://github.com/fakeorg/fakerepo/issues/31']['content'], 'issue 31\nfirst 31\n')
@@ -0,0 +1,255 @@
+import io
+import os
+import shutil
+import tempfile
+import zipfile
+import unittest
+from mailbox import mbox
+
+from centillion.search import Search
+from centillion.search.groupsio_util import iter_threads_from_mbox, iter_mbox_messages, \
+        extract_threads_from_mbox, open_mbox_in_zip, crawl_subgroup
+
+
+"""
+test_groupsio
+
+Test the streaming mbox parser used to index
+Groups.io email archives, on a small handmade
+mbox file, and incremental updates of the search
+index against a fake Groups.io API client.
+
+To run, use pytest:
+
+    $ pytest
+    $ python -m unittest -q test_groupsio.MboxTest
+    $ python -m unittest -q test_groupsio.CrawlSubgroupTest
+    $ python -m unittest -q test_groupsio.GroupsioSyncTest
+"""
+
+
+MBOX = b"""From 12345@groups.io Mon Jul 02 12:00:00 2018
+From: "Ada Lovelace" <ada@example.com>
+Subject: Analytical engine
+Date: Mon, 02 Jul 2018 12:00:00 +0000
+Content-Type: text/plain
+
+Notes on the engine.
+
+From 12346@groups.io Mon Jul 02 13:00:00 2018
+From: charles@example.com
+Subject: Re: Analytical engine
+Date: Mon, 02 Jul 2018 13:00:00 +0000
+MIME-Version: 1.0
+Content-Type: multipart/alternative; boundary="XXX"
+
+--XXX
+Content-Type: text/plain
+
+Difference engine first.
+--XXX
+Content-Type: text/html
+
+<p>Difference engine first.</p>
+--XXX--
+
+From 12347@groups.io Mon Jul 02 14:00:00 2018
+From: "Ada Lovelace" <ada@example.com>
+Subject: Bernoulli numbers
+Date: Mon, 02 Jul 2018 14:00:00 +0000
+Content-Type: text/html
+
+<p>No plain text here</p>
+"""
+
+
+class MboxTest(unittest.TestCase):
+    """
+    Test the streaming mbox parser.
+    """
+    def test_messages_match_mailbox(self):
+        """The streaming parser should find the same messages as the mailbox module
+        """
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp, 'messages.mbox')
+            with open(path, 'wb') as f:
+                f.write(MBOX)
+            expected = [(m['Subject'], m.get_payload()) for k, m in mbox(path).items()]
+        finally:
+            shutil.rmtree(tmp)
+
+        messages = [(m['Subject'], m.get_payload()) for m in iter_mbox_messages(io.BytesIO(MBOX))]
+        self.assertEqual([s for s, p in messages], [s for s, p in expected])
+        self.assertEqual(messages[0][1], expected[0][1])
+
+    def test_archive_items(self):
+        """Each message should become one archive item, streamed from the zip file
+        """
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as z:
+            z.writestr('messages.mbox', MBOX)
+
+        with zipfile.ZipFile(io.BytesIO(buf.getvalue())) as z:
+            with open_mbox_in_zip(z) as f:
+                items = list(iter_threads_from_mbox(f, 'dcppc+engines'))
+
+        self.assertEqual(len(items), 3)
+        permalink, item = items[1]
+        self.assertEqual(permalink, 'https://dcppc.groups.io/g/engines/message/2')
+        self.assertEqual(item['subject'], 'Re: Analytical engine')
+        self.assertEqual(item['sender_email'], 'charles@example.com')
+        self.assertIn('Difference engine first.', item['content'])
+
+        self.assertEqual(items[0][1]['sender_name'], 'Ada Lovelace')
+        self.assertEqual(items[2][1]['content'], "b''")
+
+        # The dictionary version gives the same items
+        archive = extract_threads_from_mbox(MBOX, 'dcppc+engines')
+        self.assertEqual(sorted(archive.keys()), sorted(p for p, i in items))
+
+
+class FakeResponse(object):
+    def __init__(self, data=None, content=b''):
+        self.data = data
+        self.content = content
+
+    def json(self):
+        return self.data
+
+
+class FakeGroupsioClient(object):
+    """
+    Fake HTTP client answering the Groups.io
+    getsubgroups and downloadarchives calls.
+
+    subgroups maps subgroup ids to
+    (subgroup name, mbox bytes) tuples.
+    """
+    def __init__(self, subgroups):
+        self.subgroups = subgroups
+        self.downloads = []
+
+    def post(self, url, data=None, auth=None, stream=False):
+        if url.endswith('getsubgroups'):
+            dat = [{'id' : k, 'name' : v[0]} for k, v in sorted(self.subgroups.items())]
+            return FakeResponse({'data' : dat})
+
+        group_id = dict(data)['group_id']
+        self.downloads.append(group_id)
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as z:
+            z.writestr('messages.mbox', self.subgroups[group_id][1])
+        return FakeResponse(content=buf.getvalue())
+
+
+def make_message(n, subject):
+    return ("""From %d@groups.io Mon Jul 02 12:00:00 2018
+From: "Ada Lovelace" <ada@example.com>
+Subject: %s
+Date: Mon, 02 Jul 2018 12:%02d:00 +0000
+Content-Type: text/plain
+
+Message %d.
+
+"""%(n, subject, n, n)).encode('utf-8')
+
+
+class CrawlSubgroupTest(unittest.TestCase):
+    """
+    Test crawl_subgroup against a fake Groups.io API client.
+    """
+    def test_messages_are_streamed(self):
+        """New messages should be parsed one at a time, as they are iterated over
+        """
+        mbox = b''.join(make_message(n, 'Message %d'%(n)) for n in range(1, 6))
+        crawl = crawl_subgroup(1, 'dcppc+engines', 'token', after=2, client=FakeGroupsioClient({1 : ('dcppc+engines', mbox)}))
+
+        items = iter(crawl)
+        self.assertEqual(next(items)['number'], 3)
+        self.assertEqual((crawl.count, crawl.highest), (1, 3))
+        self.assertEqual([item['number'] for item in items], [4, 5])
+        self.assertEqual((crawl.count, crawl.highest, crawl.reset), (3, 5, False))
+
+    def test_shrunk_archive_is_reset(self):
+        """An archive with fewer messages than the watermark should be crawled again from the start
+        """
+        mbox = make_message(1, 'Engines') + make_message(2, 'Re: Engines')
+        crawl = crawl_subgroup(1, 'dcppc+engines', 'token', after=4, client=FakeGroupsioClient({1 : ('dcppc+engines', mbox)}))
+        self.assertEqual([item['number'] for item in crawl], [1, 2])
+        self.assertEqual((crawl.count, crawl.highest, crawl.reset), (2, 2, True))
+
+
+class GroupsioSyncTest(unittest.TestCase):
+    """
+    Test incremental Groups.io updates of the search index.
+    """
+    def setUp(self):
+        self.index_dir = tempfile.mkdtemp()
+        self.search = Search(os.path.join(self.index_dir, 'search_index'))
+        self.subgroups = {
+            1 : ['dcppc+engines', make_message(1, 'Engines') + make_message(2, 'Re: Engines')],
+            2 : ['dcppc+looms', make_message(1, 'Looms')],
+        }
+        self.client = FakeGroupsioClient(self.subgroups)
+
+    def tearDown(self):
+        shutil.rmtree(self.index_dir)
+
+    def indexed(self):
+        with self.search.ix.searcher() as s:
+            return {d['id'] : d for d in s.documents(kind='emailthread')}
+
+    def update(self, **config):
+        self.search.update_index_emailthreads('token', config, client=self.client)
+
+    def test_only_new_messages_are_added(self):
+        """Only messages after each subgroup's watermark should be indexed again
+        """
+        self.update(GROUPSIO_WORKERS=2)
+        first = self.indexed()
+        self.assertEqual(set(first.keys()), {
+            'https://dcppc.groups.io/g/engines/message/1',
+            'https://dcppc.groups.io/g/engines/message/2',
+            'https://dcppc.groups.io/g/looms/message/1',
+        })
+        self.assertEqual(sorted(self.client.downloads), [1, 2])
+        d = first['https://dcppc.groups.io/g/engines/message/2']
+        self.assertEqual(d['title'], 'Re: Engines')
+        self.assertEqual(d['group'], 'engines')
+        self.assertEqual(d['owner_name'], 'Ada Lovelace')
+        self.assertEqual(d['created_time'].minute, 2)
+
+        # A new message in one subgroup
+        self.subgroups[2][1] += make_message(2, 'Re: Looms')
+        self.update()
+        second = self.indexed()
+        self.assertEqual(len(second), 4)
+        for k in first.keys():
+            self.assertEqual(second[k]['indexed_time'], first[k]['indexed_time'])
+
+    def test_removed_subgroups_are_dropped(self):
+        """Messages of subgroups that are gone should be removed from the index
+        """
+        self.update()
+        del self.subgroups[1]
+        self.update()
+        self.assertEqual(set(self.indexed().keys()), {'https://dcppc.groups.io/g/looms/message/1'})
+
+    def test_shrunk_archive_is_reindexed(self):
+        """A subgroup with fewer messages than its watermark should be indexed from scratch
+        """
+        self.update()
+        self.subgroups[1][1] = make_message(1, 'Engines, again')
+        self.update()
+        indexed = self.indexed()
+        self.assertNotIn('https://dcppc.groups.io/g/engines/message/2', indexed)
+        self.assertEqual(indexed['https://dcppc.groups.io/g/engines/message/1']['title'], 'Engines, again')
+
+    def test_cleared_index(self):
+        """Watermarks should be ignored if the index does not have the messages
+        """
+        self.update()
+        self.search.open_index(self.search.index_folder, create_new=True)
+        self.update()
+        self.assertEqual(len(self.indexed()), 3)
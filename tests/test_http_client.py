@@ -0,0 +1,178 @@
+import os
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+import centillion.search.http_client as http_client
+from centillion.search.http_client import HttpClient
+from centillion.search.rate_limit import get_rate_limiter
+from centillion.search.http_cache import HttpCache
+
+
+"""
+test_http_client
+
+Test the shared HTTP client used by the crawlers
+(keep-alive, retries, per-host concurrency cap,
+rate limits) and the on-disk conditional request cache against
+a local HTTP server.
+
+To run, use pytest:
+
+    $ pytest
+    $ python -m unittest -q test_http_client.HttpClientTest
+"""
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            server.connections.add(self.client_address)
+            fail = server.failures > 0
+            if fail:
+                server.failures -= 1
+            limited = server.rate_limited > 0
+            if limited:
+                server.rate_limited -= 1
+
+        etag = '"%s"'%(server.version)
+        if fail:
+            self.send_response(503)
+            body = b'try again'
+        elif limited:
+            self.send_response(403)
+            body = b'API rate limit exceeded'
+            self.send_header('X-RateLimit-Remaining', '0')
+            self.send_header('X-RateLimit-Reset', str(int(time.time())))
+        elif self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            body = b''
+        else:
+            self.send_response(200)
+            body = ('ok %s'%(server.version)).encode('utf-8')
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class HttpClientTest(unittest.TestCase):
+    """
+    Test HttpClient against a local HTTP server.
+    """
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), Handler)
+        self.server.lock = threading.Lock()
+        self.server.requests = 0
+        self.server.failures = 0
+        self.server.connections = set()
+        self.server.version = 1
+        self.server.rate_limited = 0
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%d/'%(self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_keep_alive(self):
+        """Requests to the same host should reuse one connection
+        """
+        client = HttpClient(backoff=0)
+        for i in range(5):
+            self.assertEqual(client.get(self.url).text, 'ok 1')
+        self.assertEqual(self.server.requests, 5)
+        self.assertEqual(len(self.server.connections), 1)
+        client.close()
+
+    def test_retry(self):
+        """5xx responses should be retried, up to the number of retries
+        """
+        client = HttpClient(retries=3, backoff=0)
+        self.server.failures = 2
+        self.assertEqual(client.get(self.url).status_code, 200)
+        self.assertEqual(self.server.requests, 3)
+
+        self.server.failures = 5
+        self.assertEqual(client.get(self.url).status_code, 503)
+        client.close()
+
+    def test_rate_limited(self):
+        """Requests refused because of the rate limit should be made again after the reset
+        """
+        host = '127.0.0.1:%d'%(self.server.server_address[1])
+        http_client.RATE_LIMITED_HOSTS[host] = 'Local API'
+        try:
+            client = HttpClient(backoff=0)
+            self.server.rate_limited = 1
+            self.assertEqual(client.get(self.url).status_code, 200)
+            self.assertEqual(self.server.requests, 2)
+            self.assertEqual(get_rate_limiter('Local API').used, 2)
+            client.close()
+        finally:
+            del http_client.RATE_LIMITED_HOSTS[host]
+
+    def test_host_semaphore(self):
+        """Each host should get its own concurrency cap
+        """
+        client = HttpClient(max_per_host=2)
+        a = client.host_semaphore('https://api.github.com/repos')
+        b = client.host_semaphore('https://API.github.com/users')
+        c = client.host_semaphore('https://disqus.com/api')
+        self.assertIs(a, b)
+        self.assertIsNot(a, c)
+        self.assertTrue(a.acquire(blocking=False))
+        self.assertTrue(a.acquire(blocking=False))
+        self.assertFalse(a.acquire(blocking=False))
+        client.close()
+
+    def test_cache(self):
+        """Repeat requests should be conditional, and served from the cache on 304
+        """
+        client = HttpClient(backoff=0)
+        cache_dir = tempfile.mkdtemp()
+        try:
+            cache = HttpCache(cache_dir)
+            headers = {'Authorization' : 'token abc'}
+
+            r = cache.get(client, self.url, headers=headers)
+            self.assertFalse(r.from_cache)
+            r = cache.get(client, self.url, headers=headers)
+            self.assertTrue(r.from_cache)
+            self.assertEqual(r.text, 'ok 1')
+            self.assertEqual((cache.hits, cache.misses, cache.stored), (1, 1, 1))
+
+            # Another token does not share the entry
+            r = cache.get(client, self.url, headers={'Authorization' : 'token xyz'})
+            self.assertFalse(r.from_cache)
+
+            # A changed resource is downloaded again
+            self.server.version = 2
+            r = cache.get(client, self.url, headers=headers)
+            self.assertFalse(r.from_cache)
+            self.assertEqual(r.text, 'ok 2')
+
+            # Tokens are not written to disk
+            for name in os.listdir(cache_dir):
+                with open(os.path.join(cache_dir, name), 'rb') as f:
+                    self.assertNotIn(b'abc', f.read())
+
+            # Prune down to nothing
+            cache.max_bytes = 0
+            self.assertEqual(cache.prune(), 2)
+            self.assertEqual(os.listdir(cache_dir), [])
+        finally:
+            shutil.rmtree(cache_dir)
+            client.close()
@@ -0,0 +1,154 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from centillion.search import Search
+from centillion.search.hypothesis_util import iter_annotation_pages
+from centillion.search.const import DEFAULT_HYPOTHESIS_BATCH_SIZE, DEFAULT_INDEX_BATCH_SIZE
+
+
+"""
+test_hypothesis
+
+Test the Hypothesis annotation indexer (search_after
+paging, incremental updates and batched commits)
+against a fake Hypothesis API client, without
+making any real API calls.
+
+To run, use pytest:
+
+    $ pytest
+    $ python -m unittest -q test_hypothesis.HypothesisSyncTest
+"""
+
+
+class FakeResponse(object):
+    def __init__(self, data, status_code=200):
+        self.data = data
+        self.status_code = status_code
+
+    def json(self):
+        return self.data
+
+
+class FakeHypothesisClient(object):
+    """
+    Fake HTTP client answering Hypothesis
+    search API calls, sorted by updated time
+    and paged with search_after.
+    """
+    def __init__(self, annotations):
+        self.annotations = annotations
+        self.calls = []
+
+    def get(self, url, headers=None, params=None):
+        self.calls.append(dict(params))
+        rows = sorted(self.annotations.values(), key=lambda a: a['updated'])
+        if 'search_after' in params:
+            rows = [a for a in rows if a['updated'] > params['search_after']]
+        return FakeResponse({'total' : len(rows), 'rows' : rows[:params['limit']]})
+
+
+def make_annotation(n, text, day=1):
+    return {
+        'id' : 'annotation%d'%(n),
+        'created' : '2018-07-01T12:00:00.000000+00:00',
+        'updated' : '2018-07-%02dT12:%02d:00.000000+00:00'%(day, n),
+        'user' : 'acct:ada@hypothes.is',
+        'uri' : 'https://pilot.nihdatacommons.us/page%d/'%(n),
+        'text' : text,
+        'tags' : ['engines', 'notes'],
+        'group' : '__world__',
+        'document' : {'title' : ['Page %d'%(n)]},
+        'links' : {'incontext' : 'https://hyp.is/annotation%d'%(n)},
+        'target' : [{'selector' : [{'type' : 'TextQuoteSelector', 'exact' : 'quoted %d'%(n)}]}],
+    }
+
+
+class HypothesisSyncTest(unittest.TestCase):
+    """
+    Test incremental Hypothesis updates of the search index.
+    """
+    def setUp(self):
+        self.index_dir = tempfile.mkdtemp()
+        self.search = Search(os.path.join(self.index_dir, 'search_index'))
+        self.annotations = {}
+        for n in range(1, 6):
+            a = make_annotation(n, 'Annotation %d'%(n))
+            self.annotations[a['id']] = a
+        self.client = FakeHypothesisClient(self.annotations)
+
+    def tearDown(self):
+        shutil.rmtree(self.index_dir)
+
+    def indexed(self):
+        with self.search.ix.searcher() as s:
+            return {d['id'] : d for d in s.documents(kind='annotation')}
+
+    def update(self, **config):
+        self.search.update_index_annotations('token', config, client=self.client)
+
+    def test_paging(self):
+        """Pages should follow each other with a search_after cursor
+        """
+        pages = list(iter_annotation_pages('token', since=None, limit=2, client=self.client))
+        self.assertEqual([len(rows) for rows in pages], [2, 2, 1])
+        self.assertNotIn('search_after', self.client.calls[0])
+        self.assertEqual(self.client.calls[1]['search_after'], pages[0][-1]['updated'])
+
+    def test_records(self):
+        """Annotations should be indexed with their page, user, quote and tags
+        """
+        self.update()
+        d = self.indexed()['annotation2']
+        self.assertEqual(d['title'], 'Page 2')
+        self.assertEqual(d['url'], 'https://hyp.is/annotation2')
+        self.assertEqual(d['owner_name'], 'ada')
+        self.assertEqual(d['tags'], 'engines,notes')
+        self.assertEqual(d['content'], '> quoted 2\n\nAnnotation 2')
+
+    def test_incremental_batches(self):
+        """Only annotations updated since the last run should be listed, and written in batches
+        """
+        commits = []
+        commit_records = self.search.commit_records
+        def count_commits(records, drop_ids=frozenset(), replace=True, **writer_options):
+            commits.append(len(records))
+            commit_records(records, drop_ids, replace, **writer_options)
+        self.search.commit_records = count_commits
+
+        # One page of annotations,
+        # committed 2 at a time
+        self.update(HYPOTHESIS_BATCH_SIZE=2)
+        first = self.indexed()
+        self.assertEqual(len(first), 5)
+        self.assertEqual(commits, [2, 2, 1])
+
+        # A changed annotation and a new one
+        self.annotations['annotation1'] = make_annotation(1, 'Changed', day=2)
+        a = make_annotation(6, 'New', day=2)
+        self.annotations[a['id']] = a
+        self.client.calls = []
+        self.update(HYPOTHESIS_BATCH_SIZE=2)
+
+        self.assertEqual(self.client.calls[0]['search_after'], '2018-07-01T12:05:00.000000+00:00')
+        second = self.indexed()
+        self.assertEqual(len(second), 6)
+        self.assertIn('Changed', second['annotation1']['content'])
+        self.assertEqual(second['annotation3']['indexed_time'], first['annotation3']['indexed_time'])
+
+    def test_default_batch_size(self):
+        """The default batch size should bound the commits, below the pipeline batch size
+        """
+        self.assertLess(DEFAULT_HYPOTHESIS_BATCH_SIZE, DEFAULT_INDEX_BATCH_SIZE)
+
+    def test_full_listing_drops_deleted(self):
+        """A full listing should drop annotations that are gone
+        """
+        self.update()
+        del self.annotations['annotation3']
+        self.update()
+        self.assertEqual(len(self.indexed()), 5)
+        self.update(HYPOTHESIS_INCREMENTAL=False)
+        self.assertNotIn('annotation3', self.indexed())
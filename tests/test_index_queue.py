@@ -0,0 +1,157 @@
+import threading
+import unittest
+
+import centillion.webapp.flask_index_queue as flask_index_queue
+from centillion.webapp.flask_index_queue import IndexJobQueue
+from centillion.search import IndexCancelled
+
+
+"""
+test_index_queue
+
+Test the webapp's index job queue (one job at a
+time, merged duplicate requests, history and
+cancellation) with a fake update index task.
+
+To run, use pytest:
+
+    $ pytest
+    $ python -m unittest -q test_index_queue.IndexJobQueueTest
+"""
+
+
+class FakeTask(object):
+    """
+    Fake UpdateIndexTask: waits until the test
+    lets it finish, or until it is cancelled, and
+    returns the result set for its run_which.
+    """
+    started = []
+    results = {}
+    running = 0
+    max_running = 0
+    release = threading.Event()
+    lock = threading.Lock()
+
+    def __init__(self, app_config, run_which='all', cancel=None):
+        self.run_which = run_which
+        self.cancel = cancel
+
+    def execute(self):
+        with FakeTask.lock:
+            FakeTask.started.append(self.run_which)
+            FakeTask.running += 1
+            FakeTask.max_running = max(FakeTask.max_running, FakeTask.running)
+        try:
+            while not FakeTask.release.wait(0.01):
+                if self.cancel.is_set():
+                    raise IndexCancelled()
+            if self.run_which == 'disqus':
+                raise IOError("Disqus is down")
+            return FakeTask.results.get(self.run_which, [])
+        finally:
+            with FakeTask.lock:
+                FakeTask.running -= 1
+
+
+class IndexJobQueueTest(unittest.TestCase):
+    """
+    Test IndexJobQueue against a fake update index task.
+    """
+    def setUp(self):
+        FakeTask.started = []
+        FakeTask.results = {}
+        FakeTask.running = 0
+        FakeTask.max_running = 0
+        FakeTask.release = threading.Event()
+        self.task = flask_index_queue.UpdateIndexTask
+        flask_index_queue.UpdateIndexTask = FakeTask
+        self.queue = IndexJobQueue({'INDEX_JOB_HISTORY' : 3})
+
+    def tearDown(self):
+        FakeTask.release.set()
+        flask_index_queue.UpdateIndexTask = self.task
+
+    def wait_until(self, condition):
+        for i in range(500):
+            if condition():
+                return
+            threading.Event().wait(0.01)
+        self.fail("timed out")
+
+    def test_merge_and_history(self):
+        """Duplicate requests should be merged, jobs run one at a time, and finished jobs kept
+        """
+        first, new = self.queue.submit('gdocs')
+        self.wait_until(lambda: self.queue.status()['current'] is not None)
+
+        # gdocs is running, so a new gdocs job
+        # is queued, and more requests merged
+        second, new = self.queue.submit('gdocs')
+        self.assertTrue(new)
+        third, new = self.queue.submit('gdocs')
+        self.assertFalse(new)
+        self.assertIs(third, second)
+        self.queue.submit('all')
+        self.assertEqual(self.queue.submit('issues')[1], False)
+        self.assertEqual(self.queue.status()['queued'][0]['requests'], 2)
+
+        with self.assertRaises(ValueError):
+            self.queue.submit('everything')
+
+        FakeTask.release.set()
+        self.wait_until(lambda: len(self.queue.status()['history']) == 3)
+        history = self.queue.status()['history']
+        self.assertEqual([j['run_which'] for j in history], ['all', 'gdocs', 'gdocs'])
+        self.assertEqual([j['status'] for j in history], ['done']*3)
+        self.assertIsNotNone(history[0]['duration'])
+        self.assertEqual(FakeTask.max_running, 1)
+
+    def test_cancel(self):
+        """Queued jobs should be dropped, and running jobs stopped, when cancelled
+        """
+        running, new = self.queue.submit('all')
+        self.wait_until(lambda: FakeTask.started == ['all'])
+        queued, new = self.queue.submit('ghfiles')
+
+        self.assertIs(self.queue.cancel(queued.id), queued)
+        self.assertIs(self.queue.cancel(running.id), running)
+        self.assertIsNone(self.queue.cancel(1000))
+
+        self.wait_until(lambda: self.queue.status()['current'] is None)
+        self.assertEqual([j['status'] for j in self.queue.status()['history']], ['cancelled', 'cancelled'])
+        self.assertEqual(FakeTask.started, ['all'])
+
+    def test_failed_job(self):
+        """A failed job should be recorded with its error, and not stop the queue
+        """
+        FakeTask.release.set()
+        self.queue.submit('disqus')
+        self.queue.submit('issues')
+        self.wait_until(lambda: len(self.queue.status()['history']) == 2)
+        failed, done = reversed(self.queue.status()['history'])
+        self.assertEqual((failed['status'], failed['error']), ('failed', 'Disqus is down'))
+        self.assertEqual(done['status'], 'done')
+
+    def test_failed_sources(self):
+        """A job where some sources failed to update should not be recorded as done
+        """
+        FakeTask.release.set()
+        FakeTask.results = {
+            'all' : ['Github issues', 'Disqus comment threads'],
+            'gdocs' : ['Google Drive'],
+            'rebuild' : False
+        }
+        self.queue.submit('all')
+        self.wait_until(lambda: len(self.queue.status()['history']) == 1)
+        self.queue.submit('gdocs')
+        self.wait_until(lambda: len(self.queue.status()['history']) == 2)
+        self.queue.submit('rebuild')
+        self.wait_until(lambda: len(self.queue.status()['history']) == 3)
+
+        rebuild, gdocs, everything = self.queue.status()['history']
+        self.assertEqual(everything['status'], 'partial')
+        self.assertEqual(everything['error'], 'Failed to update Github issues, Disqus comment threads')
+        self.assertEqual((gdocs['status'], gdocs['error']), ('failed', 'Failed to update Google Drive'))
+        self.assertEqual(rebuild['status'], 'failed')
+        self.assertIsNotNone(rebuild['error'])
@@ -0,0 +1,106 @@
+import shutil
+import tempfile
+import unittest
+
+from centillion.webapp.flask_index_scheduler import IndexScheduler
+
+
+"""
+test_index_scheduler
+
+Test the periodic index scheduler (per-source
+intervals, jitter, skipping runs that are still
+going, catching up after a restart) with a fake
+clock and a fake index job queue.
+
+To run, use pytest:
+
+    $ pytest
+    $ python -m unittest -q test_index_scheduler.IndexSchedulerTest
+"""
+
+
+class FakeQueue(object):
+    def __init__(self):
+        self.submitted = []
+        self.running = set()
+
+    def submit(self, run_which):
+        self.submitted.append(run_which)
+        return None, True
+
+    def is_running(self, run_which):
+        return run_which in self.running
+
+
+class FakeClock(object):
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class IndexSchedulerTest(unittest.TestCase):
+    """
+    Test IndexScheduler against a fake clock and queue.
+    """
+    def setUp(self):
+        self.index_dir = tempfile.mkdtemp()
+        self.config = {
+            'INDEX_DIR' : self.index_dir,
+            'INDEX_SCHEDULE' : {'gdocs' : 100, 'issues' : 1000, 'bogus' : 10},
+            'INDEX_SCHEDULE_JITTER' : 0.1,
+        }
+        self.clock = FakeClock(10000)
+        self.queue = FakeQueue()
+
+    def tearDown(self):
+        shutil.rmtree(self.index_dir)
+
+    def scheduler(self):
+        return IndexScheduler(self.config, self.queue, clock=self.clock)
+
+    def test_intervals(self):
+        """Each source should run once per interval, stretched by at most the jitter
+        """
+        scheduler = self.scheduler()
+        self.assertEqual(scheduler.check(), ['gdocs', 'issues'])
+
+        self.clock.now += 99
+        self.assertEqual(scheduler.check(), [])
+        self.clock.now += 12
+        self.assertEqual(scheduler.check(), ['gdocs'])
+        self.assertEqual(self.queue.submitted, ['gdocs', 'issues', 'gdocs'])
+
+    def test_skip_running(self):
+        """A source should be skipped while its previous job is still going
+        """
+        scheduler = self.scheduler()
+        scheduler.check()
+        self.queue.running.add('gdocs')
+        self.clock.now += 111
+        self.assertEqual(scheduler.check(), [])
+
+        # And run at the next interval
+        self.queue.running.clear()
+        self.clock.now += 111
+        self.assertEqual(scheduler.check(), ['gdocs'])
+
+    def test_catch_up_after_restart(self):
+        """Overdue sources should run right after a restart, the others wait
+        """
+        self.scheduler().check()
+
+        # Restart, 500 s later
+        self.clock.now += 500
+        self.queue.submitted = []
+        scheduler = self.scheduler()
+        self.assertEqual(scheduler.check(), ['gdocs'])
+        self.assertEqual(scheduler.check(), [])
+
+        # issues is due 1000-1100 s after its last run
+        self.clock.now += 400
+        self.assertEqual(scheduler.check(), ['gdocs'])
+        self.clock.now += 300
+        self.assertEqual(scheduler.check(), ['gdocs', 'issues'])
@@ -0,0 +1,260 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from concurrent.futures import ThreadPoolExecutor
+
+from centillion.search import Search
+from centillion.search.bulk_writer import open_writer, BulkWriter
+from centillion.search.pipeline import Connector, IndexPipeline, IndexCancelled, Drop, Checkpoint, iter_completed
+
+
+"""
+test_pipeline
+
+Test the index pipeline (bounded queue between
+source connectors and the single index writer,
+batched commits, checkpoints, several sources at
+once) against a fake search index, and bulk
+indexing into a real (empty) search index.
+
+To run, use pytest:
+
+    $ pytest
+    $ python -m unittest -q test_pipeline.PipelineTest
+    $ python -m unittest -q test_pipeline.BulkIndexTest
+"""
+
+
+class FakeSearch(object):
+    """
+    Fake Search object, recording the
+    batches committed to the index.
+    """
+    def __init__(self, fail_on=None):
+        self.commits = []
+        self.fail_on = fail_on
+
+    def commit_records(self, records, drop_ids, replace=True):
+        if self.fail_on is not None and len(self.commits) == self.fail_on:
+            raise IOError("disk full")
+        self.commits.append(([r['id'] for r in records], list(drop_ids)))
+
+
+def make_records(n, log=None):
+    for i in range(n):
+        if log is not None:
+            log.append(i)
+        yield {'id' : str(i)}
+
+
+class PipelineTest(unittest.TestCase):
+    """
+    Test IndexPipeline.
+    """
+    def test_batches(self):
+        """Records and drops should be committed in batches, checkpoints after their batch
+        """
+        search = FakeSearch()
+        seen = []
+
+        def items():
+            yield {'id' : 'a'}
+            yield Drop('x')
+            yield Checkpoint(lambda: seen.append(len(search.commits)))
+            yield {'id' : 'b'}
+            yield {'id' : 'c'}
+            yield Checkpoint(lambda: seen.append(len(search.commits)))
+
+        pipeline = IndexPipeline(search, batch_size=2)
+        pipeline.run(Connector('test', items()))
+
+        self.assertEqual(search.commits, [(['a'], ['x']), (['b', 'c'], [])])
+        self.assertEqual(seen, [1, 2])
+        self.assertEqual((pipeline.count, pipeline.dropped, pipeline.commits), (3, 1, 2))
+
+    def test_backpressure(self):
+        """The source should not get more than the queue size ahead of the writer
+        """
+        produced = []
+        ahead = []
+
+        class SlowSearch(FakeSearch):
+            def commit_records(self, records, drop_ids, replace=True):
+                # Give the producer time to fill the queue
+                threading.Event().wait(0.05)
+                ahead.append(len(produced) - sum(len(c[0]) for c in self.commits))
+                FakeSearch.commit_records(self, records, drop_ids, replace)
+
+        search = SlowSearch()
+        pipeline = IndexPipeline(search, batch_size=1, queue_size=3)
+        pipeline.run(Connector('test', make_records(20, produced)))
+
+        self.assertEqual(pipeline.count, 20)
+        # One record being committed, up to three in
+        # the queue, and one waiting to be put in it
+        self.assertLessEqual(max(ahead), 5)
+
+    def test_source_error(self):
+        """Records yielded before a source fails should be committed, later checkpoints skipped
+        """
+        search = FakeSearch()
+        seen = []
+
+        def items():
+            yield {'id' : 'a'}
+            raise ValueError("listing failed")
+            yield Checkpoint(lambda: seen.append(True))
+
+        pipeline = IndexPipeline(search, batch_size=10)
+        with self.assertRaises(ValueError):
+            pipeline.run(Connector('test', items()))
+        self.assertEqual(search.commits, [(['a'], [])])
+        self.assertEqual(seen, [])
+
+    def test_writer_error(self):
+        """A failed commit should stop the source
+        """
+        produced = []
+        search = FakeSearch(fail_on=1)
+        pipeline = IndexPipeline(search, batch_size=1, queue_size=1)
+        with self.assertRaises(IOError):
+            pipeline.run(Connector('test', make_records(1000, produced)))
+        self.assertEqual(len(search.commits), 1)
+        self.assertLess(len(produced), 10)
+
+    def test_cancel(self):
+        """A cancelled run should commit what it has and stop the source
+        """
+        search = FakeSearch()
+        cancel = threading.Event()
+        produced = []
+
+        def items():
+            for record in make_records(1000, produced):
+                if len(produced) == 3:
+                    cancel.set()
+                yield record
+
+        pipeline = IndexPipeline(search, batch_size=100, queue_size=1, cancel=cancel)
+        with self.assertRaises(IndexCancelled):
+            pipeline.run(Connector('test', items()))
+        self.assertEqual(len(search.commits), 1)
+        self.assertLess(len(produced), 10)
+
+    def test_run_all(self):
+        """Several connectors should run at once through one writer, a failing one not stopping the others
+        """
+        search = FakeSearch()
+        started = threading.Barrier(2, timeout=5)
+        done = []
+
+        def items(prefix, n):
+            # Both sources must be running
+            # before either yields anything
+            started.wait()
+            for i in range(n):
+                yield {'id' : '%s%d'%(prefix, i)}
+
+        def broken():
+            yield {'id' : 'z'}
+            raise ValueError("listing failed")
+
+        a = Connector('a', items('a', 5), batch_size=2, done=done.append)
+        b = Connector('b', items('b', 3), done=done.append)
+        c = Connector('c', broken(), done=done.append)
+        pipeline = IndexPipeline(search, batch_size=100)
+        pipeline.run_all([a, b, c])
+
+        ids = sorted(i for records, drops in search.commits for i in records)
+        self.assertEqual(ids, ['a0', 'a1', 'a2', 'a3', 'a4', 'b0', 'b1', 'b2', 'z'])
+        self.assertEqual((a.count, b.count, c.count), (5, 3, 1))
+        self.assertIsInstance(c.error, ValueError)
+        self.assertEqual(sorted(x.name for x in done), ['a', 'b'])
+        self.assertIsNotNone(b.elapsed)
+        # Connector a commits at least every two records
+        self.assertGreaterEqual(pipeline.commits, 3)
+
+    def test_iter_completed(self):
+        """Only max_pending calls should be submitted ahead of the consumer
+        """
+        submitted = []
+
+        def work(i):
+            submitted.append(i)
+            return i*i
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            results = []
+            for args, future in iter_completed(executor, work, [(i,) for i in range(10)], 3):
+                self.assertLessEqual(len(submitted) - len(results), 3)
+                results.append(future.result())
+
+        self.assertEqual(sorted(results), [i*i for i in range(10)])
+
+
+class BulkIndexTest(unittest.TestCase):
+    """
+    Test bulk indexing of an empty search index.
+    """
+    def setUp(self):
+        self.index_dir = tempfile.mkdtemp()
+        self.search = Search(os.path.join(self.index_dir, 'search_index'))
+        self.options = []
+        self.replace = []
+        commit_records = self.search.commit_records
+        def record_options(records, drop_ids=frozenset(), replace=True, **writer_options):
+            self.options.append(writer_options)
+            self.replace.append(replace)
+            commit_records(records, drop_ids, replace, **writer_options)
+        self.search.commit_records = record_options
+
+    def tearDown(self):
+        shutil.rmtree(self.index_dir)
+
+    def records(self, n, text):
+        for i in range(n):
+            yield dict(id='doc%d'%(i), kind='gdoc', title='Doc %d'%(i), content='%s number %d'%(text, i))
+
+    def test_bulk_then_incremental(self):
+        """An empty index should be written by several (spawned) processes, later updates by a plain writer
+        """
+        config = dict(INDEX_BULK_PROCS=2, INDEX_BULK_LIMITMB=32, INDEX_BULK_BATCH_SIZE=20, INDEX_BATCH_SIZE=5)
+        self.search.run_pipeline(Connector('test', self.records(50, 'running engines')), config)
+        self.assertEqual(self.search.ix.doc_count(), 50)
+        self.assertEqual(len(self.options), 3)
+        self.assertEqual(self.options[0], dict(procs=2, limitmb=32, multisegment=True))
+        # Nothing to replace in an empty index
+        self.assertEqual(self.replace, [False]*3)
+
+        # The segments of the writer processes
+        # are merged at the end of the bulk run
+        self.assertEqual(len(self.search.ix._segments()), 1)
+
+        # Not empty any more: replace some documents
+        self.options = []
+        self.search.run_pipeline(Connector('test', self.records(10, 'changed')), config)
+        self.assertEqual(self.options, [{}, {}])
+        self.assertEqual(self.replace, [False]*3 + [True]*2)
+        with self.search.ix.searcher() as s:
+            self.assertEqual(s.document(id='doc3')['content'], 'changed number 3')
+            self.assertEqual(s.document(id='doc30')['content'], 'running engines number 30')
+            self.assertEqual(s.doc_count(), 50)
+
+    def test_bulk_writer_spawns(self):
+        """The writer processes of bulk indexing should be spawned, not forked
+        """
+        writer = open_writer(self.search.ix)
+        self.assertNotIsInstance(writer, BulkWriter)
+        writer.cancel()
+
+        writer = open_writer(self.search.ix, procs=2, limitmb=32, batchsize=1)
+        self.assertIsInstance(writer, BulkWriter)
+        for record in self.records(4, 'spawned'):
+            writer.add_document(**record)
+        writer.commit()
+        self.assertEqual(len(writer.tasks), 2)
+        self.assertEqual([t._start_method for t in writer.tasks], ['spawn', 'spawn'])
+        self.assertEqual(self.search.ix.doc_count(), 4)
@@ -0,0 +1,103 @@
+import time
+import threading
+import unittest
+
+from centillion.search.rate_limit import RateLimiter
+
+
+"""
+test_rate_limit
+
+Test the API rate limit budget used to pace
+Github API requests.
+
+To run, use pytest:
+
+    $ pytest
+    $ python -m unittest -q test_rate_limit.RateLimiterTest
+"""
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, headers):
+        self.status_code = status_code
+        self.headers = headers
+
+
+class FakeGithub(object):
+    def __init__(self, remaining, limit, reset):
+        self.rate_limiting = (remaining, limit)
+        self.rate_limiting_resettime = reset
+
+
+class RateLimiterTest(unittest.TestCase):
+    """
+    Test RateLimiter.
+    """
+    def test_budget(self):
+        """Each request should take one request from the budget
+        """
+        limiter = RateLimiter('Test API', reserve=2)
+        limiter.wait()
+        self.assertIsNone(limiter.remaining)
+
+        reset = int(time.time()) + 3600
+        limiter.update_from_headers({'X-RateLimit-Remaining' : '10', 'X-RateLimit-Limit' : '5000', 'X-RateLimit-Reset' : str(reset)})
+        limiter.wait()
+        limiter.wait()
+        self.assertEqual(limiter.remaining, 8)
+        self.assertEqual(limiter.used, 3)
+
+        # A late response from the same window can't raise the budget
+        limiter.update_from_github(FakeGithub(9, 5000, reset))
+        self.assertEqual(limiter.remaining, 8)
+
+        # A response from an earlier window is ignored
+        limiter.update(100, 5000, reset - 3600)
+        self.assertEqual(limiter.remaining, 8)
+
+    def test_pause_and_resume(self):
+        """Requests should wait for the reset when the budget is used up
+        """
+        limiter = RateLimiter('Test API', reserve=1)
+        reset = int(time.time()) + 3600
+        limiter.update(1, 5000, reset)
+
+        thread = threading.Thread(target=limiter.wait)
+        thread.start()
+        thread.join(0.2)
+        self.assertTrue(thread.is_alive())
+
+        # The window resets
+        limiter.update(5000, 5000, reset + 3600)
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(limiter.remaining, 4999)
+
+    def test_expired_window(self):
+        """A used up budget from a window that is over should not block
+        """
+        limiter = RateLimiter('Test API')
+        limiter.update(0, 5000, int(time.time()) - 10)
+        limiter.wait()
+        self.assertIsNone(limiter.remaining)
+
+    def test_is_rate_limited(self):
+        """Only refusals with no requests left are rate limited
+        """
+        limiter = RateLimiter('Test API')
+        self.assertTrue(limiter.is_rate_limited(FakeResponse(403, {'X-RateLimit-Remaining' : '0'})))
+        self.assertFalse(limiter.is_rate_limited(FakeResponse(403, {'X-RateLimit-Remaining' : '12'})))
+        self.assertFalse(limiter.is_rate_limited(FakeResponse(200, {'X-RateLimit-Remaining' : '0'})))
+
+    def test_progress(self):
+        """Projected completion should wait for resets if the budget is short
+        """
+        limiter = RateLimiter('Test API')
+        now = time.time()
+        reset = int(now) + 1800
+        limiter.update(100, 5000, reset)
+        limiter.used = 200
+        msg = limiter.progress(2, 10, now - 10)
+        self.assertIn('2 of 10 done, 200 requests made', msg)
+        self.assertIn('projected completion at', msg)